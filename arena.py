@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+
+from math import sqrt
+from program import Program
+
+class SpatialHash():
+    """Uniform grid index used to find the robots close to each other
+       Items are stored in the cell containing their position, with a
+       cell size of at least the contact distance only the 3x3 cells
+       around a position have to be checked.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def cell(self, x, y):
+        """Return the key of the cell containing (x, y)"""
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def insert(self, item, x, y):
+        self.cells.setdefault(self.cell(x, y), []).append(item)
+
+    def query(self, x, y):
+        """Yield the items stored in the cells around (x, y)"""
+        cx, cy = self.cell(x, y)
+        for i in xrange(cx - 1, cx + 2):
+            for j in xrange(cy - 1, cy + 2):
+                for item in self.cells.get((i, j), ()):
+                    yield item
+
+
+class Arena:
+    """Simulation of several robots sharing the same world map
+       Each robot is a Program (own CPU, memory and modules), the CPUs
+       are interleaved by quantum of instructions so they all run at the
+       same simulated clock.
+       The CPUs are stepped here instead of by Program.run_cpu, which runs
+       a whole synchronisation at once : the timer and the exact IO mode
+       are not available in an arena. The rest of the update goes through
+       Program.synchronise, idle (not loaded or stuck) robots are skipped.
+    """
+    # Number of instructions a CPU runs before giving the hand to the next one
+    QUANTUM = 1250
+    # RAM of each robot, the MIPS binaries only use the low addresses
+    # (I/O bytes and data) : no need for the 1MB default with many robots
+    MEMORY_SIZE = 64 * 1024
+
+    def __init__(self, world_map, cpu_freq=Program.CPU_FREQ,
+                 synchronise_freq=Program.SYNCHRONISE_FREQ, quantum=QUANTUM,
+                 memory_size=MEMORY_SIZE, stuck_detection=False):
+        """memory_size : RAM of each robot in bytes, None for the engine default
+           stuck_detection : stop running the robots once they repeat
+                             themselves (see Program.stuck)
+        """
+        self.world_map = world_map
+        self.cpu_freq = cpu_freq
+        self.synchronise_freq = synchronise_freq
+        self.synchronise_step = 1.0 / synchronise_freq
+        self.cpu_sample = int(cpu_freq / synchronise_freq)
+        self.quantum = min(quantum, self.cpu_sample)
+        self.memory_size = memory_size
+        self.stuck_detection = stuck_detection
+        self.time = 0.0
+        self.programs = []
+        # Pairs of programs in contact during the last update
+        self.contacts = []
+        self.radius = 0
+        self.index = None
+
+    def add_robot(self, path, x=50, y=50, rotation=90):
+        """Create a new robot running the MIPS binary at path
+           Return the Program simulating it
+        """
+        program = Program(self.world_map, self.cpu_freq, self.synchronise_freq,
+                          stuck_detection=self.stuck_detection, memory_size=self.memory_size)
+        program.load(path)
+        robot = program.robot
+        robot.pos_x = x
+        robot.pos_y = y
+        robot.rotation = rotation
+        self.programs.append(program)
+        # Robots are considered as disks for the contacts
+        self.radius = max(self.radius, robot.half_width, robot.half_height)
+        self.index = SpatialHash(2 * self.radius)
+        return program
+
+    def is_idle(self):
+        """Check if update has nothing to run"""
+        return all(p.is_idle() for p in self.programs)
+
+    def update(self):
+        """Run a synchronisation step for all the robots"""
+        programs = [p for p in self.programs if not p.is_idle()]
+        cpus = [p.cpu for p in programs]
+        remaining = self.cpu_sample
+        while remaining > 0:
+            quantum = min(self.quantum, remaining)
+            for cpu in cpus:
+                cpu.step(quantum)
+            remaining -= quantum
+        for p in programs:
+            p.synchronise()
+        self.time += self.synchronise_step
+        self.collide()
+
+    def collide(self):
+        """Separate the robots overlapping each other"""
+        self.contacts = []
+        if self.index is None:
+            return
+        index = self.index
+        index.clear()
+        for i, p in enumerate(self.programs):
+            index.insert(i, p.robot.pos_x, p.robot.pos_y)
+        distance_min = 2 * self.radius
+        for i, p in enumerate(self.programs):
+            a = p.robot
+            for j in index.query(a.pos_x, a.pos_y):
+                # Each pair is handled only once
+                if j <= i:
+                    continue
+                b = self.programs[j].robot
+                dx = b.pos_x - a.pos_x
+                dy = b.pos_y - a.pos_y
+                distance = sqrt(dx * dx + dy * dy)
+                if distance >= distance_min:
+                    continue
+                self.contacts.append((p, self.programs[j]))
+                # Move both robots away by half the overlap
+                if distance == 0:
+                    # Same position, push them along an arbitrary axis
+                    dx, dy = 1.0, 0.0
+                    push = distance_min / 2.0
+                else:
+                    push = (distance_min - distance) / (2 * distance)
+                a.pos_x -= dx * push
+                a.pos_y -= dy * push
+                b.pos_x += dx * push
+                b.pos_y += dy * push
+        # Pushed robots must stay inside the world
+        width = self.world_map.width()
+        height = self.world_map.height()
+        for p, q in self.contacts:
+            for r in (p.robot, q.robot):
+                r.pos_x = max(min(r.pos_x, width), 0)
+                r.pos_y = max(min(r.pos_y, height), 0)
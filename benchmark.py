@@ -3,12 +3,107 @@
 from emulator import Cpu, IMPLEMENTATION
 from datetime import datetime
 
+import os
 import sys
+import imp
+import shutil
+import tempfile
 import cProfile
+import subprocess
+from timeit import default_timer as clock
 
 DEFAULT_FREQUENCY = 12500000
+STARTUP_RUNS = 5
+LOAD_RUNS = 20
+
+def startup_time(command, env=None, runs=STARTUP_RUNS):
+    """Return the (first, best) wall time of running command runs times"""
+    times = []
+    for _ in xrange(runs):
+        tstart = datetime.now()
+        subprocess.check_call(command, env=env)
+        times.append((datetime.now() - tstart).total_seconds())
+    return times[0], min(times)
+
+def startup():
+    """Startup benchmark : `benchmark.py --startup`"""
+    print "\t*** STARTUP BENCHMARK ***"
+    commands = [("interpreter", [sys.executable, "-c", "pass"], None)]
+    for implementation in ("python", "flat", "cpp"):
+        env = dict(os.environ, TRIMPS_EMULATOR=implementation)
+        commands.append(("headless " + implementation,
+            [sys.executable, "-c", "import program"], env))
+    try:
+        imp.find_module("PyQt4")
+        commands.append(("gui", [sys.executable, "trimps.py", "--startup"], None))
+    except ImportError:
+        print "PyQt4 not found, skipping the gui"
+    for name, command, env in commands:
+        try:
+            first, best = startup_time(command, env)
+        except subprocess.CalledProcessError:
+            print "{:<20} failed".format(name)
+            continue
+        print "{:<20} first {:.3f}s best {:.3f}s".format(name, first, best)
+
+def replay(binary, recording):
+    """Replay benchmark : `benchmark.py --replay <binary> <recording>`
+       Each implementation runs the recorded I/O of a real run (see replay.py)
+    """
+    print "\t*** REPLAY BENCHMARK ***"
+    for implementation in ("python", "flat", "cpp"):
+        env = dict(os.environ, TRIMPS_EMULATOR=implementation)
+        if subprocess.call([sys.executable, "replay.py", binary, recording], env=env) != 0:
+            print "{} failed".format(implementation)
+
+def load_time(load, runs=LOAD_RUNS):
+    """Return the best wall time of load() over runs"""
+    times = []
+    for _ in xrange(runs):
+        tstart = clock()
+        load()
+        times.append(clock() - tstart)
+    return min(times)
+
+def load(binary):
+    """Load benchmark : `benchmark.py --load <binary>`
+       Load time of the binary without cache, with a cold cache (empty,
+       the entry is written) and with a warm one, for the engines caching
+       their decoded programs (see emulator/cache.py)
+    """
+    from emulator import ProgramCache, cpu, flatcpu, aot
+    print "\t*** LOAD BENCHMARK ***"
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ProgramCache(directory)
+        python_cpu = cpu.Cpu()
+        flat_cpu = flatcpu.Cpu()
+        engines = [("python", lambda cache: python_cpu.load(binary), False),
+                   ("flat", lambda cache: flat_cpu.load(binary, cache=cache), True),
+                   ("aot", lambda cache: aot.load(binary, cache=cache), True)]
+        for name, loader, cached in engines:
+            line = "{:<8} no cache {:8.3f}ms".format(name, load_time(lambda: loader(None)) * 1000)
+            if cached:
+                def cold():
+                    cache.clear()
+                    loader(cache)
+                line += " cold {:8.3f}ms warm {:8.3f}ms".format(load_time(cold) * 1000,
+                    load_time(lambda: loader(cache)) * 1000)
+            print line
+    finally:
+        shutil.rmtree(directory)
 
 if __name__ == '__main__':
+    if "--startup" in sys.argv:
+        startup()
+        sys.exit(0)
+    if "--replay" in sys.argv:
+        index = sys.argv.index("--replay")
+        replay(sys.argv[index + 1], sys.argv[index + 2])
+        sys.exit(0)
+    if "--load" in sys.argv:
+        load(sys.argv[sys.argv.index("--load") + 1])
+        sys.exit(0)
     count = DEFAULT_FREQUENCY
     datetime.now()
     cpu = Cpu()
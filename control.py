@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+
+"""Control server to drive a Program from another process
+
+Protocol (little endian) : each request is a frame made of a header
+(command byte, payload size as 32bits) followed by the payload.
+Each request gets a reply frame (status byte, payload size, payload)
+in the same order. Several requests can be sent without waiting the
+replies : they are all executed and their replies sent back at once.
+"""
+
+import os
+import sys
+import socket
+import struct
+import asyncore
+
+HEADER = struct.Struct("<BI")
+
+# Commands
+LOAD = 1        # payload : path of the binary
+STEP = 2        # payload : instructions count (CPU only, robot is not updated)
+RUN_UNTIL = 3   # payload : simulated time to reach (whole Program update),
+                # stops earlier if the Program is stuck (see Program.stuck)
+PEEK = 4        # payload : address, size
+POKE = 5        # payload : address, bytes to write
+REGS = 6        # reply : pc and the 32 registers
+POSE = 7        # reply : x, y, rotation of the robot
+STATE = 8       # reply : state block
+SCORE = 9       # reply : score block (server started with --score)
+
+# Reply status
+OK = 0
+ERROR = 1
+
+COUNT = struct.Struct("<Q")
+TIME = struct.Struct("<d")
+ADDRESS = struct.Struct("<I")
+RANGE = struct.Struct("<II")
+REGISTERS = struct.Struct("<33I")
+POSE_BLOCK = struct.Struct("<ddd")
+# Simulated time, pc, registers, x, y, rotation
+STATE_BLOCK = struct.Struct("<d33Iddd")
+# Line following score (see distancefield.LineScore.results)
+SCORE_KEYS = ("time", "mean_deviation", "max_deviation", "time_off_line", "laps")
+SCORE_BLOCK = struct.Struct("<5d")
+
+# cpu.step takes a C unsigned int with the C++ implementation
+STEP_CHUNK = 1 << 30
+
+class ControlError(Exception):
+    pass
+
+
+def frame(command, payload=""):
+    """Build a request (or reply) frame"""
+    return HEADER.pack(command, len(payload)) + payload
+
+
+class Controller():
+    """Execute the protocol commands on a Program"""
+    def __init__(self, program):
+        self.program = program
+        self.handlers = {
+            LOAD : self.load,
+            STEP : self.step,
+            RUN_UNTIL : self.run_until,
+            PEEK : self.peek,
+            POKE : self.poke,
+            REGS : self.regs,
+            POSE : self.pose,
+            STATE : self.state,
+            SCORE : self.score
+        }
+
+    def execute(self, command, payload):
+        """Run a command and return the reply frame"""
+        try:
+            handler = self.handlers[command]
+        except KeyError:
+            return frame(ERROR, "unknown command {}".format(command))
+        try:
+            return frame(OK, handler(payload))
+        except Exception as e:
+            return frame(ERROR, str(e))
+
+    def load(self, payload):
+        self.program.load(payload)
+        return ""
+
+    def step(self, payload):
+        count, = COUNT.unpack(payload)
+        cpu = self.program.cpu
+        if cpu.program_size == 0:
+            raise ControlError("No program loaded !")
+        while count > 0:
+            chunk = min(count, STEP_CHUNK)
+            cpu.step(chunk)
+            count -= chunk
+        self.program.state_changed()
+        return self.state("")
+
+    def run_until(self, payload):
+        time, = TIME.unpack(payload)
+        program = self.program
+        if program.cpu.program_size == 0:
+            raise ControlError("No program loaded !")
+        update = program.update
+        while program.time < time and program.stuck is None:
+            update()
+        return self.state("")
+
+    def peek(self, payload):
+        address, size = RANGE.unpack(payload)
+        memory = self.program.memory
+        return "".join(chr(memory[a]) for a in xrange(address, address + size))
+
+    def poke(self, payload):
+        address, = ADDRESS.unpack_from(payload)
+        memory = self.program.memory
+        for i, byte in enumerate(payload[ADDRESS.size:]):
+            memory[address + i] = ord(byte)
+        self.program.state_changed()
+        return ""
+
+    def _registers(self):
+        cpu = self.program.cpu
+        return [cpu.get_pc() & 0xFFFFFFFF] + [r & 0xFFFFFFFF for r in cpu.r]
+
+    def regs(self, payload):
+        return REGISTERS.pack(*self._registers())
+
+    def pose(self, payload):
+        robot = self.program.robot
+        return POSE_BLOCK.pack(robot.pos_x, robot.pos_y, robot.rotation)
+
+    def state(self, payload):
+        robot = self.program.robot
+        values = [self.program.time] + self._registers()
+        values += [robot.pos_x, robot.pos_y, robot.rotation]
+        return STATE_BLOCK.pack(*values)
+
+    def score(self, payload):
+        score = self.program.score
+        if score is None:
+            raise ControlError("The run is not scored")
+        results = score.results()
+        return SCORE_BLOCK.pack(*[results[key] for key in SCORE_KEYS])
+
+
+class ControlHandler(asyncore.dispatcher):
+    """Connection with a controller"""
+    def __init__(self, sock, controller):
+        asyncore.dispatcher.__init__(self, sock)
+        self.controller = controller
+        self.in_buffer = ""
+        self.out_buffer = ""
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        buf = self.in_buffer + data
+        offset = 0
+        replies = []
+        # Run every complete request received so far
+        while len(buf) - offset >= HEADER.size:
+            command, size = HEADER.unpack_from(buf, offset)
+            end = offset + HEADER.size + size
+            if len(buf) < end:
+                break
+            replies.append(self.controller.execute(command, buf[offset + HEADER.size:end]))
+            offset = end
+        self.in_buffer = buf[offset:]
+        if replies:
+            self.out_buffer += "".join(replies)
+            # Don't wait for the next loop iteration to answer
+            self.handle_write()
+
+    def writable(self):
+        return len(self.out_buffer) > 0
+
+    def handle_write(self):
+        sent = self.send(self.out_buffer)
+        self.out_buffer = self.out_buffer[sent:]
+
+    def handle_close(self):
+        self.close()
+
+
+class ControlServer(asyncore.dispatcher):
+    """Serve a Program on a Unix socket (address is a path)
+       or on TCP (address is a (host, port) tuple)
+    """
+    def __init__(self, program, address):
+        asyncore.dispatcher.__init__(self)
+        self.controller = Controller(program)
+        self.address = address
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(5)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock, _ = pair
+        if sock.family == socket.AF_INET:
+            # Replies are small, don't let Nagle delay them
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ControlHandler(sock, self.controller)
+
+    def serve_forever(self):
+        asyncore.loop()
+
+
+def unpack_state(payload):
+    """Convert a state block into a dict"""
+    values = STATE_BLOCK.unpack(payload)
+    return {
+        'time': values[0],
+        'pc': values[1],
+        'r': list(values[2:34]),
+        'pos_x': values[34],
+        'pos_y': values[35],
+        'rotation': values[36]
+    }
+
+
+class ControlClient():
+    """Blocking client of the ControlServer
+       request() sends several frames in a single round trip
+    """
+    def __init__(self, address):
+        if isinstance(address, basestring):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self.buffer = ""
+
+    def close(self):
+        self.sock.close()
+
+    def _read(self, size):
+        while len(self.buffer) < size:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ControlError("Connection closed by the server")
+            self.buffer += data
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def request(self, *frames):
+        """Send the frames and return the payloads of their replies"""
+        self.sock.sendall("".join(frames))
+        replies = []
+        for _ in frames:
+            status, size = HEADER.unpack(self._read(HEADER.size))
+            payload = self._read(size)
+            if status != OK:
+                raise ControlError(payload)
+            replies.append(payload)
+        return replies
+
+    def load(self, path):
+        self.request(frame(LOAD, path))
+
+    def step(self, count):
+        return unpack_state(self.request(frame(STEP, COUNT.pack(count)))[0])
+
+    def run_until(self, time):
+        return unpack_state(self.request(frame(RUN_UNTIL, TIME.pack(time)))[0])
+
+    def peek(self, address, size):
+        return self.request(frame(PEEK, RANGE.pack(address, size)))[0]
+
+    def poke(self, address, data):
+        self.request(frame(POKE, ADDRESS.pack(address) + data))
+
+    def regs(self):
+        """Return the pc and the list of registers"""
+        values = REGISTERS.unpack(self.request(frame(REGS))[0])
+        return values[0], list(values[1:])
+
+    def pose(self):
+        return POSE_BLOCK.unpack(self.request(frame(POSE))[0])
+
+    def state(self):
+        return unpack_state(self.request(frame(STATE))[0])
+
+    def score(self):
+        """Return the line following score as a dict"""
+        return dict(zip(SCORE_KEYS, SCORE_BLOCK.unpack(self.request(frame(SCORE))[0])))
+
+
+if __name__ == '__main__':
+    # control.py <world (image, .ttm or .vw)> <unix socket path | port> [--score]
+    from program import Program, load_world
+    from emulator import ProgramCache
+    world_map = load_world(sys.argv[1])
+    if sys.argv[2].isdigit():
+        address = ("127.0.0.1", int(sys.argv[2]))
+    else:
+        address = sys.argv[2]
+    distance_field = None
+    if "--score" in sys.argv[3:]:
+        from distancefield import DistanceField
+        distance_field = DistanceField(world_map)
+    try:
+        cache = ProgramCache()
+    except (OSError, IOError):
+        # Cache directory can't be created (read-only home...), run without it
+        cache = None
+    # Headless runs don't need to go on once the simulation is stuck
+    server = ControlServer(Program(world_map, stuck_detection=True, cache=cache,
+                                   distance_field=distance_field), address)
+    server.serve_forever()
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+
+"""Distance to the line over the whole world map and line following scores
+
+The distance field is a truncated Euclidean distance transform of the line
+pixels (every non white pixel), computed with numpy. When a stroke is drawn
+only the area it can affect is recomputed.
+"""
+
+from math import atan2, pi
+import numpy
+
+from vectorworld import WHITE
+
+# Distances are exact up to MAX_DISTANCE pixels, larger ones are clamped
+MAX_DISTANCE = 64
+
+
+def line_mask(world_map, left, top, width, height):
+    """Boolean array of the given area, True on the line pixels"""
+    if hasattr(world_map, 'pixels'):
+        # numpy view of the pixels (uiworld.ImageView)
+        return world_map.pixels[top:top + height, left:left + width] != WHITE
+    if hasattr(world_map, 'constBits'):
+        # ARGB32 QImage, read all the pixels at once
+        data = numpy.frombuffer(world_map.constBits().asstring(world_map.byteCount()),
+                                dtype=numpy.uint32)
+        pixels = data.reshape(world_map.height(), world_map.bytesPerLine() // 4)
+        return pixels[top:top + height, left:left + width] != WHITE
+    mask = numpy.zeros((height, width), dtype=bool)
+    for y in xrange(height):
+        for x in xrange(width):
+            mask[y, x] = world_map.pixel(left + x, top + y) != WHITE
+    return mask
+
+
+def distance_transform(mask, max_distance=MAX_DISTANCE):
+    """Distance from each pixel to the closest True pixel of mask
+       The result is exact up to max_distance and clamped to it
+    """
+    height, width = mask.shape
+    cap = numpy.float32(max_distance + 1)
+    # Vertical distance to the closest line pixel of the same column
+    vertical = numpy.empty((height, width), dtype=numpy.float32)
+    previous = numpy.full(width, cap, dtype=numpy.float32)
+    for y in xrange(height):
+        previous = numpy.where(mask[y], 0, numpy.minimum(previous + 1, cap))
+        vertical[y] = previous
+    for y in xrange(height - 2, -1, -1):
+        numpy.minimum(vertical[y], vertical[y + 1] + 1, out=vertical[y])
+    # Then the closest one among the columns at most max_distance away
+    vertical *= vertical
+    squared = vertical.copy()
+    for dx in xrange(1, min(max_distance, width - 1) + 1):
+        offset = dx * dx
+        numpy.minimum(squared[:, dx:], vertical[:, :-dx] + offset, out=squared[:, dx:])
+        numpy.minimum(squared[:, :-dx], vertical[:, dx:] + offset, out=squared[:, :-dx])
+    return numpy.minimum(numpy.sqrt(squared), max_distance)
+
+
+class DistanceField():
+    """Distance to the line of every pixel of a world map
+       update() must be called when the world map changes
+    """
+    def __init__(self, world_map, max_distance=MAX_DISTANCE):
+        self.world_map = world_map
+        self.max_distance = max_distance
+        self.rebuild()
+
+    def rebuild(self):
+        """Compute the whole field"""
+        width = self.world_map.width()
+        height = self.world_map.height()
+        self.mask = line_mask(self.world_map, 0, 0, width, height)
+        self.field = distance_transform(self.mask, self.max_distance)
+        ys, xs = numpy.nonzero(self.mask)
+        self.line_count = len(xs)
+        self.line_sum = (float(xs.sum()), float(ys.sum()))
+        self._update_centroid()
+
+    def _update_centroid(self):
+        if self.line_count:
+            self.centroid = (self.line_sum[0] / self.line_count,
+                             self.line_sum[1] / self.line_count)
+        else:
+            self.centroid = None
+
+    def _clip(self, left, top, right, bottom):
+        height, width = self.field.shape
+        return max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+
+    def update(self, rect=None):
+        """Recompute the field after the world map changed
+           rect : (left, top, right, bottom) of the changed area (right and
+                  bottom excluded), None if the whole map may have changed
+        """
+        if rect is None:
+            return self.rebuild()
+        r = self.max_distance
+        left, top, right, bottom = self._clip(*rect)
+        if left >= right or top >= bottom:
+            return
+        # Update the line pixels and their centroid
+        old = self.mask[top:bottom, left:right]
+        ys, xs = numpy.nonzero(old)
+        count = -len(xs)
+        sum_x = -float(xs.sum())
+        sum_y = -float(ys.sum())
+        new = line_mask(self.world_map, left, top, right - left, bottom - top)
+        self.mask[top:bottom, left:right] = new
+        ys, xs = numpy.nonzero(new)
+        count += len(xs)
+        sum_x += float(xs.sum())
+        sum_y += float(ys.sum())
+        self.line_count += count
+        self.line_sum = (self.line_sum[0] + sum_x + count * left,
+                         self.line_sum[1] + sum_y + count * top)
+        self._update_centroid()
+        # Only the distances up to max_distance around the change can move,
+        # they depend on the line pixels up to max_distance further
+        inner = self._clip(left - r, top - r, right + r, bottom + r)
+        outer = self._clip(left - 2 * r, top - 2 * r, right + 2 * r, bottom + 2 * r)
+        field = distance_transform(self.mask[outer[1]:outer[3], outer[0]:outer[2]], r)
+        self.field[inner[1]:inner[3], inner[0]:inner[2]] = \
+            field[inner[1] - outer[1]:inner[3] - outer[1], inner[0] - outer[0]:inner[2] - outer[0]]
+
+    def distance(self, x, y):
+        """Distance from (x, y) to the line, max_distance outside of the map"""
+        x = int(x)
+        y = int(y)
+        height, width = self.field.shape
+        if 0 <= x < width and 0 <= y < height:
+            return float(self.field[y, x])
+        return self.max_distance
+
+
+class LineScore():
+    """Robot module scoring how well the robot follows the line
+       Each update is O(1) : a lookup in the distance field and a few
+       accumulators. Lap progress is the angle swept around the centroid
+       of the line (positive when turning clockwise on screen).
+    """
+    # Distance (pixels) from which the robot is considered off the line
+    OFF_LINE = 5
+
+    def __init__(self, field, robot, off_line=OFF_LINE):
+        self.field = field
+        self.robot = robot
+        self.off_line = off_line
+        self.reset()
+
+    def reset(self):
+        self.time = 0.0
+        self.deviation_sum = 0.0
+        self.max_deviation = 0.0
+        self.time_off_line = 0.0
+        # Angle swept around the line centroid
+        self.progress = 0.0
+        self.angle = None
+
+    def update(self, dt):
+        x = self.robot.pos_x
+        y = self.robot.pos_y
+        distance = self.field.distance(x, y)
+        self.time += dt
+        self.deviation_sum += distance * dt
+        if distance > self.max_deviation:
+            self.max_deviation = distance
+        if distance > self.off_line:
+            self.time_off_line += dt
+        center = self.field.centroid
+        if center is not None:
+            angle = atan2(y - center[1], x - center[0])
+            if self.angle is not None:
+                delta = angle - self.angle
+                if delta > pi:
+                    delta -= 2 * pi
+                elif delta < -pi:
+                    delta += 2 * pi
+                self.progress += delta
+            self.angle = angle
+
+    def mean_deviation(self):
+        if self.time == 0:
+            return 0.0
+        return self.deviation_sum / self.time
+
+    def laps(self):
+        return self.progress / (2 * pi)
+
+    def results(self):
+        return {
+            "time": self.time,
+            "mean_deviation": self.mean_deviation(),
+            "max_deviation": self.max_deviation,
+            "time_off_line": self.time_off_line,
+            "laps": self.laps()
+        }
@@ -1,12 +1,35 @@
 #! /usr/bin/env python
 
-# Check if C++ version is compiled
-try:
+import os
+import imp
+
+# TRIMPS_EMULATOR environment variable selects the implementation :
+# "cpp", "python" or "flat" (python, array based)
+# Only the selected one is imported
+IMPLEMENTATION = os.environ.get("TRIMPS_EMULATOR")
+
+if IMPLEMENTATION is None:
+	# Use the C++ version if it is compiled, without trying to import it
+	try:
+		imp.find_module("_cpp_emulator", __path__)
+		IMPLEMENTATION = "cpp"
+	except ImportError:
+		IMPLEMENTATION = "python"
+
+if IMPLEMENTATION == "cpp":
 	from cpp_emulator import Cpu, Memory
-	IMPLEMENTATION="cpp"
 
-# Otherwise, load the pure python version
-except ImportError:
+elif IMPLEMENTATION == "python":
 	from cpu import Cpu
 	from memory import Memory
-	IMPLEMENTATION="python"
+
+elif IMPLEMENTATION == "flat":
+	from flatcpu import Cpu
+	from memory import Memory
+
+else:
+	raise ImportError("Unknown emulator implementation : {}".format(IMPLEMENTATION))
+
+# Cpu.run_until stop reasons, same values for all the implementations
+from cpu import STOP_MAX_STEPS, STOP_PC, STOP_MEM_WRITE, STOP_REG_EQUALS
+from cache import ProgramCache
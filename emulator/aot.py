@@ -0,0 +1,263 @@
+#! /usr/bin/env python
+
+"""Ahead-of-time translation of a MIPS binary into a python module
+
+Usage : aot.py <binary> <output.py> [program_start]
+
+The ISA only has direct jumps (J and BEQ), so every block of the program
+and all its successors are known at translation time. The whole program
+becomes a single run() function : registers are local variables and a
+dispatch tree on the fake_pc selects the block to execute. A block runs
+at once when the instruction budget allows it, otherwise instructions
+are executed one by one so step(count) stays exact.
+
+The generated module provides a Cpu class usable in place of emulator.Cpu
+(see Program's cpu_class), working on any Memory.
+"""
+
+import sys
+import struct
+
+from cpu import decode, signExtImmed, read_binary, VERSION, DEFAULT_PROGRAM_START
+from cache import cache_tag
+
+CACHE_TAG = cache_tag("aot", VERSION)
+
+MASK = "0xFFFFFFFF"
+
+# R instructions funct -> expression template
+FUNCTS = {
+    0x24 : "{rs} & {rt}",                   # AND
+    0x25 : "{rs} | {rt}",                   # OR
+    0x27 : "{rs} ^ {rt}",                   # XOR
+    0x20 : "({rs} + {rt}) & " + MASK,       # ADD
+    0x22 : "({rs} - {rt}) & " + MASK,       # SUB
+    0x00 : "({rt} << {shamt}) & " + MASK,   # SLL
+    0x02 : "({rt} >> {shamt}) & " + MASK,   # SRL
+    0x2a : "{rs} < {rt}"                    # SLT
+}
+
+OP_BEQ = 0x04
+OP_LW = 0x23
+OP_SW = 0x2b
+OP_ANDI = 0x0c
+OP_ORI = 0x0d
+OP_ADDI = 0x08
+OP_J = 0x02
+
+MODULE_TEMPLATE = '''\
+#! /usr/bin/env python
+# Generated by emulator/aot.py from {source}, do not edit
+
+PROGRAM_START = {program_start:#x}
+PROGRAM_SIZE = {size}
+PROGRAM = {words!r}
+
+{run}
+
+class Cpu():
+    """MIPS-1 CPU running the translated program"""
+
+    class CpuError(Exception):
+        pass
+
+    def __init__(self, memory=None):
+        if memory is None:
+            from emulator import Memory
+            memory = Memory()
+        self.memory = memory
+        self.program_start = PROGRAM_START
+        self.program_size = PROGRAM_SIZE
+        self.program = PROGRAM
+        self.r = [0x00000000 for _ in xrange(32)]
+        self.fake_pc = 0
+
+    def load(self, path, program_start=PROGRAM_START):
+        raise self.CpuError("The program is translated in the Cpu, it cannot be loaded")
+
+    def set_pc(self, address):
+        self.fake_pc = (address - self.program_start) >> 2
+
+    def get_pc(self):
+        return (self.fake_pc << 2) + self.program_start
+
+    def step(self, count=1):
+        try:
+            self.fake_pc = run(self.r, self.memory, self.fake_pc, count)
+        except IndexError as e:
+            self.fake_pc = e.args[0]
+            raise
+'''
+
+
+def reg(i):
+    """Name of the local variable holding register i"""
+    if i == 0:
+        return "0"
+    return "r{}".format(i)
+
+
+class Translator():
+    """Translate a list of raw instructions into python source"""
+    def __init__(self, words):
+        self.words = words
+        self.size = len(words)
+        self.fields = [decode(w) for w in words]
+        for i, f in enumerate(self.fields):
+            opcode = f[0]
+            if opcode != 0 and opcode not in (OP_BEQ, OP_LW, OP_SW, OP_ANDI, OP_ORI, OP_ADDI, OP_J):
+                raise TypeError('bad opcode ({}) at {}'.format(hex(opcode), i))
+        self.leaders = self._find_leaders()
+
+    def _is_branch(self, i):
+        return self.fields[i][0] in (OP_BEQ, OP_J)
+
+    def _target(self, i):
+        """Target of the branch/jump at i"""
+        opcode, _, _, _, _, _, immed, addr = self.fields[i]
+        if opcode == OP_BEQ:
+            return i + 1 + signExtImmed(immed)
+        return addr
+
+    def _find_leaders(self):
+        leaders = set([0])
+        for i in xrange(self.size):
+            if self._is_branch(i):
+                leaders.add(i + 1)
+                leaders.add(self._target(i))
+        return leaders
+
+    def block_end(self, i):
+        """Index of the last instruction of the block going on from i"""
+        while not self._is_branch(i) and i + 1 < self.size and i + 1 not in self.leaders:
+            i += 1
+        return i
+
+    def instruction(self, i, indent):
+        """Python lines executing instruction i (pc is only set by branches)"""
+        opcode, rs, rt, rd, shamt, funct, immed, addr = self.fields[i]
+        simm = signExtImmed(immed)
+        pad = " " * indent
+        if opcode == 0:
+            if rd == 0 or funct not in FUNCTS:
+                return []
+            expr = FUNCTS[funct].format(rs=reg(rs), rt=reg(rt), shamt=shamt)
+            return [pad + "{} = {}".format(reg(rd), expr)]
+        elif opcode == OP_BEQ:
+            target = i + 1 + simm
+            if rs == rt:
+                return [pad + "pc = {}".format(target)]
+            return [pad + "if {} == {}:".format(reg(rs), reg(rt)),
+                    pad + "    pc = {}".format(target),
+                    pad + "else:",
+                    pad + "    pc = {}".format(i + 1)]
+        elif opcode == OP_J:
+            return [pad + "pc = {}".format(addr)]
+        elif opcode == OP_LW:
+            if rt == 0:
+                return []
+            return [pad + "{} = get_uword(({} + {}) & 0xFFFFFFFF)".format(reg(rt), reg(rs), simm)]
+        elif opcode == OP_SW:
+            return [pad + "set_word(({} + {}) & 0xFFFFFFFF, {})".format(reg(rs), simm, reg(rt))]
+        elif rt == 0:
+            return []
+        elif opcode == OP_ANDI:
+            return [pad + "{} = {} & {:#x}".format(reg(rt), reg(rs), immed)]
+        elif opcode == OP_ORI:
+            return [pad + "{} = {} | {:#x}".format(reg(rt), reg(rs), immed)]
+        else:
+            return [pad + "{} = ({} + {}) & {}".format(reg(rt), reg(rs), simm, MASK)]
+
+    def _sequence(self, start, end, indent):
+        """Lines running instructions start to end (included) and setting pc"""
+        lines = []
+        for i in xrange(start, end + 1):
+            lines += self.instruction(i, indent)
+        if not self._is_branch(end):
+            lines.append(" " * indent + "pc = {}".format(end + 1))
+        return lines
+
+    def _entry(self, i, indent):
+        """Lines executed when pc == i"""
+        pad = " " * indent
+        end = self.block_end(i)
+        count = end - i + 1
+        if count == 1:
+            return self._sequence(i, i, indent) + [pad + "budget -= 1"]
+        lines = [pad + "if budget >= {}:".format(count)]
+        lines += self._sequence(i, end, indent + 4)
+        lines.append(pad + "    budget -= {}".format(count))
+        lines.append(pad + "else:")
+        lines += self._sequence(i, i, indent + 4)
+        lines.append(pad + "    budget -= 1")
+        return lines
+
+    def _dispatch(self, lo, hi, indent):
+        """Binary search tree on pc, for lo <= pc < hi"""
+        if hi - lo == 1:
+            return self._entry(lo, indent)
+        pad = " " * indent
+        mid = (lo + hi) // 2
+        return ([pad + "if pc < {}:".format(mid)] +
+                self._dispatch(lo, mid, indent + 4) +
+                [pad + "else:"] +
+                self._dispatch(mid, hi, indent + 4))
+
+    def run_function(self):
+        """Source of run(r, memory, pc, budget), returning the new pc"""
+        registers = ", ".join(reg(i) for i in xrange(1, 32))
+        lines = ["def run(r, memory, pc, budget):",
+                 "    get_uword = memory.get_uword",
+                 "    set_word = memory.set_word",
+                 "    {} = r[1:32]".format(registers),
+                 "    try:",
+                 "        while budget > 0:",
+                 "            if not 0 <= pc < {}:".format(self.size),
+                 "                raise IndexError(pc)"]
+        lines += self._dispatch(0, self.size, 12)
+        lines += ["    finally:",
+                  "        r[1:32] = [{}]".format(registers),
+                  "    return pc"]
+        return "\n".join(lines)
+
+
+def translate(words, program_start=DEFAULT_PROGRAM_START, source="<memory>"):
+    """Return the source of the python module running words"""
+    if not words:
+        raise ValueError("Empty program")
+    return MODULE_TEMPLATE.format(source=source, program_start=program_start,
+        size=len(words), words=tuple(words), run=Translator(words).run_function())
+
+
+def read_words(path):
+    data = read_binary(path)
+    return struct.unpack("{}i".format(len(data) / 4), data), data
+
+
+def load(path, program_start=DEFAULT_PROGRAM_START, cache=None):
+    """Translate the binary at path and return the resulting module namespace
+       (a dict with the Cpu class)
+       cache : ProgramCache keeping the compiled code object between runs
+    """
+    words, data = read_words(path)
+    code = None
+    if cache is not None:
+        key = cache.key(data, program_start, CACHE_TAG)
+        code = cache.get(key)
+    if code is None:
+        code = compile(translate(words, program_start, path), path, "exec")
+        if cache is not None:
+            cache.put(key, code)
+    namespace = {'__name__': 'aot_program'}
+    exec code in namespace
+    return namespace
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        start = int(sys.argv[3], 0)
+    else:
+        start = DEFAULT_PROGRAM_START
+    words, _ = read_words(sys.argv[1])
+    with open(sys.argv[2], "w") as fd:
+        fd.write(translate(words, start, sys.argv[1]))
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import imp
+import mmap
+import marshal
+import struct
+import hashlib
+import tempfile
+import zlib
+import platform
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "trimps")
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Entry header : magic, format version, payload size, payload crc32
+ENTRY_MAGIC = "TPC1"
+ENTRY_HEADER = struct.Struct("<4sIII")
+ENTRY_FORMAT = 1
+ENTRY_SUFFIX = ".entry"
+
+def cache_tag(engine, version):
+    """Return the tag of the payloads produced by an emulator engine
+       Marshal formats and code objects depend on the interpreter, so it
+       is part of the tag : interpreters sharing a cache directory never
+       load each other's entries
+    """
+    return "{}-{}-{}-{}-{}".format(engine, version, platform.python_implementation(),
+        ".".join(str(v) for v in sys.version_info), imp.get_magic().encode("hex"))
+
+class ProgramCache():
+    """Persistent cache of decoded programs
+       Entries are keyed by a hash of the binary, the load address and
+       a tag identifying the emulator which produced them (see cache_tag).
+       The payload is anything marshal can serialize (code objects included).
+       Entries are checked and read through mmap, the least recently used
+       ones are removed when the cache gets bigger than max_size.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, data, program_start, tag):
+        """Compute the key of a binary loaded at program_start"""
+        h = hashlib.sha1()
+        h.update(tag)
+        h.update(struct.pack("<I", program_start))
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Return the payload stored for key, None if missing or invalid"""
+        path = self.path(key)
+        try:
+            fd = open(path, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                # Empty file
+                mm = None
+                payload = None
+            if mm is not None:
+                try:
+                    payload = self._read(mm)
+                finally:
+                    mm.close()
+        finally:
+            fd.close()
+        if payload is None:
+            # Corrupted entry, get rid of it
+            self._remove(path)
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return payload
+
+    def _read(self, mm):
+        """Validate and decode an entry, return None if it is invalid"""
+        if len(mm) < ENTRY_HEADER.size:
+            return None
+        magic, fmt, size, crc = ENTRY_HEADER.unpack_from(mm, 0)
+        if magic != ENTRY_MAGIC or fmt != ENTRY_FORMAT:
+            return None
+        if len(mm) != ENTRY_HEADER.size + size:
+            return None
+        data = mm[ENTRY_HEADER.size:]
+        if zlib.crc32(data) & 0xFFFFFFFF != crc:
+            return None
+        try:
+            return marshal.loads(data)
+        except (ValueError, EOFError, TypeError):
+            return None
+
+    def put(self, key, payload):
+        """Store payload for key, then enforce the cache size"""
+        data = marshal.dumps(payload)
+        header = ENTRY_HEADER.pack(ENTRY_MAGIC, ENTRY_FORMAT, len(data),
+                                   zlib.crc32(data) & 0xFFFFFFFF)
+        # Write in a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(data)
+        os.rename(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits max_size"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove all the entries"""
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                self._remove(os.path.join(self.directory, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
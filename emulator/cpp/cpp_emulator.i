@@ -2,11 +2,14 @@
 
 %include "carrays.i"
 %include "std_vector.i"
+%include "std_string.i"
+%include "std_pair.i"
 %include "cdata.i"
 %include "exception.i"
 
 namespace std {
    %template(vectorui) vector<unsigned int>;
+   %template(pairiui) pair<int, unsigned int>;
 };
 
 %exception {
@@ -22,5 +25,37 @@ namespace std {
 #include "cpu.hpp"
 %}
 
+// run_until is wrapped to take the same keyword arguments as the python Cpu
+%rename(_run_until) Cpu::run_until;
+%rename(_step_until_io) Cpu::step_until_io;
+%rename(_swap_program) Cpu::swap_program;
+%extend Cpu {
+%pythoncode %{
+    def run_until(self, max_steps, pc=None, mem_write_range=None, reg_equals=None):
+        """Run the CPU until one of the conditions is met after an instruction
+           Return (stop reason, number of instructions executed)
+        """
+        if pc is None:
+            pc = -1
+        write_start, write_end = (-1, -1) if mem_write_range is None else mem_write_range
+        reg, value = (-1, 0) if reg_equals is None else reg_equals
+        return self._run_until(max_steps, pc, write_start, write_end, reg, value & 0xFFFFFFFF)
+
+    def step_until_io(self, count, io_range, max_events=1):
+        """Run up to count instructions, recording the stores in io_range
+           Return (number of instructions executed, events), an event being
+           (instruction offset, address, value written)
+        """
+        result = self._step_until_io(count, io_range[0], io_range[1], max_events)
+        return result[0], [result[i:i + 3] for i in xrange(1, len(result), 3)]
+
+    def swap_program(self, path, pc=None):
+        """Replace the program without resetting the CPU : registers and
+           memory are kept, and so is the PC unless pc is given
+        """
+        self._swap_program(path, -1 if pc is None else pc)
+%}
+}
+
 %include "memory.hpp"
 %include "cpu.hpp"
@@ -1,5 +1,6 @@
 #include <fstream>
 #include <iostream>
+#include <algorithm>
 
 #include "cpu.hpp"
 #include "memory.hpp"
@@ -26,6 +27,7 @@ Cpu::Cpu(Memory *memory)
         this->_inner_memory = new Memory();
         this->memory = this->_inner_memory;
     }
+    this->_io_events.reserve(1 + 3 * IO_EVENTS_MAX);
 }
 
 Cpu::~Cpu(void)
@@ -43,20 +45,11 @@ void Cpu::step(const unsigned int count)
     }
 }
 
-void Cpu::load(const char *path, const unsigned int program_start)
+/// Read the words of the binary at path in program
+static void read_program(const char *path, std::vector<unsigned int> &program)
 {
     unsigned int instruction;
 
-    // Unload previous program
-    this->program.clear();
-
-    // Make sure the program start is 4bytes aligned
-    if (program_start % 4) {
-        std::string msg("Program start address must be 4 bytes aligned");
-        throw EmulatorException(msg);
-    }
-
-    // Actually do the loading
     std::ifstream fs(path, std::fstream::in | std::fstream::binary);
     if (!fs) {
         std::string msg("Cannot open file : ");
@@ -68,9 +61,24 @@ void Cpu::load(const char *path, const unsigned int program_start)
         fs.read((char*)&instruction, 4);
         if (fs.eof())
             break;
-        this->program.push_back(instruction);
+        program.push_back(instruction);
     }
     fs.close();
+}
+
+void Cpu::load(const char *path, const unsigned int program_start)
+{
+    // Unload previous program
+    this->program.clear();
+
+    // Make sure the program start is 4bytes aligned
+    if (program_start % 4) {
+        std::string msg("Program start address must be 4 bytes aligned");
+        throw EmulatorException(msg);
+    }
+
+    // Actually do the loading
+    read_program(path, this->program);
     // Finally update some variables
     this->program_start = program_start;
     this->program_size = this->program.size();
@@ -79,6 +87,18 @@ void Cpu::load(const char *path, const unsigned int program_start)
     this->set_pc(this->program_start);
 }
 
+void Cpu::swap_program(const char *path, const long long pc)
+{
+    // Instructions are decoded when executed, only the raw words change
+    // The program is only replaced once the new one is read
+    std::vector<unsigned int> program;
+    read_program(path, program);
+    this->program.swap(program);
+    this->program_size = this->program.size();
+    if (pc >= 0)
+        this->set_pc(pc);
+}
+
 static inline int signExtImmed(const unsigned int immed)
 {
     if (immed & 0x8000)
@@ -87,6 +107,62 @@ static inline int signExtImmed(const unsigned int immed)
         return immed;
 }
 
+std::pair<int, unsigned int> Cpu::run_until(const unsigned int max_steps, const long long pc,
+    const long long write_start, const long long write_end,
+    const int reg, const unsigned int reg_value)
+{
+    const bool check_pc = pc >= 0;
+    const unsigned int target = check_pc ? (pc - this->program_start) >> 2 : 0;
+    const bool check_write = write_start >= 0 && write_end > write_start;
+    const bool check_reg = reg >= 0 && reg < 32;
+
+    for (unsigned int i = 1; i <= max_steps; ++i) {
+        const unsigned int instruction = this->program.at(this->fake_pc);
+        this->execute(instruction);
+        if (check_write && (instruction >> 26) == 0x2b) {
+            // SW doesn't change the registers, the address can be computed afterward
+            const long long address = (unsigned int)(this->r[(instruction >> 21) & 0x1F] +
+                signExtImmed(instruction & 0xFFFF));
+            if (address < write_end && address + 4 > write_start)
+                return std::make_pair((int)STOP_MEM_WRITE, i);
+        }
+        if (check_reg && this->r[reg] == reg_value)
+            return std::make_pair((int)STOP_REG_EQUALS, i);
+        if (check_pc && this->fake_pc == target)
+            return std::make_pair((int)STOP_PC, i);
+    }
+    return std::make_pair((int)STOP_MAX_STEPS, max_steps);
+}
+
+const std::vector<unsigned int>& Cpu::step_until_io(const unsigned int count,
+    const unsigned int io_start, const unsigned int io_end, const unsigned int max_events)
+{
+    const unsigned int events_max = std::min(std::max(max_events, 1u), (unsigned int)IO_EVENTS_MAX);
+    unsigned int events = 0;
+    unsigned int executed = 0;
+    // First element is the number of instructions executed, set at the end
+    this->_io_events.resize(1);
+    while (executed < count) {
+        const unsigned int instruction = this->program.at(this->fake_pc);
+        this->execute(instruction);
+        ++executed;
+        if ((instruction >> 26) == 0x2b) {
+            // SW doesn't change the registers, the address can be computed afterward
+            const unsigned int address = this->r[(instruction >> 21) & 0x1F] +
+                signExtImmed(instruction & 0xFFFF);
+            if (address < io_end && (unsigned long long)address + 4 > io_start) {
+                this->_io_events.push_back(executed);
+                this->_io_events.push_back(address);
+                this->_io_events.push_back(this->r[(instruction >> 16) & 0x1F]);
+                if (++events == events_max)
+                    break;
+            }
+        }
+    }
+    this->_io_events[0] = executed;
+    return this->_io_events;
+}
+
 void Cpu::execute(const unsigned int instruction)
 {
     const unsigned char opcode = instruction >> 26;
@@ -3,9 +3,20 @@
 
 #include <vector>
 #include <string>
+#include <utility>
 #include <exception>
 
 #define DEFAULT_PROGRAM_START 0x0
+/// Maximum number of events recorded by a Cpu::step_until_io call
+#define IO_EVENTS_MAX 1024
+
+/// Cpu::run_until stop reasons
+enum StopReason {
+    STOP_MAX_STEPS = 0,
+    STOP_PC = 1,
+    STOP_MEM_WRITE = 2,
+    STOP_REG_EQUALS = 3
+};
 
 class EmulatorException : public std::exception {
 public:
@@ -24,8 +35,22 @@ public:
     virtual ~Cpu(void);
 
     void step(const unsigned int count=1);
+    /// Run until max_steps instructions or a stop condition (a negative value disables it)
+    /// Return the stop reason and the number of instructions executed
+    std::pair<int, unsigned int> run_until(const unsigned int max_steps, const long long pc=-1,
+        const long long write_start=-1, const long long write_end=-1,
+        const int reg=-1, const unsigned int reg_value=0);
+    /// Run up to count instructions, recording the stores in [io_start, io_end[
+    /// and stopping right after max_events of them
+    /// Return the number of instructions executed followed by the
+    /// (instruction offset, address, value) of each store
+    const std::vector<unsigned int>& step_until_io(const unsigned int count,
+        const unsigned int io_start, const unsigned int io_end, const unsigned int max_events=1);
     void execute(const unsigned int intruction);
     void load(const char *path, const unsigned int program_start=DEFAULT_PROGRAM_START);
+    /// Replace the program without resetting the CPU : registers and memory
+    /// are kept, and so is the PC unless pc is given (a negative value keeps it)
+    void swap_program(const char *path, const long long pc=-1);
     /// Get back the CPU's program counter
     unsigned int get_pc(void) { return (this->fake_pc << 2) + this->program_start; }
     void set_pc(const unsigned int pc) { this->fake_pc = (pc - this->program_start) >> 2; }
@@ -45,6 +70,8 @@ public:
 private:
     // Keep track of allocated Memory object if any
     Memory *_inner_memory = nullptr;
+    /// step_until_io result, allocated once
+    std::vector<unsigned int> _io_events;
 };
 
 #endif // _CPU_H_
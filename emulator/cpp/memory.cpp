@@ -1,4 +1,5 @@
 #include <cstdlib>
+#include <algorithm>
 
 #include "memory.hpp"
 
@@ -67,7 +68,11 @@ void Memory::set_byte(const unsigned address, const int byte)
 
 	if (this->base_address <= address &&
 		address < this->memory_size) {
-		this->_a_memory[address - this->base_address] = (char)byte;
+		const unsigned index = address - this->base_address;
+		this->_a_memory[index] = (char)byte;
+		if (this->_tracking) {
+			this->_dirty[index >> MEMORY_PAGE_SHIFT] = true;
+		}
 	}
 
 	this->_mutex.unlock();
@@ -79,8 +84,54 @@ void Memory::set_word(const unsigned address, const long word)
 
 	if (this->base_address <= address &&
 		address + sizeof(int) < this->memory_size) {
-		*(int*)(this->_a_memory + address - this->base_address) = word;
+		const unsigned index = address - this->base_address;
+		*(int*)(this->_a_memory + index) = word;
+		if (this->_tracking) {
+			this->_dirty[index >> MEMORY_PAGE_SHIFT] = true;
+			this->_dirty[(index + 3) >> MEMORY_PAGE_SHIFT] = true;
+		}
 	}
 
 	this->_mutex.unlock();
 }
+
+void Memory::track_writes(const bool enabled)
+{
+	this->_mutex.lock();
+
+	this->_tracking = enabled;
+	this->_dirty.assign(enabled ? (this->memory_size + MEMORY_PAGE_SIZE - 1) >> MEMORY_PAGE_SHIFT : 0,
+		false);
+
+	this->_mutex.unlock();
+}
+
+std::vector<unsigned int> Memory::dirty_pages(void)
+{
+	this->_mutex.lock();
+
+	std::vector<unsigned int> pages;
+	for (unsigned i = 0; i < this->_dirty.size(); ++i) {
+		if (this->_dirty[i]) {
+			pages.push_back(i);
+		}
+	}
+
+	this->_mutex.unlock();
+	return pages;
+}
+
+std::string Memory::page(const unsigned index)
+{
+	this->_mutex.lock();
+
+	std::string content;
+	const unsigned start = index << MEMORY_PAGE_SHIFT;
+	if (start < this->memory_size) {
+		const unsigned size = std::min((unsigned)MEMORY_PAGE_SIZE, this->memory_size - start);
+		content.assign(this->_a_memory + start, size);
+	}
+
+	this->_mutex.unlock();
+	return content;
+}
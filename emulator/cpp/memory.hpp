@@ -2,9 +2,14 @@
 #define _MEMORY_HH_
 
 #include <mutex>
+#include <string>
+#include <vector>
 
 #define DEFAULT_MEMORY_SIZE (1024 * 1024)
 #define DEFAULT_BASE_ADDRESS 0
+/// Granularity of the written memory tracking
+#define MEMORY_PAGE_SHIFT 8
+#define MEMORY_PAGE_SIZE (1 << MEMORY_PAGE_SHIFT)
 
 class Memory {
 public:
@@ -27,12 +32,24 @@ public:
 	void set_byte(const unsigned address, const int byte);
 	void set_word(const unsigned address, const long word);
 
+	/// Enable/disable the tracking of the written pages (dirty_pages),
+	/// the stores only mark them while it is enabled
+	void track_writes(const bool enabled);
+	/// Sorted indexes of the pages written since the tracking was enabled
+	/// (page i starts at base_address + i * MEMORY_PAGE_SIZE)
+	std::vector<unsigned int> dirty_pages(void);
+	/// Content of a page
+	std::string page(const unsigned index);
+
 	const unsigned memory_size;
 	const unsigned base_address;
 
 private:
 	std::mutex _mutex;
 	char *_a_memory;
+	bool _tracking = false;
+	/// Pages written since the tracking was enabled, empty when disabled
+	std::vector<bool> _dirty;
 };
 
 #endif // _MEMORY_HH_
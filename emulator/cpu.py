@@ -1,9 +1,20 @@
 #! /usr/bin/env python
 
 from memory import Memory
+from types import MethodType
+from operator import index
 import struct
 
 DEFAULT_PROGRAM_START = 0x0
+# Bump it when the decoded form of the instructions or the code translated
+# from it changes (see ProgramCache)
+VERSION = "1.2"
+
+# Cpu.run_until stop reasons
+STOP_MAX_STEPS = 0
+STOP_PC = 1
+STOP_MEM_WRITE = 2
+STOP_REG_EQUALS = 3
 
 def signExtImmed(immed):
     """Python int are not bounded unlike C int32,
@@ -15,6 +26,35 @@ def signExtImmed(immed):
     else:
         return immed
 
+def store_access(instruction, r):
+    """Return the (address, value) written by the SW instruction
+       (registers are not modified by a SW, r may be the one after it)
+    """
+    address = (r[(instruction >> 21) & 0x1F] + signExtImmed(instruction & 0xFFFF)) & 0xFFFFFFFF
+    return address, r[(instruction >> 16) & 0x1F] & 0xFFFFFFFF
+
+def read_binary(path):
+    """Return the content of the MIPS binary at path"""
+    with open(path, "rb") as fd:
+        data = fd.read()
+    if len(data) % 4 != 0:
+        raise Exception('"{}" must be 4 bytes alligned !'
+            '(size : {} bytes)'.format(path, len(data)))
+    return data
+
+def decode(instruction):
+    """Split a raw instruction into its fields
+       Return (opcode, rs, rt, rd, shamt, funct, immed, addr)
+    """
+    return ((instruction >> 26) & 0x3F,
+            (instruction >> 21) & 0x1F,
+            (instruction >> 16) & 0x1F,
+            (instruction >> 11) & 0x1F,
+            (instruction >> 6) & 0x1F,
+            instruction & 0x3F,
+            instruction & 0xFFFF,
+            instruction & 0x03FFFFFF)
+
 class Instruction():
     """Class representing a single instruction.
        To save runtime performances, a raw instruction (i.e. a 32bits word)
@@ -22,42 +62,30 @@ class Instruction():
        Then the instruction can be executed by calling Instruction.execute()
     """
     def __init__(self, cpu, instruction):
-        self.OPCODES_I = {
-        0x04 : self.__execute_I_BEQ,
-        0x23 : self.__execute_I_LW,
-        0x2b : self.__execute_I_SW,
-        0x0c : self.__execute_I_ANDI,
-        0x0d : self.__execute_I_ORI,
-        0x08 : self.__execute_I_ADDI
-        }
-
-        self.OPCODES_J = {
-        0x02 : self.__execute_J_JUMP
-        }
-
         self.cpu = cpu
         self.raw = instruction
 
+        opcode, rs, rt, rd, shamt, funct, immed, addr = decode(instruction)
+        self.opcode = opcode
         # Get the instruction type (R, I or J) from the opcode and execute it
-        opcode = (instruction >> 26) & 0x3F
         if opcode == 0:
             # R instruction
-            self.rs = (instruction >> 21) & 0x1F
-            self.rt = (instruction >> 16) & 0x1F
-            self.rd = (instruction >> 11) & 0x1F
-            self.shamt = (instruction >> 6) & 0x1F
-            self.funct = instruction & 0x3F
+            self.rs = rs
+            self.rt = rt
+            self.rd = rd
+            self.shamt = shamt
+            self.funct = funct
             self.execute = self.__execute_R
 
         elif opcode in self.OPCODES_I:
-            self.rs = (instruction >> 21) & 0x1F
-            self.rt = (instruction >> 16) & 0x1F
-            self.immed = instruction & 0xFFFF
-            self.execute = self.OPCODES_I[opcode]
+            self.rs = rs
+            self.rt = rt
+            self.immed = immed
+            self.execute = MethodType(self.OPCODES_I[opcode], self)
 
         elif opcode in self.OPCODES_J:
-            self.addr = instruction & 0x03FFFFFF
-            self.execute = self.OPCODES_J[opcode]
+            self.addr = addr
+            self.execute = MethodType(self.OPCODES_J[opcode], self)
 
         else:
             raise TypeError('bad opcode ({})'.format(hex(opcode)))
@@ -98,11 +126,14 @@ class Instruction():
 
     def __execute_I_LW(self):
         if self.rt != 0:
-            self.cpu.r[self.rt] = self.cpu.memory.get_sword(self.cpu.r[self.rs] + signExtImmed(self.immed))
+            self.cpu.r[self.rt] = self.cpu.memory.get_uword(
+                (self.cpu.r[self.rs] + signExtImmed(self.immed)) & 0xFFFFFFFF)
         self.cpu.fake_pc += 1
 
     def __execute_I_SW(self):
-        self.cpu.memory.set_word(self.cpu.r[self.rs] + signExtImmed(self.immed), self.cpu.r[self.rt])
+        # Addresses wrap around like the 32 bits registers
+        self.cpu.memory.set_word((self.cpu.r[self.rs] + signExtImmed(self.immed)) & 0xFFFFFFFF,
+                                 self.cpu.r[self.rt])
         self.cpu.fake_pc += 1
 
     def __execute_I_ANDI(self):
@@ -124,8 +155,88 @@ class Instruction():
         self.cpu.fake_pc = (self.cpu.fake_pc & (0x3F << 26)) | self.addr
         # No need to update the program counter in a jump
 
+    # Execute method of each opcode, shared by all the instructions so
+    # that building one only binds the method it needs
+    OPCODES_I = {
+    0x04 : __execute_I_BEQ,
+    0x23 : __execute_I_LW,
+    0x2b : __execute_I_SW,
+    0x0c : __execute_I_ANDI,
+    0x0d : __execute_I_ORI,
+    0x08 : __execute_I_ADDI
+    }
+
+    OPCODES_J = {
+    0x02 : __execute_J_JUMP
+    }
 
-class Cpu():
+
+class CpuControl():
+    """Run control shared by the python implementations
+       The Cpu provides the loop _run_until(max_steps, target, write_start,
+       write_end, reg, value), target being a fake_pc (-1 for none), the
+       write range empty and reg -1 when they are not checked, the
+       method _swap(words, changed) replacing its program by words, only
+       the indexes in changed being new instructions, and a program whose
+       entries convert to their raw word with index()
+    """
+    def run_until(self, max_steps, pc=None, mem_write_range=None, reg_equals=None):
+        """Run the CPU until one of the conditions is met after an instruction
+           max_steps : maximum number of instructions to execute
+           pc : stop when the PC reaches this address
+           mem_write_range : (start, end), stop after a store in [start, end[
+           reg_equals : (register, value), stop when the register holds value
+           Return (stop reason, number of instructions executed)
+        """
+        if self.program is None:
+            raise self.CpuError("No program loaded !")
+        target = -1 if pc is None else (pc - self.program_start) >> 2
+        if mem_write_range is None:
+            write_start, write_end = 0, 0
+        else:
+            write_start, write_end = mem_write_range
+        if reg_equals is None:
+            reg, value = -1, 0
+        else:
+            reg, value = reg_equals[0], reg_equals[1] & 0xFFFFFFFF
+        return self._run_until(max_steps, target, write_start, write_end, reg, value)
+
+    def step_until_io(self, count, io_range, max_events=1):
+        """Run up to count instructions, recording the stores in io_range
+           io_range : (start, end) of the I/O addresses, end excluded
+           max_events : stop right after this number of stores
+           Return (number of instructions executed, events), an event being
+           (instruction offset, address, value written), offset 1 is the
+           first instruction executed
+        """
+        events = []
+        executed = 0
+        while executed < count:
+            reason, steps = self.run_until(count - executed, mem_write_range=io_range)
+            executed += steps
+            if reason != STOP_MEM_WRITE:
+                break
+            events.append((executed,) + store_access(index(self.program[self.fake_pc - 1]), self.r))
+            if len(events) >= max_events:
+                break
+        return executed, events
+
+    def swap_program(self, path, pc=None):
+        """Replace the program without resetting the CPU : registers and
+           memory are kept, and so is the PC unless pc is given
+           Only the instructions whose raw word changed are decoded again
+        """
+        data = read_binary(path)
+        words = struct.unpack("{}i".format(len(data) / 4), data)
+        old = [index(entry) for entry in self.program or ()]
+        changed = [i for i, word in enumerate(words) if i >= len(old) or old[i] != word]
+        self._swap(words, changed)
+        self.program_size = len(words)
+        if pc is not None:
+            self.set_pc(pc)
+
+
+class Cpu(CpuControl):
     """MIPS-1 CPU"""
 
     class CpuError(Exception):
@@ -159,19 +270,22 @@ class Cpu():
             raise Exception("Cpu program_start must be 4 bytes alligned !")
         self.program_start = program_start
         # Get the input binary as bit array
-        with open(path, "rb") as fd:
-            data = fd.read()
-            if len(data) % 4 != 0:
-                raise Exception('"{}" must be 4 bytes alligned !'
-                    '(size : {} bytes)'.format(path, len(data)))
-            self.program_size = len(data) / 4
-            # The program is stored as an array of Instruction objecs
-            self.program = []
-            for i in xrange(self.program_size):
-                self.program.append(Instruction(self, struct.unpack_from("i", data, i * 4)[0]))
+        data = read_binary(path)
+        words = struct.unpack("{}i".format(len(data) / 4), data)
+        self.program_size = len(words)
+        # The program is stored as an array of Instruction objecs
+        self.program = [Instruction(self, word) for word in words]
         # Finally, set the PC to be ready to start the program
         self.set_pc(self.program_start)
 
+    def _swap(self, words, changed):
+        """Program replacement of swap_program (see CpuControl)"""
+        program = (self.program or [])[:len(words)]
+        program += [None] * (len(words) - len(program))
+        for i in changed:
+            program[i] = Instruction(self, words[i])
+        self.program = program
+
     def set_pc(self, address):
         """Set the PC"""
         self.fake_pc = (address - self.program_start) >> 2
@@ -189,6 +303,23 @@ class Cpu():
             # Fetch and execute the next instruction
             self.program[self.fake_pc].execute()
 
+    def _run_until(self, max_steps, target, write_start, write_end, reg, value):
+        """Loop of run_until (see CpuControl)"""
+        program = self.program
+        r = self.r
+        for executed in xrange(1, max_steps + 1):
+            instruction = program[self.fake_pc]
+            instruction.execute()
+            if write_end > write_start and instruction.opcode == 0x2b:
+                address = (r[instruction.rs] + signExtImmed(instruction.immed)) & 0xFFFFFFFF
+                if address < write_end and address + 4 > write_start:
+                    return STOP_MEM_WRITE, executed
+            if reg >= 0 and r[reg] & 0xFFFFFFFF == value:
+                return STOP_REG_EQUALS, executed
+            if self.fake_pc == target:
+                return STOP_PC, executed
+        return STOP_MAX_STEPS, max(max_steps, 0)
+
     def execute(self, instruction):
         """Make the CPU execute the given MIPS instruction"""
         # First fetch the instruction
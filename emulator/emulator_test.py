@@ -2,19 +2,40 @@
 
 import unittest
 import sys
+import os
+import imp
+import shutil
+import tempfile
+import random
+import struct
 
+from cache import ProgramCache, cache_tag
+from cpu import STOP_MAX_STEPS, STOP_PC, STOP_MEM_WRITE, STOP_REG_EQUALS, signExtImmed
 
-# Check if emulator compiled version is disponible
-try:
-    from cpp_emulator import Cpu, Memory
-    print "TESTING C++ version"
 
-# Otherwise, load the pure python version
-except ImportError:
+# TRIMPS_EMULATOR selects the tested implementation (see emulator/__init__.py)
+if os.environ.get("TRIMPS_EMULATOR") == "flat":
+    from flatcpu import Cpu
+    from memory import Memory
+    print "TESTING FLAT version"
+
+elif os.environ.get("TRIMPS_EMULATOR") == "python":
     from cpu import Cpu
     from memory import Memory
     print "TESTING PYTHON version"
 
+else:
+    # Check if emulator compiled version is disponible
+    try:
+        from cpp_emulator import Cpu, Memory
+        print "TESTING C++ version"
+
+    # Otherwise, load the pure python version
+    except ImportError:
+        from cpu import Cpu
+        from memory import Memory
+        print "TESTING PYTHON version"
+
 
 class Test_memory(unittest.TestCase):
     mem = 0
@@ -99,6 +120,36 @@ class Test_memory(unittest.TestCase):
         self.assertEqual(memory.get_uword(-1), 0x0)
         self.assertEqual(memory.get_sword(-1), 0x0)
 
+    def testDirtyPages(self):
+        memory = Memory(1024)
+
+        # Not tracked by default
+        memory.set_byte(0x10, 0x1)
+        self.assertEqual(list(memory.dirty_pages()), [])
+        memory.track_writes(True)
+        self.assertEqual(list(memory.dirty_pages()), [])
+        memory.set_byte(0x201, 0x42)
+        self.assertEqual(list(memory.dirty_pages()), [2])
+        # A word across two pages marks both
+        memory.set_word(0xFE, 0x01020304)
+        self.assertEqual(list(memory.dirty_pages()), [0, 1, 2])
+        # Reads don't mark anything
+        memory.get_uword(0x300)
+        self.assertEqual(list(memory.dirty_pages()), [0, 1, 2])
+        page = memory.page(2)
+        self.assertEqual(len(page), 256)
+        self.assertEqual(page[1], "\x42")
+        self.assertEqual(memory.page(1)[:2], "\x02\x01")
+        memory.track_writes(False)
+        memory.set_byte(0x300, 0x1)
+        self.assertEqual(list(memory.dirty_pages()), [])
+        # The CPU stores are tracked too
+        memory.track_writes(True)
+        cpu = Cpu(memory)
+        cpu.load("tests/store.mips")
+        cpu.step(2)
+        self.assertEqual(list(memory.dirty_pages()), [0])
+
 def cmp_regs(regs1, regs2):
     for i in xrange(len(regs1)):
         if regs1[i] != regs2[i]:
@@ -435,5 +486,461 @@ class Test_execute(unittest.TestCase):
         self.assertEqual(cpu.fake_pc, 4)
 
 
+class Test_run_until(unittest.TestCase):
+    """Program used (tests/store.mips) :
+           ori $1, $0, 0x42
+       loop:
+           sw $1, 0x10($0)
+           lw $2, 0x10($0)
+           addi $1, $1, 1
+           j loop
+    """
+    def testMaxSteps(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.run_until(10), (STOP_MAX_STEPS, 10))
+        self.assertEqual(cpu.fake_pc, 2)
+        # Conditions never met
+        self.assertEqual(cpu.run_until(7, pc=0x40, mem_write_range=(0x20, 0x30)),
+                         (STOP_MAX_STEPS, 7))
+        self.assertEqual(cpu.fake_pc, 1)
+
+    def testPc(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.run_until(100, pc=0xc), (STOP_PC, 3))
+        self.assertEqual(cpu.fake_pc, 3)
+        # The current pc doesn't count, the next loop is reached
+        self.assertEqual(cpu.run_until(100, pc=0xc), (STOP_PC, 4))
+        self.assertEqual(cpu.r[1], 0x43)
+
+    def testMemWrite(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.run_until(100, mem_write_range=(0x10, 0x11)), (STOP_MEM_WRITE, 2))
+        self.assertEqual(cpu.memory[0x10], 0x42)
+        # Overlapping the end of the stored word
+        self.assertEqual(cpu.run_until(100, mem_write_range=(0x13, 0x20)), (STOP_MEM_WRITE, 4))
+        self.assertEqual(cpu.memory[0x10], 0x43)
+
+    def testRegEquals(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.run_until(100, reg_equals=(1, 0x44)), (STOP_REG_EQUALS, 8))
+        self.assertEqual(cpu.r[1], 0x44)
+        self.assertEqual(cpu.run_until(100, reg_equals=(2, 0x44), pc=0x0), (STOP_REG_EQUALS, 3))
+
+    def testWrappedWrite(self):
+        """Program used :
+               sw $1, 0x11($2)
+               sw $1, -4($0)
+               j 0
+           The write stops agree on all the engines available
+        """
+        fd, path = tempfile.mkstemp(suffix=".mips")
+        os.write(fd, struct.pack("<3I", 0xAC410011, 0xAC01FFFC, 0x08000000))
+        os.close(fd)
+        engines = [("cpu", "memory"), ("flatcpu", "memory"), ("cpp_emulator", "cpp_emulator")]
+        try:
+            for cpu_module, memory_module in engines:
+                try:
+                    EngineCpu = __import__(cpu_module).Cpu
+                    EngineMemory = __import__(memory_module).Memory
+                except ImportError:
+                    continue
+                memory = EngineMemory()
+                cpu = EngineCpu(memory)
+                cpu.load(path)
+                # Negative base register
+                cpu.r[2] = 0xFFFFFFFF
+                self.assertEqual(cpu.run_until(10, mem_write_range=(0x10, 0x11)),
+                                 (STOP_MEM_WRITE, 1), cpu_module)
+                # Negative offset
+                self.assertEqual(cpu.run_until(10, mem_write_range=(0xFFFFFFF0, 0x100000000)),
+                                 (STOP_MEM_WRITE, 1), cpu_module)
+        finally:
+            os.remove(path)
+
+
+class Test_swap_program(unittest.TestCase):
+    """Program used (tests/store.mips), then swapped with addi $1, $1, 2"""
+    def setUp(self):
+        with open("tests/store.mips", "rb") as fd:
+            data = fd.read()
+        # addi $1, $1, 1 -> addi $1, $1, 2
+        words = list(struct.unpack("<5I", data))
+        words[3] += 1
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, struct.pack("<5I", *words))
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testKeepState(self):
+        memory = Memory()
+        cpu = Cpu(memory)
+        cpu.load("tests/store.mips")
+        cpu.step(5)
+        self.assertEqual(cpu.get_pc(), 0x4)
+        cpu.swap_program(self.path)
+        # Registers, memory and PC are kept
+        self.assertEqual(cpu.get_pc(), 0x4)
+        self.assertEqual(cpu.r[1], 0x43)
+        self.assertEqual(cpu.memory[0x10], 0x42)
+        cpu.step(4)
+        self.assertEqual(cpu.memory[0x10], 0x43)
+        self.assertEqual(cpu.r[1], 0x45)
+
+    def testPc(self):
+        memory = Memory()
+        cpu = Cpu(memory)
+        cpu.load("tests/store.mips")
+        cpu.step(3)
+        cpu.swap_program(self.path, pc=0xc)
+        self.assertEqual(cpu.get_pc(), 0xc)
+        cpu.step(1)
+        self.assertEqual(cpu.r[1], 0x44)
+
+    def testMissing(self):
+        memory = Memory()
+        cpu = Cpu(memory)
+        cpu.load("tests/store.mips")
+        cpu.step(3)
+        # The program is kept when the new one can't be read
+        self.assertRaises(Exception, cpu.swap_program, self.path + ".missing")
+        self.assertEqual(cpu.program_size, 5)
+        cpu.step(2)
+        self.assertEqual(cpu.r[1], 0x43)
+
+    def testBreakpoint(self):
+        # Breakpoints of the GDB stub of the python implementation
+        import cpu as pycpu
+        import gdbstub
+        cpu = pycpu.Cpu()
+        cpu.load("tests/store.mips")
+        stub = gdbstub.GdbStub(cpu)
+        stub.insert_breakpoint(0x4)
+        stub.insert_breakpoint(0xc)
+        cpu.swap_program(self.path)
+        # Both keep their breakpoint, the changed one on the new instruction
+        new = struct.unpack("<5I", open(self.path, "rb").read())[3]
+        self.assertTrue(isinstance(cpu.program[1], gdbstub.Trap))
+        self.assertTrue(isinstance(cpu.program[3], gdbstub.Trap))
+        self.assertEqual(cpu.program[3].instruction.raw, new)
+        self.assertEqual(stub.resume(), "S05")
+        self.assertEqual(stub.resume(), "S05")
+        self.assertEqual(cpu.fake_pc, 3)
+        # Removing it doesn't bring the old instruction back
+        stub.remove_breakpoint(0xc)
+        self.assertEqual(cpu.program[3].raw, new)
+        cpu.step(1)
+        self.assertEqual(cpu.r[1], 0x44)
+        # Breakpoints past the end of a shorter program are dropped
+        with open(self.path, "wb") as fd:
+            fd.write(struct.pack("<I", 0x08000000))
+        cpu.set_pc(0)
+        cpu.swap_program(self.path)
+        self.assertEqual(stub.breakpoints.keys(), [])
+
+
+class Test_step_until_io(unittest.TestCase):
+    """Same program as Test_run_until (tests/store.mips)"""
+    def testEvents(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.step_until_io(100, (0x10, 0x11), 3),
+                         (10, [(2, 0x10, 0x42), (6, 0x10, 0x43), (10, 0x10, 0x44)]))
+        self.assertEqual(cpu.fake_pc, 2)
+        # Budget exhausted before the next store
+        self.assertEqual(cpu.step_until_io(3, (0x10, 0x11), 3), (3, []))
+        self.assertEqual(cpu.step_until_io(5, (0x10, 0x11)), (1, [(1, 0x10, 0x45)]))
+
+    def testOutOfRange(self):
+        cpu = Cpu()
+        cpu.load("tests/store.mips")
+        self.assertEqual(cpu.step_until_io(20, (0x14, 0x20), 3), (20, []))
+        self.assertEqual(cpu.memory[0x10], 0x46)
+
+
+class Test_cache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ProgramCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testKey(self):
+        key = self.cache.key("data", 0x0, "tag")
+        self.assertEqual(key, self.cache.key("data", 0x0, "tag"))
+        self.assertNotEqual(key, self.cache.key("data", 0x4, "tag"))
+        self.assertNotEqual(key, self.cache.key("data", 0x0, "tag2"))
+        self.assertNotEqual(key, self.cache.key("datb", 0x0, "tag"))
+
+    def testGetPut(self):
+        self.assertEqual(self.cache.get("missing"), None)
+        payload = ((1, (0, 1, 2)), (2, (3, 4, 5)))
+        self.cache.put("key", payload)
+        self.assertEqual(self.cache.get("key"), payload)
+
+    def testCorrupted(self):
+        self.cache.put("key", (1, 2, 3))
+        with open(self.cache.path("key"), "r+b") as fd:
+            fd.seek(-1, os.SEEK_END)
+            fd.write("\xff")
+        self.assertEqual(self.cache.get("key"), None)
+        self.assertFalse(os.path.exists(self.cache.path("key")))
+
+    def testEviction(self):
+        self.cache.max_size = 0
+        self.cache.put("key", (1, 2, 3))
+        self.assertEqual(self.cache.get("key"), None)
+
+    def testTag(self):
+        # Payloads of other interpreters are never shared
+        import platform
+        tag = cache_tag("flat", "1.0")
+        self.assertTrue(tag.startswith("flat-1.0-" + platform.python_implementation()))
+        self.assertTrue(imp.get_magic().encode("hex") in tag)
+        self.assertNotEqual(tag, cache_tag("aot", "1.0"))
+
+    def testLoad(self):
+        # Cache is only used by the flat implementation
+        import flatcpu
+        cpu = flatcpu.Cpu()
+        cpu.load("tests/beq.mips", cache=self.cache)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        cached = flatcpu.Cpu()
+        cached.load("tests/beq.mips", cache=self.cache)
+        self.assertEqual(cached.program_size, cpu.program_size)
+        self.assertEqual(cached.program, cpu.program)
+        self.assertEqual(cached.columns, cpu.columns)
+        cached.step(3)
+        self.assertEqual(cached.r[1], 0x24)
+
+
+class Test_gdbstub(unittest.TestCase):
+    """Program used (tests/store.mips) :
+           ori $1, $0, 0x42
+       loop:
+           sw $1, 0x10($0)
+           lw $2, 0x10($0)
+           addi $1, $1, 1
+           j loop
+    """
+    def setUp(self):
+        # The stub works on the python implementation
+        import cpu as pycpu
+        import gdbstub
+        self.gdbstub = gdbstub
+        self.cpu = pycpu.Cpu()
+        self.cpu.load("tests/store.mips")
+        self.stub = gdbstub.GdbStub(self.cpu)
+
+    def testBreakpoint(self):
+        self.stub.insert_breakpoint(0xc)
+        # The instruction is still seen through the trap
+        self.assertEqual(bin(self.cpu.program[3]), bin(0x20210001))
+        self.assertEqual(self.stub.resume(), "S05")
+        self.assertEqual(self.cpu.fake_pc, 3)
+        self.assertEqual(self.cpu.r[1], 0x42)
+        # Resuming executes the instruction under the breakpoint
+        self.assertEqual(self.stub.resume(), "S05")
+        self.assertEqual(self.cpu.fake_pc, 3)
+        self.assertEqual(self.cpu.r[1], 0x43)
+        self.stub.remove_breakpoint(0xc)
+        self.assertFalse(isinstance(self.cpu.program[3], self.gdbstub.Trap))
+
+    def testWatchpoint(self):
+        self.stub.insert_watchpoint(self.gdbstub.WATCH_WRITE, 0x10, 4)
+        self.assertEqual(self.stub.resume(), "T05watch:10;")
+        self.assertEqual(self.cpu.fake_pc, 2)
+        self.assertEqual(self.cpu.memory[0x10], 0x42)
+        self.stub.remove_watchpoint(self.gdbstub.WATCH_WRITE, 0x10, 4)
+        self.assertTrue(self.cpu.memory is self.stub.memory)
+
+        self.stub.insert_watchpoint(self.gdbstub.WATCH_READ, 0x10, 1)
+        self.assertEqual(self.stub.resume(), "T05rwatch:10;")
+        # The interrupted LW has been completed
+        self.assertEqual(self.cpu.fake_pc, 3)
+        self.assertEqual(self.cpu.r[2], 0x42)
+
+    def testPackets(self):
+        self.assertEqual(self.stub.handle_packet("s"), "S05")
+        registers = self.stub.handle_packet("g")
+        self.assertEqual(len(registers), 38 * 8)
+        self.assertEqual(registers[8:16], "42000000")
+        self.assertEqual(registers[-8:], "04000000")
+        self.assertEqual(self.stub.handle_packet("M20,2:abcd"), "OK")
+        self.assertEqual(self.stub.handle_packet("m20,2"), "abcd")
+        self.assertEqual(self.stub.handle_packet("Z0,4,4"), "OK")
+        self.assertEqual(self.stub.handle_packet("c"), "S05")
+        self.assertEqual(self.stub.handle_packet("p25"), "04000000")
+        self.assertEqual(self.stub.handle_packet("unknown"), "")
+
+    def testErrors(self):
+        # Breakpoint outside the program, malformed read
+        self.assertEqual(self.stub.reply("Z0,1000,4"), "E01")
+        self.assertEqual(self.stub.reply("m,zz"), "E01")
+        self.assertEqual(self.stub.reply("m20,2"), "0000")
+
+    def testSession(self):
+        import socket
+        import threading
+        # Free port for the stub
+        probe = socket.socket()
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        thread = threading.Thread(target=self.stub.serve, args=(port,))
+        thread.start()
+        sock = None
+        for _ in xrange(100):
+            try:
+                sock = socket.create_connection(("127.0.0.1", port))
+                break
+            except socket.error:
+                threading.Event().wait(0.01)
+        try:
+            # Errors don't end the session
+            for packet, reply in (("Z0,1000,4", "E01"), ("m,zz", "E01"), ("s", "S05"), ("k", "OK")):
+                sock.sendall("${}#{:02x}".format(packet, self.gdbstub.checksum(packet)))
+                expected = "+${}#{:02x}".format(reply, self.gdbstub.checksum(reply))
+                received = ""
+                while len(received) < len(expected):
+                    received += sock.recv(4096)
+                self.assertEqual(received, expected)
+        finally:
+            sock.close()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class Test_aot(unittest.TestCase):
+    def compare(self, path, counts):
+        """Run the binary on the python Cpu and its translation"""
+        import cpu as pycpu
+        import memory as pymemory
+        import aot
+        reference = pycpu.Cpu()
+        reference.load(path)
+        translated = aot.load(path)['Cpu'](pymemory.Memory())
+        for count in counts:
+            reference.step(count)
+            translated.step(count)
+            self.assertEqual(translated.fake_pc, reference.fake_pc)
+            self.assertTrue(cmp_regs(translated.r, reference.r))
+            self.assertEqual(translated.memory.get_uword(0x10), reference.memory.get_uword(0x10))
+
+    def testStore(self):
+        # Budgets ending in the middle of the blocks
+        self.compare("tests/store.mips", [1, 2, 3, 5, 7, 11, 100, 1])
+
+    def testBeq(self):
+        self.compare("tests/beq.mips", [1, 2, 1, 13, 40, 2])
+
+    def testOutOfProgram(self):
+        import memory as pymemory
+        import aot
+        cpu = aot.load("tests/beq.mips")['Cpu'](pymemory.Memory())
+        self.assertRaises(IndexError, cpu.step, 200)
+        self.assertEqual(cpu.fake_pc, 5)
+        self.assertEqual(cpu.r[1], 0)
+
+    def testCache(self):
+        import memory as pymemory
+        import aot
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ProgramCache(directory)
+            aot.load("tests/store.mips", cache=cache)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            cpu = aot.load("tests/store.mips", cache=cache)['Cpu'](pymemory.Memory())
+            cpu.step(2)
+            self.assertEqual(cpu.memory[0x10], 0x42)
+        finally:
+            shutil.rmtree(directory)
+
+
+class Test_fuzz(unittest.TestCase):
+    def setUp(self):
+        # Only needed here, it loads multiprocessing
+        import fuzz
+        self.fuzz = fuzz
+
+    def testRandomCase(self):
+        rng = random.Random(0)
+        for _ in xrange(20):
+            words, registers, memory, steps = self.fuzz.random_case(rng, size=16)
+            self.assertEqual(len(words), 16)
+            self.assertEqual(registers[0], 0)
+            # Jumps and branches stay inside the program
+            for index, word in enumerate(words):
+                opcode = word >> 26
+                if opcode == self.fuzz.OP_J:
+                    self.assertTrue(0 <= word & 0x03FFFFFF < 16)
+                elif opcode == self.fuzz.OP_BEQ:
+                    self.assertTrue(0 <= index + 1 + signExtImmed(word & 0xFFFF) < 16)
+            self.assertEqual(words[-1] >> 26, self.fuzz.OP_J)
+
+    def testShrink(self):
+        case = self.fuzz.random_case(random.Random(1), size=16, steps=100)
+        target = case[0][3]
+        def diverges(case):
+            words, registers, memory, steps = case
+            return target in words and steps >= 5
+        words, registers, memory, steps = self.fuzz.shrink(case, diverges)
+        self.assertEqual(steps, 5)
+        self.assertEqual(words[3], target)
+        self.assertEqual(set(words[:3] + words[4:]), set([self.fuzz.NOP]))
+        self.assertEqual(set(registers), set([0]))
+        self.assertEqual(memory, [])
+
+    def testRunner(self):
+        # Both python implementations must agree
+        runner = self.fuzz.Runner("python", "flat")
+        try:
+            rng = random.Random(2)
+            for _ in xrange(5):
+                self.assertFalse(runner.diverges(self.fuzz.random_case(rng, steps=500)))
+        finally:
+            runner.close()
+
+    def run_case(self, case):
+        """Run a fuzzing case on the tested Cpu, return (cpu, memory)
+           (the C++ Cpu doesn't keep its memory alive)
+        """
+        words, registers, memory_words, steps = case
+        fd, path = tempfile.mkstemp(suffix=".mips")
+        os.write(fd, struct.pack("<{}I".format(len(words)), *words))
+        os.close(fd)
+        memory = Memory(self.fuzz.MEMORY_SIZE)
+        for address, word in memory_words:
+            memory.set_word(address, word)
+        cpu = Cpu(memory)
+        try:
+            cpu.load(path)
+        finally:
+            os.remove(path)
+        for i, value in enumerate(registers):
+            cpu.r[i] = value
+        cpu.step(steps)
+        return cpu, memory
+
+    def testDivergences(self):
+        # Cases where the python versions used to diverge from the C++ one
+        registers = [0] * 32
+        registers[3] = 0x3e5
+        registers[12] = 0xFFFFFFFF
+        # Addresses wrap around at 32 bits : sw $3, 304($12)
+        cpu, memory = self.run_case(([0xAD830130, 0x08000000], registers, [], 1))
+        self.assertEqual(memory.get_uword(0x12f), 0x3e5)
+        # Loaded words are unsigned : lw $1, 0x10($0), lw $2, 0x11($12)
+        cpu, memory = self.run_case(([0x8C010010, 0x8D820011, 0x08000000], registers, [(0x10, 0x80000000)], 2))
+        self.assertEqual(cpu.r[1], 0x80000000)
+        self.assertEqual(cpu.r[2], 0x80000000)
+
+
 if __name__ == '__main__':
     unittest.main()
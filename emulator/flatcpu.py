@@ -0,0 +1,305 @@
+#! /usr/bin/env python
+
+from memory import Memory
+from cpu import signExtImmed, read_binary, CpuControl, VERSION, DEFAULT_PROGRAM_START
+from cpu import STOP_MAX_STEPS, STOP_PC, STOP_MEM_WRITE, STOP_REG_EQUALS
+from cache import cache_tag
+from array import array
+import struct
+
+CACHE_TAG = cache_tag("flat", VERSION)
+
+# Operation classes, an instruction writing to r0 (or unknown) becomes a NOP
+NOP = 0
+AND = 1
+OR = 2
+XOR = 3
+ADD = 4
+SUB = 5
+SLL = 6
+SRL = 7
+SLT = 8
+BEQ = 9
+LW = 10
+SW = 11
+ANDI = 12
+ORI = 13
+ADDI = 14
+J = 15
+
+FUNCTS = {
+    0x24 : AND,
+    0x25 : OR,
+    0x27 : XOR,
+    0x20 : ADD,
+    0x22 : SUB,
+    0x00 : SLL,
+    0x02 : SRL,
+    0x2a : SLT
+}
+
+OPCODES = {
+    0x04 : BEQ,
+    0x23 : LW,
+    0x2b : SW,
+    0x0c : ANDI,
+    0x0d : ORI,
+    0x08 : ADDI,
+    0x02 : J
+}
+
+def decode(instruction):
+    """Decode a raw instruction into the (op, rs, rt, rd, immed) columns
+       For R instructions immed is the shamt, for BEQ, LW, SW and ADDI
+       it is sign extended, for J it is the target address
+    """
+    opcode = (instruction >> 26) & 0x3F
+    rs = (instruction >> 21) & 0x1F
+    rt = (instruction >> 16) & 0x1F
+    rd = (instruction >> 11) & 0x1F
+    if opcode == 0:
+        op = FUNCTS.get(instruction & 0x3F, NOP)
+        if rd == 0:
+            op = NOP
+        return (op, rs, rt, rd, (instruction >> 6) & 0x1F)
+    if opcode not in OPCODES:
+        raise TypeError('bad opcode ({})'.format(hex(opcode)))
+    op = OPCODES[opcode]
+    if op == J:
+        return (op, 0, 0, 0, instruction & 0x03FFFFFF)
+    immed = instruction & 0xFFFF
+    if op in (BEQ, LW, SW, ADDI):
+        immed = signExtImmed(immed)
+    if rt == 0 and op not in (BEQ, SW):
+        op = NOP
+    return (op, rs, rt, 0, immed)
+
+
+class Cpu(CpuControl):
+    """MIPS-1 CPU, flat implementation
+       The program is decoded into parallel arrays (one per instruction
+       field) and executed by a single loop working on local variables.
+    """
+    # Tag of the decoded programs in a ProgramCache
+    CACHE_TAG = CACHE_TAG
+
+    class CpuError(Exception):
+        pass
+
+    def __init__(self, memory=None):
+        self.program_start = 0x0
+        # PC is 4 bytes alligned, then we use instead a fake_pc divided by 4
+        self.fake_pc = 0
+        # MIPS has 31 general-purpose registers plus r0 (always 0 register)
+        self.r = [0x00000000 for _ in xrange(32)]
+        # If no memory was given, it's time to create one
+        if memory is None:
+            self.memory = Memory()
+        else:
+            self.memory = memory
+        # No program loaded so far
+        self.program_size = 0
+        self.program = None
+        self.columns = None
+
+    def __str__(self):
+        string = 'Dump cpu registers :\n'
+        string += 'pc : {}\n'.format(self.fake_pc * 4)
+        for i in xrange(len(self.r)):
+            string += '\tr{} : 0b{}\n'.format(i, bin(self.r[i]))
+        return string
+
+    def load(self, path, program_start=DEFAULT_PROGRAM_START, cache=None):
+        """Load MIPS binary and reset the CPU
+           cache : ProgramCache where to look for the already decoded program
+        """
+        if program_start % 4 != 0:
+            raise Exception("Cpu program_start must be 4 bytes alligned !")
+        self.program_start = program_start
+        data = read_binary(path)
+        decoded = None
+        if cache is not None:
+            key = cache.key(data, program_start, CACHE_TAG)
+            decoded = cache.get(key)
+        if decoded is None:
+            words = struct.unpack("{}i".format(len(data) / 4), data)
+            fields = zip(*[decode(word) for word in words]) or [()] * 5
+            decoded = [array('i', words).tostring()]
+            decoded += [array('i', column).tostring() for column in fields]
+            if cache is not None:
+                cache.put(key, decoded)
+        columns = [array('i') for _ in decoded]
+        for column, raw in zip(columns, decoded):
+            column.fromstring(raw)
+        self.program = columns[0]
+        self.columns = columns[1:]
+        self.program_size = len(self.program)
+        # Finally, set the PC to be ready to start the program
+        self.set_pc(self.program_start)
+
+    def _swap(self, words, changed):
+        """Program replacement of swap_program (see CpuControl)"""
+        size = len(words)
+        if self.columns is None:
+            columns = [array('i') for _ in xrange(5)]
+        else:
+            columns = [column[:size] for column in self.columns]
+        for column in columns:
+            column.extend([0] * (size - len(column)))
+        for i in changed:
+            for column, field in zip(columns, decode(words[i])):
+                column[i] = field
+        self.program = array('i', words)
+        self.columns = columns
+
+    def set_pc(self, address):
+        """Set the PC"""
+        self.fake_pc = (address - self.program_start) >> 2
+
+    def get_pc(self):
+        """Get the current value of the PC"""
+        return (self.fake_pc << 2) + self.program_start
+
+    def step(self, count=1):
+        """Run the CPU count times (i.e. execute the count next instructions)"""
+        if self.program is None:
+            raise self.CpuError("No program loaded !")
+        self._run(self.columns, count)
+
+    def execute(self, instruction):
+        """Make the CPU execute the given MIPS instruction"""
+        # The columns only need to hold the instruction at the current pc
+        self._run([{self.fake_pc: field} for field in decode(instruction)], 1)
+
+    def _run(self, columns, count):
+        ops, a, b, c, imm = columns
+        r = self.r
+        memory = self.memory
+        get_uword = memory.get_uword
+        set_word = memory.set_word
+        pc = self.fake_pc
+        try:
+            for _ in xrange(count):
+                op = ops[pc]
+                if op == NOP:
+                    pc += 1
+                elif op == ORI:
+                    r[b[pc]] = r[a[pc]] | imm[pc]
+                    pc += 1
+                elif op == ADDI:
+                    r[b[pc]] = (r[a[pc]] + imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == BEQ:
+                    if r[a[pc]] == r[b[pc]]:
+                        pc += imm[pc] + 1
+                    else:
+                        pc += 1
+                elif op == J:
+                    pc = (pc & (0x3F << 26)) | imm[pc]
+                elif op == ANDI:
+                    r[b[pc]] = r[a[pc]] & imm[pc]
+                    pc += 1
+                elif op == OR:
+                    r[c[pc]] = r[a[pc]] | r[b[pc]]
+                    pc += 1
+                elif op == AND:
+                    r[c[pc]] = r[a[pc]] & r[b[pc]]
+                    pc += 1
+                elif op == LW:
+                    r[b[pc]] = get_uword((r[a[pc]] + imm[pc]) & 0xFFFFFFFF)
+                    pc += 1
+                elif op == SW:
+                    set_word((r[a[pc]] + imm[pc]) & 0xFFFFFFFF, r[b[pc]])
+                    pc += 1
+                elif op == XOR:
+                    r[c[pc]] = r[a[pc]] ^ r[b[pc]]
+                    pc += 1
+                elif op == ADD:
+                    r[c[pc]] = (r[a[pc]] + r[b[pc]]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SUB:
+                    r[c[pc]] = (r[a[pc]] - r[b[pc]]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SLL:
+                    r[c[pc]] = (r[b[pc]] << imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SRL:
+                    r[c[pc]] = (r[b[pc]] >> imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                else:  # SLT
+                    r[c[pc]] = r[a[pc]] < r[b[pc]]
+                    pc += 1
+        finally:
+            self.fake_pc = pc
+
+    def _run_until(self, count, target, write_start, write_end, reg, value):
+        """Loop of run_until (see CpuControl), _run with the stop conditions"""
+        ops, a, b, c, imm = self.columns
+        r = self.r
+        memory = self.memory
+        get_uword = memory.get_uword
+        set_word = memory.set_word
+        pc = self.fake_pc
+        address = 0
+        executed = 0
+        try:
+            for executed in xrange(1, count + 1):
+                op = ops[pc]
+                if op == NOP:
+                    pc += 1
+                elif op == ORI:
+                    r[b[pc]] = r[a[pc]] | imm[pc]
+                    pc += 1
+                elif op == ADDI:
+                    r[b[pc]] = (r[a[pc]] + imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == BEQ:
+                    if r[a[pc]] == r[b[pc]]:
+                        pc += imm[pc] + 1
+                    else:
+                        pc += 1
+                elif op == J:
+                    pc = (pc & (0x3F << 26)) | imm[pc]
+                elif op == ANDI:
+                    r[b[pc]] = r[a[pc]] & imm[pc]
+                    pc += 1
+                elif op == OR:
+                    r[c[pc]] = r[a[pc]] | r[b[pc]]
+                    pc += 1
+                elif op == AND:
+                    r[c[pc]] = r[a[pc]] & r[b[pc]]
+                    pc += 1
+                elif op == LW:
+                    r[b[pc]] = get_uword((r[a[pc]] + imm[pc]) & 0xFFFFFFFF)
+                    pc += 1
+                elif op == SW:
+                    address = (r[a[pc]] + imm[pc]) & 0xFFFFFFFF
+                    set_word(address, r[b[pc]])
+                    pc += 1
+                elif op == XOR:
+                    r[c[pc]] = r[a[pc]] ^ r[b[pc]]
+                    pc += 1
+                elif op == ADD:
+                    r[c[pc]] = (r[a[pc]] + r[b[pc]]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SUB:
+                    r[c[pc]] = (r[a[pc]] - r[b[pc]]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SLL:
+                    r[c[pc]] = (r[b[pc]] << imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                elif op == SRL:
+                    r[c[pc]] = (r[b[pc]] >> imm[pc]) & 0xFFFFFFFF
+                    pc += 1
+                else:  # SLT
+                    r[c[pc]] = r[a[pc]] < r[b[pc]]
+                    pc += 1
+                if op == SW and address < write_end and address + 4 > write_start:
+                    return STOP_MEM_WRITE, executed
+                if reg >= 0 and r[reg] & 0xFFFFFFFF == value:
+                    return STOP_REG_EQUALS, executed
+                if pc == target:
+                    return STOP_PC, executed
+        finally:
+            self.fake_pc = pc
+        return STOP_MAX_STEPS, executed
@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+
+"""Differential fuzzing of the emulator implementations
+
+Usage : fuzz.py [seconds] [processes] [reference] [tested]
+
+Random programs, initial registers and memory contents are run on two
+implementations ("python", "flat" or "cpp", default python against cpp)
+and the hashes of their final states are compared. A diverging case is
+shrunk to a minimal reproducer before being reported. Without a duration
+the fuzzing runs until interrupted.
+
+Programs only use the implemented instructions and all their jumps and
+branches stay inside the program (the last instruction is a J), so they
+can run any number of instructions.
+"""
+
+import os
+import sys
+import struct
+import random
+import hashlib
+import tempfile
+import itertools
+from timeit import default_timer as clock
+from multiprocessing import Pool, cpu_count
+
+from cpu import decode, signExtImmed
+
+# name -> (module of the Cpu, module of the Memory)
+BACKENDS = {
+    "python" : ("cpu", "memory"),
+    "flat" : ("flatcpu", "memory"),
+    "cpp" : ("cpp_emulator", "cpp_emulator")
+}
+
+# Memory of the fuzzed CPUs, a multiple of the page size
+MEMORY_SIZE = 1024
+PAGES = MEMORY_SIZE >> 8
+PROGRAM_SIZE = 64
+STEPS = 10000
+# Words initialised in the memory
+MEMORY_WORDS = 16
+# Cases run by a worker for each task
+CASES_PER_TASK = 50
+
+OP_R = 0x00
+OP_J = 0x02
+OP_BEQ = 0x04
+OP_ADDI = 0x08
+OP_ANDI = 0x0c
+OP_ORI = 0x0d
+OP_LW = 0x23
+OP_SW = 0x2b
+# R instructions are drawn more often, there are more of them
+OPCODES = (OP_R, OP_R, OP_R, OP_R, OP_BEQ, OP_LW, OP_SW, OP_ANDI, OP_ORI, OP_ADDI, OP_J)
+FUNCTS = {
+    0x24 : "and", 0x25 : "or", 0x27 : "xor", 0x20 : "add",
+    0x22 : "sub", 0x00 : "sll", 0x02 : "srl", 0x2a : "slt"
+}
+MNEMONICS = {
+    OP_BEQ : "beq", OP_ADDI : "addi", OP_ANDI : "andi",
+    OP_ORI : "ori", OP_LW : "lw", OP_SW : "sw"
+}
+# SLL $0, $0, 0
+NOP = 0x00000000
+# Register values at the edges of the arithmetic
+EDGE_VALUES = (0, 1, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF, 0xFFFF, 0x8000)
+
+STATE = struct.Struct("<33I")
+
+
+def load_backend(name):
+    """Return the (Cpu, Memory) classes of an implementation"""
+    cpu_module, memory_module = BACKENDS[name]
+    return (__import__(cpu_module).Cpu, __import__(memory_module).Memory)
+
+
+def random_register(rng):
+    """Registers are mostly taken in the first ones to chain the results"""
+    if rng.randrange(4) == 0:
+        return rng.randrange(32)
+    return rng.randrange(8)
+
+def random_value(rng):
+    kind = rng.randrange(3)
+    if kind == 0:
+        # An address inside the memory
+        return rng.randrange(MEMORY_SIZE)
+    if kind == 1:
+        return rng.choice(EDGE_VALUES)
+    return rng.getrandbits(32)
+
+def random_instruction(rng, index, size):
+    """Return a random instruction at index of a program of size words"""
+    opcode = rng.choice(OPCODES)
+    rs = random_register(rng)
+    rt = random_register(rng)
+    if opcode == OP_R:
+        funct = rng.choice(FUNCTS.keys())
+        return ((rs << 21) | (rt << 16) | (random_register(rng) << 11) |
+                (rng.randrange(32) << 6) | funct)
+    if opcode == OP_J:
+        return (OP_J << 26) | rng.randrange(size)
+    if opcode == OP_BEQ:
+        immed = rng.randrange(size) - index - 1
+    elif opcode in (OP_LW, OP_SW) and rng.randrange(4) != 0:
+        # Mostly around the memory
+        immed = rng.randrange(-4, MEMORY_SIZE // 4) * 4
+    else:
+        immed = rng.getrandbits(16)
+    return (opcode << 26) | (rs << 21) | (rt << 16) | (immed & 0xFFFF)
+
+def random_case(rng, size=PROGRAM_SIZE, steps=STEPS):
+    """Return a case : (program words, registers, memory words as
+       (address, word), number of instructions to run)
+    """
+    words = [random_instruction(rng, index, size) for index in xrange(size - 1)]
+    # Loop back to stay inside the program
+    words.append((OP_J << 26) | rng.randrange(size))
+    registers = [0] + [random_value(rng) for _ in xrange(31)]
+    memory = [(rng.randrange(MEMORY_SIZE // 4 - 1) * 4, rng.getrandbits(32))
+              for _ in xrange(MEMORY_WORDS)]
+    return (words, registers, memory, steps)
+
+
+def disassemble(word):
+    opcode, rs, rt, rd, shamt, funct, immed, addr = decode(word)
+    if opcode == OP_R:
+        if word == NOP:
+            return "nop"
+        return "{} ${}, ${}, ${}, {}".format(FUNCTS.get(funct, "?"), rd, rs, rt, shamt)
+    if opcode == OP_J:
+        return "j {}".format(addr)
+    if opcode in MNEMONICS:
+        return "{} ${}, ${}, {}".format(MNEMONICS[opcode], rt, rs, signExtImmed(immed))
+    return "?"
+
+def format_case(case):
+    words, registers, memory, steps = case
+    lines = ["{} steps".format(steps)]
+    lines += ["r{} = {:#010x}".format(i, value) for i, value in enumerate(registers) if value]
+    lines += ["[{:#06x}] = {:#010x}".format(address, word) for address, word in memory]
+    # The other instructions are NOPs
+    lines += ["{:3d} : {:08x}  {}".format(i, word, disassemble(word))
+              for i, word in enumerate(words) if word != NOP]
+    return "\n".join(lines)
+
+def signature(case):
+    """Mnemonics of the instructions of a shrunk case, the same bug
+       usually shrinks to the same ones
+    """
+    return tuple(sorted(set(disassemble(word).split()[0] for word in case[0] if word != NOP)))
+
+
+class Runner():
+    """Run the cases on two implementations"""
+    def __init__(self, reference="python", tested="cpp"):
+        self.backends = (load_backend(reference), load_backend(tested))
+        self.names = (reference, tested)
+        # Programs are loaded from a file by all the implementations
+        fd, self.path = tempfile.mkstemp(suffix=".mips")
+        os.close(fd)
+        self.program = None
+
+    def close(self):
+        os.remove(self.path)
+
+    def _write_program(self, words):
+        if words != self.program:
+            with open(self.path, "wb") as fd:
+                fd.write(struct.pack("<{}I".format(len(words)), *words))
+            self.program = list(words)
+
+    def state(self, backend, case):
+        """Run the case, return its final state (pc, registers, memory
+           bytes) or the name of the exception raised
+        """
+        words, registers, memory_words, steps = case
+        self._write_program(words)
+        Cpu, Memory = backend
+        memory = Memory(MEMORY_SIZE)
+        for address, word in memory_words:
+            memory.set_word(address, word)
+        cpu = Cpu(memory)
+        cpu.load(self.path)
+        for i, value in enumerate(registers):
+            cpu.r[i] = value
+        try:
+            cpu.step(steps)
+        except Exception as e:
+            return type(e).__name__
+        return (cpu.get_pc() & 0xFFFFFFFF, [r & 0xFFFFFFFF for r in cpu.r],
+                "".join(memory.page(i) for i in xrange(PAGES)))
+
+    def digest(self, state):
+        if isinstance(state, str):
+            return state
+        pc, registers, memory = state
+        return hashlib.sha1(STATE.pack(pc, *registers) + memory).digest()
+
+    def diverges(self, case):
+        return (self.digest(self.state(self.backends[0], case)) !=
+                self.digest(self.state(self.backends[1], case)))
+
+    def describe(self, case):
+        """Return the differences between the final states"""
+        states = [self.state(backend, case) for backend in self.backends]
+        if any(isinstance(state, str) for state in states):
+            return "\n".join("{} : {}".format(name, state if isinstance(state, str) else "ok")
+                             for name, state in zip(self.names, states))
+        (pc0, r0, m0), (pc1, r1, m1) = states
+        lines = []
+        if pc0 != pc1:
+            lines.append("pc : {:#x} != {:#x}".format(pc0, pc1))
+        lines += ["r{} : {:#010x} != {:#010x}".format(i, a, b)
+                  for i, (a, b) in enumerate(zip(r0, r1)) if a != b]
+        lines += ["[{:#06x}] : {:#04x} != {:#04x}".format(i, ord(a), ord(b))
+                  for i, (a, b) in enumerate(zip(m0, m1)) if a != b]
+        return "\n".join("{} ({} != {})".format(line, *self.names) if i == 0 else line
+                         for i, line in enumerate(lines))
+
+
+def shrink(case, diverges):
+    """Return a smaller case still verifying diverges : fewer steps, then
+       instructions replaced by NOPs, registers and memory words cleared
+    """
+    words, registers, memory, steps = case
+    # Smallest number of steps, the divergence usually stays once there
+    low, high = 1, steps
+    while low < high:
+        middle = (low + high) // 2
+        if diverges((words, registers, memory, middle)):
+            high = middle
+        else:
+            low = middle + 1
+    if diverges((words, registers, memory, low)):
+        steps = low
+    words = list(words)
+    for i in xrange(len(words)):
+        if words[i] != NOP:
+            trial = words[:i] + [NOP] + words[i + 1:]
+            if diverges((trial, registers, memory, steps)):
+                words = trial
+    registers = list(registers)
+    for i in xrange(len(registers)):
+        if registers[i]:
+            trial = registers[:i] + [0] + registers[i + 1:]
+            if diverges((words, trial, memory, steps)):
+                registers = trial
+    memory = list(memory)
+    for entry in list(memory):
+        trial = [e for e in memory if e != entry]
+        if diverges((words, registers, trial, steps)):
+            memory = trial
+    return (words, registers, memory, steps)
+
+
+# Worker process state, set by _init_worker
+_worker = {}
+
+def _init_worker(reference, tested):
+    _worker['runner'] = Runner(reference, tested)
+
+def _fuzz_task(seed):
+    """Run CASES_PER_TASK cases drawn from seed
+       Return (instructions run per implementation, shrunk diverging cases)
+    """
+    runner = _worker['runner']
+    rng = random.Random(seed)
+    instructions = 0
+    failures = []
+    for _ in xrange(CASES_PER_TASK):
+        case = random_case(rng)
+        instructions += case[3]
+        if runner.diverges(case):
+            failures.append(shrink(case, runner.diverges))
+    return instructions, failures
+
+
+def fuzz(seconds=None, processes=None, reference="python", tested="cpp", seed=None, report=None):
+    """Fuzz the two implementations for seconds (forever if None)
+       report(case, differences) is called for the first shrunk diverging
+       case of each signature
+       Return (instructions run per implementation, {signature : [cases]})
+    """
+    if seed is None:
+        seed = random.getrandbits(32) << 20
+    pool = Pool(processes or cpu_count(), _init_worker, (reference, tested))
+    runner = Runner(reference, tested)
+    start = clock()
+    instructions = 0
+    found = {}
+    try:
+        for count, failures in pool.imap_unordered(_fuzz_task, itertools.count(seed)):
+            instructions += count
+            for case in failures:
+                key = signature(case)
+                if key not in found and report is not None:
+                    report(case, runner.describe(case))
+                found.setdefault(key, []).append(case)
+            if seconds is not None and clock() - start >= seconds:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+        runner.close()
+    return instructions, found
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    reference = sys.argv[3] if len(sys.argv) > 3 else "python"
+    tested = sys.argv[4] if len(sys.argv) > 4 else "cpp"
+
+    def report(case, differences):
+        print "Divergence ({}) :\n{}\n{}\n".format(", ".join(signature(case)),
+                                                  format_case(case), differences)
+
+    start = clock()
+    try:
+        instructions, failures = fuzz(seconds, processes, reference, tested, report=report)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    elapsed = clock() - start
+    print "{} instructions in {:.1f}s ({:.2f}M/s)".format(
+        instructions, elapsed, instructions / elapsed / 1e6)
+    for key, cases in failures.iteritems():
+        print "{} divergence(s) : {}".format(len(cases), ", ".join(key))
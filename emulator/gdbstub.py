@@ -0,0 +1,384 @@
+#! /usr/bin/env python
+
+"""GDB remote serial protocol stub for the python Cpu
+
+Usage : gdbstub.py <binary> [port]
+then in gdb : set architecture mips ; set endian little ; target remote :<port>
+
+Breakpoints replace the Instruction at their fake_pc by a Trap object,
+watchpoints swap the cpu memory for a WatchMemory while they exist.
+Without any of them, continue is a plain cpu.step() loop.
+"""
+
+import sys
+import socket
+import select
+import struct
+
+from cpu import Cpu
+
+DEFAULT_PORT = 1234
+# Instructions run by continue between two checks of a GDB interruption
+CONTINUE_CHUNK = 100000
+
+# Stop signals
+SIGINT = 2
+SIGTRAP = 5
+SIGSEGV = 11
+
+# Watchpoint kinds, named after their GDB stop reason
+WATCH_WRITE = "watch"
+WATCH_READ = "rwatch"
+WATCH_ACCESS = "awatch"
+
+# Z packet type -> watchpoint kind
+Z_WATCHPOINTS = { 2 : WATCH_WRITE, 3 : WATCH_READ, 4 : WATCH_ACCESS }
+
+# GDB mips register layout : r0-r31, sr, lo, hi, bad, cause, pc
+REGISTERS_COUNT = 38
+PC_REGISTER = 37
+
+
+class BreakpointHit(Exception):
+    pass
+
+
+class WatchpointHit(Exception):
+    def __init__(self, kind, address, value):
+        Exception.__init__(self, kind, address)
+        self.kind = kind
+        self.address = address
+        self.value = value
+
+
+class Trap():
+    """Placeholder of a program instruction stopping the CPU"""
+    def __init__(self, instruction):
+        self.instruction = instruction
+
+    def __index__(self):
+        return self.instruction.raw
+
+    def execute(self):
+        raise BreakpointHit()
+
+
+class WatchMemory():
+    """Memory wrapper checking the accesses against the watchpoints
+       The access is done before raising WatchpointHit
+    """
+    def __init__(self, memory, watchpoints):
+        self.memory = memory
+        # List of (kind, start, end)
+        self.watchpoints = watchpoints
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    def __getitem__(self, address):
+        return self.memory[address]
+
+    def __setitem__(self, address, item):
+        self.memory[address] = item
+
+    def _check(self, access, address, size, value):
+        for kind, start, end in self.watchpoints:
+            if ((kind == access or kind == WATCH_ACCESS) and
+                    address < end and start < address + size):
+                raise WatchpointHit(kind, address, value)
+
+    def get_sword(self, address):
+        value = self.memory.get_sword(address)
+        self._check(WATCH_READ, address, 4, value)
+        return value
+
+    def get_uword(self, address):
+        value = self.memory.get_uword(address)
+        self._check(WATCH_READ, address, 4, value)
+        return value
+
+    def set_word(self, address, word):
+        self.memory.set_word(address, word)
+        self._check(WATCH_WRITE, address, 4, word)
+
+    def set_byte(self, address, byte):
+        self.memory.set_byte(address, byte)
+        self._check(WATCH_WRITE, address, 1, byte)
+
+
+def checksum(data):
+    return sum(ord(c) for c in data) & 0xFF
+
+
+class GdbStub():
+    """Debug a python Cpu through the GDB remote serial protocol"""
+    def __init__(self, cpu):
+        if not isinstance(cpu.program, list) and cpu.program is not None:
+            raise TypeError("GdbStub needs the python Cpu")
+        self.cpu = cpu
+        self.memory = cpu.memory
+        # fake_pc -> Trap
+        self.breakpoints = {}
+        self.watchpoints = []
+        self.sock = None
+        # Hot swaps go through the stub to keep the breakpoints
+        cpu.swap_program = self.swap_program
+
+    # Breakpoints and watchpoints
+
+    def _fake_pc(self, address):
+        return (address - self.cpu.program_start) >> 2
+
+    def insert_breakpoint(self, address):
+        fake_pc = self._fake_pc(address)
+        if fake_pc in self.breakpoints:
+            return
+        if not 0 <= fake_pc < self.cpu.program_size:
+            raise IndexError("breakpoint out of the program")
+        trap = Trap(self.cpu.program[fake_pc])
+        self.breakpoints[fake_pc] = trap
+        self.cpu.program[fake_pc] = trap
+
+    def remove_breakpoint(self, address):
+        trap = self.breakpoints.pop(self._fake_pc(address), None)
+        if trap is not None:
+            self.cpu.program[self._fake_pc(address)] = trap.instruction
+
+    def swap_program(self, path, pc=None):
+        """Cpu.swap_program keeping the breakpoints : the changed
+           instructions under them are trapped again, the ones past the
+           end of the new program are dropped
+        """
+        cpu = self.cpu
+        cpu.__class__.swap_program(cpu, path, pc)
+        for fake_pc, trap in self.breakpoints.items():
+            if fake_pc >= cpu.program_size:
+                del self.breakpoints[fake_pc]
+            elif cpu.program[fake_pc] is not trap:
+                trap = Trap(cpu.program[fake_pc])
+                self.breakpoints[fake_pc] = trap
+                cpu.program[fake_pc] = trap
+
+    def insert_watchpoint(self, kind, address, length):
+        self.watchpoints.append((kind, address, address + length))
+        self._update_memory()
+
+    def remove_watchpoint(self, kind, address, length):
+        try:
+            self.watchpoints.remove((kind, address, address + length))
+        except ValueError:
+            pass
+        self._update_memory()
+
+    def _update_memory(self):
+        """Only keep the WatchMemory while there is watchpoints"""
+        if self.watchpoints:
+            self.cpu.memory = WatchMemory(self.memory, self.watchpoints)
+        else:
+            self.cpu.memory = self.memory
+
+    # Execution
+
+    def _step(self, count):
+        """Run count instructions, return the stop reply or None"""
+        cpu = self.cpu
+        try:
+            cpu.step(count)
+        except BreakpointHit:
+            return "S{:02x}".format(SIGTRAP)
+        except WatchpointHit as hit:
+            # The access is done but the LW/SW has been interrupted, finish it
+            instruction = cpu.program[cpu.fake_pc]
+            if hit.kind != WATCH_WRITE and (instruction.raw >> 26) & 0x3F == 0x23:
+                if instruction.rt != 0:
+                    cpu.r[instruction.rt] = hit.value
+            cpu.fake_pc += 1
+            return "T{:02x}{}:{:x};".format(SIGTRAP, hit.kind, hit.address)
+        except IndexError:
+            # PC is out of the program
+            return "S{:02x}".format(SIGSEGV)
+        return None
+
+    def _step_over_breakpoint(self):
+        """Execute the instruction under a breakpoint, return the stop reply or None"""
+        cpu = self.cpu
+        trap = self.breakpoints.get(cpu.fake_pc)
+        if trap is None:
+            return self._step(1)
+        fake_pc = cpu.fake_pc
+        cpu.program[fake_pc] = trap.instruction
+        try:
+            return self._step(1)
+        finally:
+            cpu.program[fake_pc] = trap
+
+    def single_step(self):
+        """Execute a single instruction and return the stop reply"""
+        return self._step_over_breakpoint() or "S{:02x}".format(SIGTRAP)
+
+    def resume(self, interrupted=lambda: False):
+        """Run until a breakpoint, a watchpoint or interrupted() is true
+           Return the stop reply
+        """
+        reply = self._step_over_breakpoint()
+        while reply is None:
+            if interrupted():
+                return "S{:02x}".format(SIGINT)
+            reply = self._step(CONTINUE_CHUNK)
+        return reply
+
+    # Registers
+
+    def _get_register(self, i):
+        if i < 32:
+            return self.cpu.r[i] & 0xFFFFFFFF
+        if i == PC_REGISTER:
+            return self.cpu.get_pc() & 0xFFFFFFFF
+        return 0
+
+    def _set_register(self, i, value):
+        if 0 < i < 32:
+            self.cpu.r[i] = value
+        elif i == PC_REGISTER:
+            self.cpu.set_pc(value)
+
+    # Protocol
+
+    def handle_packet(self, packet):
+        """Execute a packet and return the reply to send"""
+        command = packet[:1]
+        args = packet[1:]
+        if command == "?":
+            return "S{:02x}".format(SIGTRAP)
+        elif command == "g":
+            return "".join(struct.pack("<I", self._get_register(i)).encode("hex")
+                           for i in xrange(REGISTERS_COUNT))
+        elif command == "G":
+            data = args.decode("hex")
+            for i in xrange(min(len(data) / 4, REGISTERS_COUNT)):
+                self._set_register(i, struct.unpack_from("<I", data, i * 4)[0])
+            return "OK"
+        elif command == "p":
+            return struct.pack("<I", self._get_register(int(args, 16))).encode("hex")
+        elif command == "P":
+            register, value = args.split("=")
+            self._set_register(int(register, 16), struct.unpack("<I", value.decode("hex"))[0])
+            return "OK"
+        elif command == "m":
+            address, length = [int(x, 16) for x in args.split(",")]
+            return "".join("{:02x}".format(self.memory[a]) for a in xrange(address, address + length))
+        elif command == "M":
+            location, data = args.split(":")
+            address = int(location.split(",")[0], 16)
+            for i, byte in enumerate(data.decode("hex")):
+                self.memory[address + i] = ord(byte)
+            return "OK"
+        elif command == "s":
+            if args:
+                self.cpu.set_pc(int(args, 16))
+            return self.single_step()
+        elif command == "c":
+            if args:
+                self.cpu.set_pc(int(args, 16))
+            return self.resume(self._interrupted)
+        elif command in ("Z", "z"):
+            kind, address, length = [int(x, 16) for x in args.split(",")[:3]]
+            if kind in (0, 1):
+                if command == "Z":
+                    self.insert_breakpoint(address)
+                else:
+                    self.remove_breakpoint(address)
+            elif kind in Z_WATCHPOINTS:
+                if command == "Z":
+                    self.insert_watchpoint(Z_WATCHPOINTS[kind], address, length)
+                else:
+                    self.remove_watchpoint(Z_WATCHPOINTS[kind], address, length)
+            else:
+                return ""
+            return "OK"
+        elif command == "H":
+            return "OK"
+        elif packet.startswith("qSupported"):
+            return "PacketSize=4000"
+        elif packet == "qAttached":
+            return "1"
+        elif command in ("D", "k"):
+            return "OK"
+        # Unsupported packet
+        return ""
+
+    def reply(self, packet):
+        """Return the reply to a packet, an error reply if it failed
+           (bad arguments, breakpoint out of the program...)
+        """
+        try:
+            return self.handle_packet(packet)
+        except Exception:
+            return "E01"
+
+    def _interrupted(self):
+        """Check if GDB sent a break (0x03) while the CPU is running"""
+        if self.sock is None:
+            return False
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if readable:
+            data = self.sock.recv(4096)
+            if not data or "\x03" in data:
+                return True
+            self.pending += data
+        return False
+
+    def _read_packet(self):
+        """Return the next packet received, None when GDB is gone"""
+        while True:
+            start = self.pending.find("$")
+            if start >= 0:
+                end = self.pending.find("#", start)
+                if end >= 0 and len(self.pending) >= end + 3:
+                    packet = self.pending[start + 1:end]
+                    self.pending = self.pending[end + 3:]
+                    return packet
+            else:
+                # Acks and breaks outside of a packet are useless here
+                self.pending = ""
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.pending += data
+
+    def _send(self, reply):
+        self.sock.sendall("${}#{:02x}".format(reply, checksum(reply)))
+
+    def serve(self, port=DEFAULT_PORT):
+        """Wait for GDB on localhost:port and serve it until it detaches"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("127.0.0.1", port))
+        server.listen(1)
+        self.sock, _ = server.accept()
+        server.close()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending = ""
+        try:
+            while True:
+                packet = self._read_packet()
+                if packet is None:
+                    break
+                self.sock.sendall("+")
+                self._send(self.reply(packet))
+                if packet[:1] in ("D", "k"):
+                    break
+        finally:
+            self.sock.close()
+            self.sock = None
+
+
+if __name__ == '__main__':
+    cpu = Cpu()
+    cpu.load(sys.argv[1])
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    else:
+        port = DEFAULT_PORT
+    print "Waiting for gdb on port {}".format(port)
+    GdbStub(cpu).serve(port)
@@ -2,6 +2,9 @@
 
 DEFAULT_MEMORY_SIZE = 1024 * 1024
 DEFAULT_BASE_ADDRESS = 0
+# Granularity of the written memory tracking
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT
 
 def signByte(byte):
     if (byte & 0x80):
@@ -34,9 +37,11 @@ class Memory():
     """
     def __init__(self, size=DEFAULT_MEMORY_SIZE, base_address=DEFAULT_BASE_ADDRESS):
         # Create the requested memory area
-        self.a_memory = [0x00 for _ in xrange(size)]
+        self.a_memory = bytearray(size)
         self.base_address = base_address
         self.upper_end = size + base_address
+        # Pages written since track_writes was enabled
+        self.dirty = set()
 
     def __getitem__(self, address):
     	return self.get_ubyte(address)
@@ -100,3 +105,46 @@ class Memory():
             self.a_memory[index + 1] = (word>>8) & 0xFF
             self.a_memory[index + 2] = (word>>16) & 0xFF
             self.a_memory[index + 3] = (word>>24) & 0xFF
+
+    def set_byte_tracked(self, address, byte):
+        """set_byte marking the written page"""
+        if self.base_address <= address < self.upper_end:
+            index = address - self.base_address
+            self.a_memory[index] = byte & 0xFF
+            self.dirty.add(index >> PAGE_SHIFT)
+
+    def set_word_tracked(self, address, word):
+        """set_word marking the written pages"""
+        if self.base_address <= address and address + 4 < self.upper_end:
+            index = address - self.base_address
+            self.a_memory[index] = word & 0xFF
+            self.a_memory[index + 1] = (word>>8) & 0xFF
+            self.a_memory[index + 2] = (word>>16) & 0xFF
+            self.a_memory[index + 3] = (word>>24) & 0xFF
+            self.dirty.add(index >> PAGE_SHIFT)
+            self.dirty.add((index + 3) >> PAGE_SHIFT)
+
+    def track_writes(self, enabled):
+        """Enable/disable the tracking of the written pages (dirty_pages)
+           The tracked setters replace the plain ones only while it is
+           enabled, so stores cost nothing more otherwise. The CPUs fetch
+           set_word when they start running, enable it before.
+        """
+        self.dirty.clear()
+        if enabled:
+            self.set_byte = self.set_byte_tracked
+            self.set_word = self.set_word_tracked
+        else:
+            self.__dict__.pop('set_byte', None)
+            self.__dict__.pop('set_word', None)
+
+    def dirty_pages(self):
+        """Return the sorted indexes of the pages written since the
+           tracking was enabled (page i starts at base_address + i * PAGE_SIZE)
+        """
+        return sorted(self.dirty)
+
+    def page(self, index):
+        """Return the content of a page as a string"""
+        start = index << PAGE_SHIFT
+        return str(bytearray(self.a_memory[start:start + PAGE_SIZE]))
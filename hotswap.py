@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+"""Replace the program of a running simulation, keeping its state
+
+Memory, registers, robot pose and motors are left as they are. The PC is
+moved to the same place of the new program : the label positions are
+read from the assembler sources (one instruction per line) and the PC
+keeps its offset from the closest label before it.
+"""
+
+import os
+import re
+
+LABEL = re.compile(r"\s*([A-Za-z_][A-Za-z_0-9]*)\s*:")
+
+
+class HotSwapError(Exception):
+    pass
+
+
+def labels(source):
+    """Return ({label : instruction index}, number of instructions) of an
+       assembler source
+    """
+    result = {}
+    count = 0
+    for line in source.splitlines():
+        line = line.split(";", 1)[0]
+        match = LABEL.match(line)
+        while match is not None:
+            result[match.group(1)] = count
+            line = line[match.end():]
+            match = LABEL.match(line)
+        if line.strip():
+            count += 1
+    return result, count
+
+
+def remap(fake_pc, old_labels, new_labels, new_count):
+    """Return the index in the new program of the instruction at fake_pc
+       in the old one
+    """
+    # Labels before the pc, closest first
+    before = sorted(((index, name) for name, index in old_labels.iteritems()
+                     if index <= fake_pc), reverse=True)
+    start, offset, end = 0, fake_pc, new_count
+    for index, name in before:
+        if name in new_labels:
+            start = new_labels[name]
+            offset = fake_pc - index
+            # The block ends at the next label
+            end = min([i for i in new_labels.itervalues() if i > start] + [new_count])
+            break
+    # Stay in the block if it got shorter
+    return min(start + offset, max(end - 1, start), new_count - 1)
+
+
+def hot_swap(program, binary, old_source, new_source):
+    """Load binary (compiled from new_source) in the Program running the
+       one compiled from old_source, without resetting it
+       Return the new PC
+    """
+    cpu = program.cpu
+    if not hasattr(cpu, 'swap_program'):
+        raise TypeError("The Cpu can't swap its program")
+    old_labels, old_count = labels(old_source)
+    new_labels, new_count = labels(new_source)
+    if old_count != cpu.program_size or new_count != os.path.getsize(binary) // 4:
+        raise HotSwapError("The sources don't match the programs")
+    fake_pc = remap(cpu.fake_pc, old_labels, new_labels, new_count)
+    cpu.swap_program(binary, cpu.program_start + (fake_pc << 2))
+    program.state_changed()
+    return cpu.get_pc()
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+
+from array import array
+
+class IoCapture():
+    """Robot module recording the writes to I/O bytes of the memory
+       Time is split in samples of period seconds, each one holding the
+       AND and the OR of the values a byte had during it (one byte each
+       per sample and address), so short pulses between two
+       synchronisations stay visible. Writes are reported by write at
+       their exact time (see Program.run_cpu_events), the other changes
+       are read from the memory at each update.
+       Samples are kept in a ring buffer. Blocks of samples are summarised
+       by the AND and the OR of their values, at several block sizes : for
+       a bit, AND set means it stayed high, OR clear means it stayed low.
+       This gives the min/max of every bit over any range without reading
+       all its samples.
+    """
+    # Each summary level groups BLOCK blocks of the previous one
+    BLOCK = 64
+    LEVELS = 3
+    # Must be a multiple of BLOCK ** LEVELS
+    CAPACITY = 1 << 20
+
+    def __init__(self, memory, addresses, period, capacity=CAPACITY):
+        """addresses : I/O bytes to capture
+           period : simulated time (s) covered by a sample
+        """
+        if capacity % (self.BLOCK ** self.LEVELS) != 0:
+            raise ValueError("capacity must be a multiple of {}".format(self.BLOCK ** self.LEVELS))
+        self.memory = memory
+        self.addresses = addresses
+        # Writes to report, (start, end) end excluded
+        self.io_range = (min(addresses), max(addresses) + 1)
+        self.period = period
+        self.capacity = capacity
+        # Block size of each summary level
+        self.sizes = [self.BLOCK ** (level + 1) for level in xrange(self.LEVELS)]
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.data_and = [array('B', [0]) * self.capacity for _ in self.addresses]
+        self.data_or = [array('B', [0]) * self.capacity for _ in self.addresses]
+        # [channel][level] summaries
+        self.ands = [[array('B', [0]) * (self.capacity // size) for size in self.sizes]
+                     for _ in self.addresses]
+        self.ors = [[array('B', [0]) * (self.capacity // size) for size in self.sizes]
+                    for _ in self.addresses]
+        # Summaries of the blocks being filled
+        self.acc_and = [[0xFF] * self.LEVELS for _ in self.addresses]
+        self.acc_or = [[0x00] * self.LEVELS for _ in self.addresses]
+        # Simulated time (s) of the last update
+        self.time = 0.0
+        # Current values, and their AND/OR since the start of the sample being filled
+        self.values = [self.memory[address] for address in self.addresses]
+        self.sample_and = list(self.values)
+        self.sample_or = list(self.values)
+
+    def _advance(self, time):
+        """Add the samples ended at time"""
+        end = int(time / self.period + 1e-6)
+        while self.count < end:
+            self.append(self.sample_and, self.sample_or)
+            self.sample_and = list(self.values)
+            self.sample_or = list(self.values)
+
+    def _set(self, channel, value, time):
+        """Change the value of a channel at time"""
+        self.values[channel] = value
+        if time - self.count * self.period < self.period * 1e-6:
+            # At the start of the sample, the previous value isn't part of it
+            self.sample_and[channel] = self.sample_or[channel] = value
+        else:
+            self.sample_and[channel] &= value
+            self.sample_or[channel] |= value
+
+    def write(self, offset, address, word):
+        """Record a SW of word at address, offset seconds after the last update"""
+        time = self.time + offset
+        self._advance(time)
+        for channel, io in enumerate(self.addresses):
+            if address <= io < address + 4:
+                self._set(channel, (word >> (8 * (io - address))) & 0xFF, time)
+
+    def update(self, dt):
+        self.time += dt
+        self._advance(self.time)
+        # Bytes written by the robot modules, or without reported writes
+        memory = self.memory
+        for channel, address in enumerate(self.addresses):
+            value = memory[address]
+            if value != self.values[channel]:
+                self._set(channel, value, self.time)
+
+    def append(self, ands, ors=None):
+        """Add a sample, ands and ors being the AND and the OR of the values
+           of each address during it (ors defaults to ands, for values
+           which didn't change)
+        """
+        if ors is None:
+            ors = ands
+        index = self.count
+        position = index % self.capacity
+        self.count = index + 1
+        for channel, (value_and, value_or) in enumerate(zip(ands, ors)):
+            self.data_and[channel][position] = value_and
+            self.data_or[channel][position] = value_or
+            acc_and = self.acc_and[channel]
+            acc_or = self.acc_or[channel]
+            acc_and[0] &= value_and
+            acc_or[0] |= value_or
+            # Store the summary of the blocks completed by this sample
+            for level, size in enumerate(self.sizes):
+                if self.count % size != 0:
+                    break
+                summary = self.ands[channel][level]
+                slot = (index // size) % len(summary)
+                summary[slot] = acc_and[level]
+                self.ors[channel][level][slot] = acc_or[level]
+                if level + 1 < self.LEVELS:
+                    acc_and[level + 1] &= acc_and[level]
+                    acc_or[level + 1] |= acc_or[level]
+                acc_and[level] = 0xFF
+                acc_or[level] = 0x00
+
+    def first(self):
+        """Index of the oldest sample still in the buffer"""
+        return max(0, self.count - self.capacity)
+
+    def sample(self, channel, index):
+        """Return the (AND, OR) of a sample"""
+        position = index % self.capacity
+        return self.data_and[channel][position], self.data_or[channel][position]
+
+    def summary(self, channel, start, end):
+        """Return the (AND, OR) of the samples [start, end[ of a channel,
+           None if there are none
+        """
+        start = max(start, self.first())
+        end = min(end, self.count)
+        if start >= end:
+            return None
+        data_and = self.data_and[channel]
+        data_or = self.data_or[channel]
+        ands = self.ands[channel]
+        ors = self.ors[channel]
+        levels = range(self.LEVELS - 1, -1, -1)
+        result_and = 0xFF
+        result_or = 0x00
+        i = start
+        while i < end:
+            for level in levels:
+                size = self.sizes[level]
+                if i % size == 0 and i + size <= end:
+                    slot = (i // size) % len(ands[level])
+                    result_and &= ands[level][slot]
+                    result_or |= ors[level][slot]
+                    i += size
+                    break
+            else:
+                position = i % self.capacity
+                result_and &= data_and[position]
+                result_or |= data_or[position]
+                i += 1
+        return result_and, result_or
+
+    def columns(self, channel, start, end, width):
+        """Decimate the samples [start, end[ into width (AND, OR) columns
+           (None for the columns without samples)
+           Column boundaries are aligned on the largest summary block not
+           bigger than a column, so a column costs at most a few blocks
+        """
+        per_column = float(end - start) / width
+        align = 1
+        for size in self.sizes:
+            if size <= per_column:
+                align = size
+        result = []
+        for column in xrange(width):
+            column_start = start + int(column * per_column)
+            column_end = start + int((column + 1) * per_column)
+            column_start -= column_start % align
+            column_end -= column_end % align
+            if column_end <= column_start:
+                column_end = column_start + 1
+            result.append(self.summary(channel, column_start, column_end))
+        return result
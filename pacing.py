@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+
+from timeit import default_timer as clock
+
+# Real-time factors proposed by the GUI, None runs as fast as possible
+FACTORS = (1.0, 10.0, None)
+
+class Pacer():
+    """Keep a simulation at a target real-time factor
+       tick() is called by a GUI timer : it runs in one batch all the
+       synchronisation steps needed to catch up with the wall time, but
+       never for more than max_batch_time so the GUI keeps responding.
+       Works with anything providing update(), is_idle() and
+       synchronise_step (Program, Arena).
+    """
+    # Wall time (s) a tick may spend simulating, leaves room for a 60fps GUI
+    MAX_BATCH_TIME = 0.012
+    # Simulated time owed is dropped beyond this wall time (s) of lag
+    MAX_LAG = 0.25
+    # Period (s) of the achieved factor measure
+    REPORT_PERIOD = 1.0
+
+    def __init__(self, program, factor=1.0, max_batch_time=MAX_BATCH_TIME):
+        self.program = program
+        self.factor = factor
+        self.max_batch_time = max_batch_time
+        self.reset()
+
+    def reset(self):
+        """Restart the pacing, to call when the simulation is (re)started"""
+        self.last = clock()
+        # Simulated time (s) late on the target
+        self.debt = 0.0
+        self.steps = 0
+        self.report_start = self.last
+        self.report_steps = 0
+        self.achieved = 0.0
+
+    def set_factor(self, factor):
+        """Target real-time factor, None for as fast as possible"""
+        self.factor = factor
+        self.debt = 0.0
+
+    def tick(self):
+        """Run the steps due since the last tick
+           Return the number of synchronisation steps run
+        """
+        now = clock()
+        if self.program.is_idle():
+            # Nothing to run, simulated time can't be late
+            self.last = now
+            self.debt = 0.0
+            self._report(0)
+            return 0
+        step = self.program.synchronise_step
+        deadline = now + self.max_batch_time
+        if self.factor is None:
+            due = None
+        else:
+            self.debt = min(self.debt + (now - self.last) * self.factor,
+                            self.MAX_LAG * self.factor)
+            due = int(self.debt / step)
+        self.last = now
+        steps = 0
+        update = self.program.update
+        while (due is None or steps < due) and clock() < deadline:
+            update()
+            steps += 1
+        if due is not None:
+            self.debt -= steps * step
+        self.steps += steps
+        self._report(steps)
+        return steps
+
+    def _report(self, steps):
+        self.report_steps += steps
+        elapsed = self.last - self.report_start
+        if elapsed >= self.REPORT_PERIOD:
+            self.achieved = self.report_steps * self.program.synchronise_step / elapsed
+            self.report_start = self.last
+            self.report_steps = 0
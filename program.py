@@ -1,8 +1,140 @@
 #! /usr/bin/env python
 
-from emulator import Cpu, Memory
+from timeit import default_timer as clock
+from emulator import Cpu, Memory, STOP_MEM_WRITE
 from robot import Robot, LineSensor
 
+# I/O bytes shared between the CPU and the robot
+MOTOR_IO = 0x10
+SENSOR_IO = 0x21
+# Timer peripheral registers (words), see Timer
+TIMER_COUNT = 0x30
+TIMER_COMPARE = 0x34
+TIMER_SLEEP = 0x38
+
+class Timer:
+    """Memory-mapped timer counting the simulated time in microseconds
+       TIMER_COUNT : current time (wraps at 32 bits), refreshed at each
+                     synchronisation and each time the CPU wakes up
+       TIMER_COMPARE : time to wake up at
+       TIMER_SLEEP : any write puts the CPU to sleep until TIMER_COUNT
+                     reaches TIMER_COMPARE
+       The CPU does not execute anything while sleeping, simulated time
+       jumps directly to the match.
+    """
+    def __init__(self, memory, cpu_freq):
+        self.memory = memory
+        self.cpu_freq = cpu_freq
+        # Simulated CPU cycles elapsed
+        self.cycles = 0
+        self.sleeping = False
+
+    def count(self):
+        """Current time in microseconds"""
+        return self.cycles * 1000000 // self.cpu_freq
+
+    def wake_cycle(self):
+        """Cycle at which the count reaches the compare register"""
+        now = self.count()
+        delta = (self.memory.get_uword(TIMER_COMPARE) - now) & 0xFFFFFFFF
+        # A compare value in the past wakes up immediately
+        if delta == 0 or delta >= 0x80000000:
+            return self.cycles
+        return -(-(now + delta) * self.cpu_freq // 1000000)
+
+    def run(self, cpu, count):
+        """Let the CPU run for count cycles
+           Return the number of instructions actually executed
+        """
+        end = self.cycles + count
+        executed = 0
+        while self.cycles < end:
+            if self.sleeping:
+                wake = self.wake_cycle()
+                if wake >= end:
+                    break
+                self.cycles = max(wake, self.cycles)
+                self.sleeping = False
+            self.memory.set_word(TIMER_COUNT, self.count() & 0xFFFFFFFF)
+            reason, steps = cpu.run_until(end - self.cycles,
+                mem_write_range=(TIMER_SLEEP, TIMER_SLEEP + 4))
+            self.cycles += steps
+            executed += steps
+            if reason == STOP_MEM_WRITE:
+                self.sleeping = True
+        self.cycles = end
+        self.memory.set_word(TIMER_COUNT, self.count() & 0xFFFFFFFF)
+        return executed
+
+class StuckDetector:
+    """Detect when a simulation repeats itself exactly
+       The whole state (registers, PC, memory pages written since
+       Memory.track_writes was enabled, robot pose and motors) is taken at each check and compared with a snapshot
+       saved at growing intervals (Brent's cycle detection), so any cycle
+       is found with a single snapshot kept. As a synchronisation step
+       is a deterministic function of that state, a repeat means the
+       simulation loops forever and nothing new can happen.
+       The world map is expected not to change, reset() otherwise.
+       Only exact repeats are found : a robot pinned against a wall while
+       its program keeps counting (the line tracer's motor and sensor
+       counters) has a state period far longer than any run.
+    """
+    def __init__(self, program):
+        self.program = program
+        self.reset()
+
+    def reset(self):
+        self.saved = None
+        # Checks since the snapshot, and interval before the next one
+        self.length = 0
+        self.power = 1
+
+    def state(self):
+        """Return a snapshot of everything the next steps depend on"""
+        program = self.program
+        cpu = program.cpu
+        memory = program.memory
+        robot = program.robot
+        motors = []
+        for motor in (robot.motorR, robot.motorL):
+            # Beyond 1 / FREQUENCY_MIN the time since the last change no
+            # longer matters : the next change is invalid whatever its value
+            motors += [tuple(motor.magnets), motor.linear_speed, motor.timecap,
+                       min(motor.lastchange, 1.0 / motor.FREQUENCY_MIN)]
+        return (cpu.fake_pc, tuple(cpu.r),
+                tuple((page, memory.page(page)) for page in memory.dirty_pages()),
+                robot.pos_x, robot.pos_y, robot.rotation, tuple(motors))
+
+    def check(self):
+        """Take the state, return the number of checks in the cycle
+           once the state repeated, None otherwise
+        """
+        state = self.state()
+        if self.saved is None:
+            self.saved = state
+            return None
+        self.length += 1
+        if state == self.saved:
+            return self.length
+        if self.length == self.power:
+            self.saved = state
+            self.power *= 2
+            self.length = 0
+        return None
+
+def load_world(path):
+    """Load a world map for a headless run : a TileMap (.ttm), a VectorWorld
+       saved as text (.vw) or, with PyQt4 only, an image
+    """
+    if path.endswith(".ttm"):
+        from tilemap import TileMap
+        return TileMap(path)
+    if path.endswith(".vw"):
+        from vectorworld import VectorWorld
+        return VectorWorld.load(path)
+    from PyQt4 import QtGui
+    return QtGui.QImage(path)
+
 class Program:
     """Represent a running simulation
     """
@@ -10,20 +142,247 @@ class Program:
     CPU_FREQ = 12500000
     # Synchronise rate 1000Hz
     SYNCHRONISE_FREQ=1000
+    # Motor writes collected by a single step_until_io call in exact mode
+    IO_EVENTS=256
 
-    def __init__(self, world_map, cpu_freq=CPU_FREQ, synchronise_freq=SYNCHRONISE_FREQ):
+    def __init__(self, world_map, cpu_freq=CPU_FREQ, synchronise_freq=SYNCHRONISE_FREQ, telemetry=None,
+                 cpu_class=Cpu, timer=False, distance_field=None, exact_io=False,
+                 stuck_detection=False, cache=None, memory_size=None):
+        """cpu_class : class of the CPU to create, for instance the Cpu
+                       of a program translated by emulator/aot.py
+           timer : enable the timer peripheral (see Timer)
+           distance_field : DistanceField of world_map to score the run with
+           exact_io : update the motors at the exact instruction of each
+                      write to their IO byte instead of once per synchronisation
+                      (see run_cpu_events)
+           stuck_detection : stop the simulation once it repeats itself (see
+                             StuckDetector)
+           cache : ProgramCache used by load when the CPU supports it
+           memory_size : size of the RAM in bytes, None for the engine default
+        """
+        self.cpu_freq = cpu_freq
         self.synchronise_step = 1.0 / synchronise_freq
         self.cpu_sample = int(cpu_freq / synchronise_freq)
-        memory = Memory()
-        self.cpu = Cpu(memory)
+        # Simulated time elapsed
+        self.time = 0.0
+        memory = Memory() if memory_size is None else Memory(memory_size)
+        self.memory = memory
+        self.cpu = cpu_class(memory)
+        self.cache = cache
         self.robot = Robot(memory, world_map)
         # Attach the robot's modules
-        line_sensor = LineSensor(lambda out: memory.set_byte(0x21, out), world_map, self.robot)
-        self.robot.modules.append(line_sensor)
+        self.line_sensor = LineSensor(lambda out: memory.set_byte(SENSOR_IO, out), world_map, self.robot)
+        self.robot.modules.append(self.line_sensor)
+        self.exact_io = False
+        self.stuck_detector = None
+        self.set_timer(timer)
+        self.set_stuck_detection(stuck_detection)
+        self.set_exact_io(exact_io)
+        self.score = None
+        self.set_scoring(distance_field)
+        self.capture = None
+        self.set_telemetry(telemetry)
+
+    def load(self, path):
+        """Load the MIPS binary at path in the CPU
+           Engines keeping their decoded programs (CACHE_TAG) load it
+           through the cache
+        """
+        if self.cache is not None and hasattr(self.cpu, 'CACHE_TAG'):
+            self.cpu.load(path, cache=self.cache)
+        else:
+            self.cpu.load(path)
+        self.state_changed()
+
+    def set_capture(self, capture):
+        """Attach an IoCapture module recording the writes to the I/O
+           bytes, None to detach it
+           The CPU reports the writes when it has step_until_io and the
+           timer is disabled, otherwise they are read at each synchronisation
+        """
+        if self.capture is not None:
+            self.robot.modules.remove(self.capture)
+        self.capture = capture
+        if capture is not None:
+            self.robot.modules.append(capture)
+
+    def set_scoring(self, distance_field):
+        """Score the line following with a LineScore module updated each
+           synchronisation, None to disable it
+        """
+        if self.score is not None:
+            self.robot.modules.remove(self.score)
+            self.score = None
+        if distance_field is not None:
+            # numpy is only needed when scoring
+            from distancefield import LineScore
+            self.score = LineScore(distance_field, self.robot)
+            self.robot.modules.append(self.score)
+
+    def set_timer(self, enabled):
+        """Enable/disable the timer peripheral
+           Without it the CPU always runs all its cycles
+        """
+        if enabled:
+            if not hasattr(self.cpu, 'run_until'):
+                raise TypeError("The timer needs a Cpu with run_until")
+            if self.exact_io:
+                raise ValueError("The timer can't be used in exact IO mode")
+            if self.stuck_detector is not None:
+                raise ValueError("The timer can't be used with the stuck detection")
+            self.timer = Timer(self.memory, self.cpu_freq)
+        else:
+            self.timer = None
+
+    def set_stuck_detection(self, enabled):
+        """Enable/disable the stuck detection : update does nothing once
+           the simulation repeated itself, stuck then holds the period (s)
+           of the cycle, a single synchronisation step meaning it converged
+           to a fixed state
+        """
+        if enabled:
+            if self.timer is not None:
+                # Its count is part of the state and never repeats
+                raise ValueError("The stuck detection can't be used with the timer")
+            self.stuck_detector = StuckDetector(self)
+        else:
+            self.stuck_detector = None
+        # The written pages are part of the state, only tracked when needed
+        self.memory.track_writes(enabled)
+        self.stuck = None
+
+    def state_changed(self):
+        """To call when the simulation state is modified outside of update
+           (program loaded, memory written...), restarts the stuck detection
+        """
+        if self.stuck_detector is not None:
+            self.stuck_detector.reset()
+        self.stuck = None
+
+    def check_stuck(self):
+        length = self.stuck_detector.check()
+        if length is not None:
+            self.stuck = length * self.synchronise_step
+
+    def set_exact_io(self, enabled):
+        """Enable/disable the exact co-simulation of the motors (see run_cpu_events)"""
+        if enabled:
+            if not hasattr(self.cpu, 'step_until_io'):
+                raise TypeError("Exact IO needs a Cpu with step_until_io")
+            if self.timer is not None:
+                raise ValueError("The timer can't be used in exact IO mode")
+        self.exact_io = enabled
+
+    def run_cpu(self):
+        """Run the CPU up to the next synchronisation
+           Return the number of instructions executed
+        """
+        if self.exact_io:
+            return self.run_cpu_events()
+        if self.timer is None:
+            if self.capture is not None and hasattr(self.cpu, 'step_until_io'):
+                return self.run_cpu_events()
+            self.cpu.step(self.cpu_sample)
+            return self.cpu_sample
+        return self.timer.run(self.cpu, self.cpu_sample)
+
+    def run_cpu_events(self):
+        """Run the CPU up to the next synchronisation, each write to the IO
+           bytes being handled at its exact simulated time : in exact IO mode
+           the motors are updated with the values written to their IO byte,
+           and the capture records the writes
+        """
+        cpu = self.cpu
+        robot = self.robot if self.exact_io else None
+        capture = self.capture
+        cycle = 1.0 / self.cpu_freq
+        if capture is None:
+            io_range = (MOTOR_IO, MOTOR_IO + 1)
+        elif robot is None:
+            io_range = capture.io_range
+        else:
+            io_range = (min(MOTOR_IO, capture.io_range[0]), max(MOTOR_IO + 1, capture.io_range[1]))
+        executed = 0
+        # Instruction at which the motors were last updated
+        last = 0
+        while executed < self.cpu_sample:
+            steps, events = cpu.step_until_io(self.cpu_sample - executed, io_range, self.IO_EVENTS)
+            for offset, address, value in events:
+                offset += executed
+                if capture is not None:
+                    capture.write(offset * cycle, address, value)
+                if robot is not None and address <= MOTOR_IO < address + 4:
+                    robot.update_motors_io((offset - last) * cycle,
+                                           (value >> (8 * (MOTOR_IO - address))) & 0xFF)
+                    last = offset
+            executed += steps
+        if robot is not None and executed > last:
+            robot.update_motors_io((executed - last) * cycle, self.memory[MOTOR_IO])
+        return executed
+
+    def is_idle(self):
+        """Check if update has nothing to run : no program loaded or stuck
+           (program_size is 0 before loading on all the engines, the C++
+           Cpu always has a program vector)
+        """
+        return self.cpu.program_size == 0 or self.stuck is not None
+
+    def set_telemetry(self, telemetry):
+        """Attach a Telemetry object to collect timings, None to disable it
+           The timed update replaces update only when a telemetry is set,
+           so there is no cost at all when it is disabled
+        """
+        self.telemetry = telemetry
+        if telemetry is None:
+            self.__dict__.pop('update', None)
+        else:
+            self.update = self.update_timed
 
     def update(self):
-        if self.cpu.program is not None:
+        if self.cpu.program_size and self.stuck is None:
             # Make the CPU run the number of instructions between two synchronisations
-            self.cpu.step(self.cpu_sample)
-            # Now update the robot state
+            self.run_cpu()
+            self.synchronise()
+
+    def synchronise(self):
+        """Update the robot state once the CPU ran a synchronisation step
+           (second half of update, also used by Arena)
+        """
+        if self.exact_io:
+            # The motors are already up to date
+            self.robot.update_modules(self.synchronise_step)
+            self.robot.move(self.synchronise_step)
+        else:
             self.robot.update(self.synchronise_step)
+        self.time += self.synchronise_step
+        if self.stuck_detector is not None:
+            self.check_stuck()
+
+    def update_timed(self):
+        """Same as update, but each stage is timed in the telemetry"""
+        if self.is_idle():
+            return
+        telemetry = self.telemetry
+        dt = self.synchronise_step
+        memory = self.memory
+        motor = memory[MOTOR_IO]
+        sensor = memory[SENSOR_IO]
+        t0 = clock()
+        instructions = self.run_cpu()
+        t1 = clock()
+        if not self.exact_io:
+            self.robot.update_motors(dt)
+        t2 = clock()
+        self.robot.update_modules(dt)
+        t3 = clock()
+        self.robot.move(dt)
+        t4 = clock()
+        self.time += dt
+        if self.stuck_detector is not None:
+            self.check_stuck()
+        telemetry.record("cpu", t1 - t0)
+        telemetry.record("motors", t2 - t1)
+        telemetry.record("modules", t3 - t2)
+        telemetry.record("robot", t4 - t3)
+        io_changes = (memory[MOTOR_IO] != motor) + (memory[SENSOR_IO] != sensor)
+        telemetry.tick(dt, instructions, io_changes)
@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+
+"""Offscreen rendering of recorded runs
+
+Usage : render.py <world image> <poses> <output> [trail] [processes]
+
+The poses are recorded during the simulation by a PoseRecorder module :
+    program.robot.modules.append(PoseRecorder(program.robot, "run.poses"))
+Output is a directory receiving a PNG sequence, or a .raw file receiving
+the frames as a raw rgb24 video stream, for instance for ffmpeg :
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s <width>x<height> -r <fps> -i run.raw run.mp4
+trail is the number of previous poses drawn behind the robot, -1 for all.
+
+Frames are drawn on QImages (no display needed) and the frame range is
+split across a process pool.
+"""
+
+import os
+import sys
+import struct
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer as clock
+
+from robot import SPRITE
+
+MAGIC = "TPS1"
+# magic, frames per second
+HEADER = struct.Struct("<4sd")
+# x, y, rotation
+POSE = struct.Struct("<ddd")
+FPS = 60
+# Frames rendered by a worker in a row
+CHUNK_FRAMES = 256
+TRAIL_COLOR = (255, 0, 0)
+
+
+class PoseRecorder():
+    """Robot module writing the robot pose fps times per simulated second"""
+    def __init__(self, robot, path, fps=FPS):
+        self.robot = robot
+        self.period = 1.0 / fps
+        self.time = 0.0
+        self.next_frame = 0.0
+        self.fd = open(path, "wb")
+        self.fd.write(HEADER.pack(MAGIC, fps))
+
+    def update(self, dt):
+        self.time += dt
+        while self.time >= self.next_frame:
+            self.fd.write(POSE.pack(self.robot.pos_x, self.robot.pos_y, self.robot.rotation))
+            self.next_frame += self.period
+
+    def close(self):
+        self.fd.close()
+
+
+def read_poses(path):
+    """Return (fps, list of (x, y, rotation)) recorded by a PoseRecorder"""
+    with open(path, "rb") as fd:
+        data = fd.read()
+    magic, fps = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('"{}" is not a pose stream'.format(path))
+    count = (len(data) - HEADER.size) // POSE.size
+    return fps, [POSE.unpack_from(data, HEADER.size + i * POSE.size) for i in xrange(count)]
+
+
+class Renderer():
+    """Draw the frames of a run, used in each worker process"""
+    def __init__(self, world_path, poses, trail=0, sprite=SPRITE):
+        from PyQt4 import QtCore, QtGui
+        self.QtCore = QtCore
+        self.QtGui = QtGui
+        self.world = QtGui.QImage(world_path).convertToFormat(QtGui.QImage.Format_RGB32)
+        self.sprite = QtGui.QImage(sprite)
+        self.poses = poses
+        self.trail = trail
+        self.trail_pen = QtGui.QPen(QtGui.QColor(*TRAIL_COLOR), 2)
+        # With a full trail the map is drawn once and the trail appended to it
+        self.background = None
+        self.background_frame = 0
+
+    def width(self):
+        return self.world.width()
+
+    def height(self):
+        return self.world.height()
+
+    def _draw_trail(self, painter, start, end):
+        points = [self.QtCore.QPointF(x, y) for x, y, _ in self.poses[start:end + 1]]
+        if len(points) > 1:
+            painter.setPen(self.trail_pen)
+            painter.drawPolyline(self.QtGui.QPolygonF(points))
+
+    def frame(self, index):
+        """Return the QImage of the frame at index"""
+        QtGui = self.QtGui
+        if self.trail < 0:
+            if self.background is None or index < self.background_frame:
+                self.background = self.world.copy()
+                self.background_frame = 0
+            painter = QtGui.QPainter(self.background)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            self._draw_trail(painter, self.background_frame, index)
+            painter.end()
+            self.background_frame = index
+            image = self.background.copy()
+            painter = QtGui.QPainter(image)
+        else:
+            image = self.world.copy()
+            painter = QtGui.QPainter(image)
+            if self.trail > 0:
+                painter.setRenderHint(QtGui.QPainter.Antialiasing)
+                self._draw_trail(painter, max(index - self.trail, 0), index)
+        x, y, rotation = self.poses[index]
+        painter.translate(x, y)
+        painter.rotate(-rotation)
+        painter.drawImage(-self.sprite.width() / 2, -self.sprite.height() / 2, self.sprite)
+        painter.end()
+        return image
+
+    def raw_frame(self, index):
+        """Return the frame at index as rgb24 bytes"""
+        image = self.frame(index).convertToFormat(self.QtGui.QImage.Format_RGB888)
+        data = image.constBits().asstring(image.byteCount())
+        line = image.width() * 3
+        if image.bytesPerLine() == line:
+            return data
+        # Remove the padding at the end of the scan lines
+        return "".join(data[y * image.bytesPerLine():y * image.bytesPerLine() + line]
+                       for y in xrange(image.height()))
+
+
+# Worker process state, set by _init_worker
+_worker = {}
+
+def _init_worker(world_path, poses_path, trail, output):
+    from PyQt4 import QtGui
+    # Non GUI application : no display needed
+    _worker['app'] = QtGui.QApplication(sys.argv, False)
+    _, poses = read_poses(poses_path)
+    _worker['renderer'] = Renderer(world_path, poses, trail)
+    _worker['output'] = output
+
+def _render_range(frames):
+    """Render the frames (start, end) in the output"""
+    renderer = _worker['renderer']
+    output = _worker['output']
+    start, end = frames
+    if output.endswith(".raw"):
+        size = renderer.width() * renderer.height() * 3
+        fd = os.open(output, os.O_WRONLY)
+        try:
+            os.lseek(fd, start * size, os.SEEK_SET)
+            for index in xrange(start, end):
+                os.write(fd, renderer.raw_frame(index))
+        finally:
+            os.close(fd)
+    else:
+        for index in xrange(start, end):
+            renderer.frame(index).save(os.path.join(output, "frame_{:06d}.png".format(index)))
+    return end - start
+
+
+def render(world_path, poses_path, output, trail=0, processes=None):
+    """Render all the frames of the recorded run in output (directory or
+       .raw file), return the number of frames
+    """
+    _, poses = read_poses(poses_path)
+    count = len(poses)
+    if output.endswith(".raw"):
+        # Each worker writes its frames at their place in the file
+        open(output, "wb").close()
+    elif not os.path.isdir(output):
+        os.makedirs(output)
+    ranges = [(start, min(start + CHUNK_FRAMES, count)) for start in xrange(0, count, CHUNK_FRAMES)]
+    pool = Pool(processes or cpu_count(), _init_worker, (world_path, poses_path, trail, output))
+    try:
+        done = sum(pool.map(_render_range, ranges))
+    finally:
+        pool.close()
+        pool.join()
+    return done
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(1)
+    trail = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    processes = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    fps, _ = read_poses(sys.argv[2])
+    tstart = clock()
+    frames = render(sys.argv[1], sys.argv[2], sys.argv[3], trail, processes)
+    elapsed = clock() - tstart
+    # The target is a small fraction of the simulated time
+    simulated = frames / fps
+    print "{} frames ({:.1f}s simulated) rendered in {:.1f}s, {:.1%} of the simulated time".format(
+        frames, simulated, elapsed, elapsed / simulated if simulated else 0.0)
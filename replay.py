@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+"""Open-loop replay of the I/O of a recorded run
+
+Usage : replay.py <binary> <recording> [motors log]
+        replay.py --record <binary> <world (image, .ttm or .vw)> <recording> <seconds>
+
+A run is recorded by an IoRecorder module plugged on its robot :
+    program.robot.modules.append(IoRecorder(program, "run.io"))
+The replay runs the binary on a bare Cpu and Memory, without robot nor
+world map : before each synchronisation the recorded sensor byte is
+written in the memory, after it the motor byte output by the CPU is
+compared with the recorded one. The CPU gets exactly the inputs of the
+recorded run, so the replay is a deterministic, physics free workload
+with the I/O pattern of a real run, to benchmark the emulator engines
+(TRIMPS_EMULATOR selects the one used).
+The motors log receives the motor byte of each synchronisation.
+"""
+
+import sys
+import struct
+from array import array
+from timeit import default_timer as clock
+
+from emulator import Cpu, Memory, IMPLEMENTATION
+from program import MOTOR_IO, SENSOR_IO, load_world
+
+MAGIC = "TIO1"
+# magic, synchronisation step (s), instructions per synchronisation
+HEADER = struct.Struct("<4sdI")
+
+
+class IoRecorder():
+    """Robot module writing the sensor and motor bytes at each synchronisation
+       The sensor byte is the one just computed for the next synchronisation,
+       the motor byte the one output by the CPU during the last one
+    """
+    def __init__(self, program, path):
+        if program.timer is not None:
+            # The CPU doesn't run a fixed number of instructions
+            raise ValueError("Runs using the timer can't be replayed")
+        self.memory = program.memory
+        self.fd = open(path, "wb")
+        self.fd.write(HEADER.pack(MAGIC, program.synchronise_step, program.cpu_sample))
+
+    def update(self, dt):
+        memory = self.memory
+        self.fd.write(chr(memory[SENSOR_IO]) + chr(memory[MOTOR_IO]))
+
+    def close(self):
+        self.fd.close()
+
+
+class Recording():
+    """I/O bytes recorded by an IoRecorder"""
+    def __init__(self, path):
+        with open(path, "rb") as fd:
+            data = fd.read()
+        magic, self.synchronise_step, self.cpu_sample = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('"{}" is not an I/O recording'.format(path))
+        samples = array('B', data[HEADER.size:])
+        self.sensors = samples[0::2]
+        # The last sample may be incomplete if the recording was interrupted
+        self.motors = samples[1::2]
+        del self.sensors[len(self.motors):]
+
+    def __len__(self):
+        return len(self.motors)
+
+    def compare(self, motors):
+        """Return (number of motor bytes different from the recorded ones,
+           index of the first one or None)
+        """
+        different = [i for i, (a, b) in enumerate(zip(self.motors, motors)) if a != b]
+        return len(different), different[0] if different else None
+
+
+def replay(cpu, recording):
+    """Run the cpu with the recorded sensor inputs
+       Return the array of the motor bytes output at each synchronisation
+    """
+    memory = cpu.memory
+    step = cpu.step
+    sample = recording.cpu_sample
+    motors = array('B', [0]) * len(recording)
+    for i, sensor in enumerate(recording.sensors):
+        step(sample)
+        motors[i] = memory[MOTOR_IO]
+        memory.set_byte(SENSOR_IO, sensor)
+    return motors
+
+
+def record(binary, world_map, path, seconds):
+    """Simulate the binary on the world map for seconds and record it"""
+    from program import Program
+    program = Program(world_map)
+    program.load(binary)
+    recorder = IoRecorder(program, path)
+    program.robot.modules.append(recorder)
+    try:
+        while program.time < seconds:
+            program.update()
+    finally:
+        recorder.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--record":
+        if len(sys.argv) < 6:
+            print __doc__
+            sys.exit(1)
+        record(sys.argv[2], load_world(sys.argv[3]), sys.argv[4], float(sys.argv[5]))
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+    recording = Recording(sys.argv[2])
+    # The C++ Cpu doesn't keep its memory alive
+    memory = Memory()
+    cpu = Cpu(memory)
+    cpu.load(sys.argv[1])
+    tstart = clock()
+    motors = replay(cpu, recording)
+    elapsed = clock() - tstart
+    instructions = len(recording) * recording.cpu_sample
+    print "{} : {} synchronisations ({:.3f}s simulated), {} instructions in {:.3f}s ({:.2f}M/s)".format(
+        IMPLEMENTATION, len(recording), len(recording) * recording.synchronise_step,
+        instructions, elapsed, instructions / elapsed / 1e6)
+    different, first = recording.compare(motors)
+    if first is None:
+        print "Motors identical to the recording"
+    else:
+        print "{} motor bytes differ from the recording, first at {:.3f}s".format(
+            different, first * recording.synchronise_step)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "wb") as fd:
+            motors.tofile(fd)
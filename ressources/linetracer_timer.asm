@@ -0,0 +1,238 @@
+;;; File : linetracer_timer
+;;; Brief : The robot follow a line according to it sensors.
+;;;         Same as linetracer, but the timing is done by the timer
+;;;         peripheral instead of busy-wait loops.
+;;; Registers : $8 timer compare value
+;;;             $7 motors output
+;;;                31--------15-------8---7-------0
+;;;                          [Bn An B A] [Bn An B A]
+;;;             $6 right motor counter
+;;;             $5 left motor counter
+;;;             $4 sensors input
+;;;             $3 Sensors counter
+;;;             $2
+;;;             $1
+;;;             $0 always-zero register
+;;; Used instructions : addi, or, ori, andi, beq, lw, sw
+;;;
+;;; Timer : 0x30 count (us), 0x34 compare, 0x38 sleep until count reaches compare
+;;; Tick         : 100us ==> 10kHz
+;;; PMP speed    : 500Hz ==> Motor count : 20
+;;; Fast speed   : 400Hz ==> Motor count : 25
+;;; Medium speed : 300Hz ==> Motor count : 33
+;;; Slow speed   : 200Hz ==> Motor count : 50
+;;; Sensors      : 100Hz ==> Sensors count : 100
+
+	;; First instruction should be useless
+	or $0, $0, $0
+start:
+	;; Initialize the registers
+	or $7, $0, $0
+	or $6, $0, $0
+	or $5, $0, $0
+	or $4, $0, $0
+	or $3, $0, $0
+
+	;; Initialize the motor
+	sw $0, 0x10($0)
+
+	;; Enable the Leds
+	ori $1, $0, 0x7f
+	sw $1, 0x20($0)
+
+
+	;; Initialize the timer
+	lw $8, 0x30($0)
+
+;;;;;;;;;;;;;;; Main loop ;;;;;;;;;;;;;;;;;
+loop:
+	;; Sleep until the next tick
+	addi $8, $8, 100
+	sw $8, 0x34($0)
+	sw $0, 0x38($0)
+
+testSensors:
+	;; Check and update sensors
+	beq $0, $3, upS
+	addi $3, $3, -1
+
+testMR:
+	;; Check and update right motor
+	beq $6, $0, upMR
+	addi $6, $6, -1
+
+testML:
+	;; Check and update left motor
+	beq $5, $0, upML
+	addi $5, $5, -1
+
+updateM:
+	;; Sent the newly created value to the motors
+	sw $7, 0x10($0)
+
+	;; Jump for infinite loop
+	j loop
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+;;;;;;;;;;; Update the sensors  ;;;;;;;;;;;
+upS:
+	lw $4, 0x21($0)
+	ori $3, $0, 100
+	j testMR
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+;;;;;;;;;; Update the right motor ;;;;;;;;;
+upMR:
+	;; Get back the current pole
+	andi $1, $7, 0x000F
+
+	;; Determine it next position according to this array :
+	;; reg1 value      pole activated         next pole
+	;;     0x00             none                 A
+	;;     0x01              A                   B
+	;;     0x02              B                   An
+	;;     0x04              An                  Bn
+	;;     0x08              Bn                  A
+	;;     else             WTF ???              A
+	ori $2, $0, 0x1
+	beq $1, $2, MRsetB
+	ori $2, $0, 0x2
+	beq $1, $2, MRsetAn
+	ori $2, $0, 0x4
+	beq $1, $2, MRsetBn
+	;; If we are here, do the default action : set the motor to A
+MRsetA:
+	ori $1, $0, 0x1
+	beq $0, $0, MRflush
+MRsetB:
+	ori $1, $0, 0x2
+	beq $0, $0, MRflush
+MRsetAn:
+	ori $1, $0, 0x4
+	beq $0, $0, MRflush
+MRsetBn:
+	ori $1, $0, 0x8
+	beq $0, $0, MRflush
+
+MRflush:
+	;; Update $7 with the new right motor value
+	andi $7, $7, 0xFFF0
+	or $7, $7, $1
+
+	;; Now reset the counter according to the input sensors
+	;;          sensors
+	;; Left 0 1 2 3 4 5 6 Right
+
+	;; Test sensor 0
+	andi $2, $4, 0x1
+	beq $2, $0, MRspeedPMP
+
+	;; Test sensor 1
+	andi $2, $4, 0x2
+	beq $2, $0, MRspeedFast
+
+	;; Test sensor 2
+	andi $2, $4, 0x4
+	beq $2, $0, MRspeedMiddle
+
+	;; No left sensors on so default speed on right motor : Slow one
+MRspeedSlow:
+	ori $6, $0, 50
+	;; Go back in the loop
+	beq $0, $0, testML
+
+MRspeedPMP:
+	ori $6, $0, 20
+	;; Go back in the loop
+	beq $0, $0, testML
+
+MRspeedFast:
+	ori $6, $0, 25
+	;; Go back in the loop
+	beq $0, $0, testML
+
+MRspeedMiddle:
+	ori $6, $0, 33
+	;; Go back in the loop
+	beq $0, $0, testML
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+;;;;;;;;;;; Update the left motor ;;;;;;;;;
+upML:
+	;; Get back the current pole
+	andi $1, $7, 0x00F0
+
+	;; Determine it next position according to this array :
+	;; reg1 value      pole activated         next pole
+	;;     0x00             none                 A
+	;;     0x10              A                   Bn
+	;;     0x20              B                   A
+	;;     0x40              An                  B
+	;;     0x80              Bn                  An
+	;;     else             WTF ???              A
+	ori $2, $0, 0x10
+	beq $1, $2, MLsetBn
+	ori $2, $0, 0x20
+	beq $1, $2, MLsetA
+	ori $2, $0, 0x40
+	beq $1, $2, MLsetB
+	ori $2, $0, 0x80
+	beq $1, $2, MLsetAn
+	;; If we are here, do the default action : set the motor to Bn
+MLsetA:
+	ori $1, $0, 0x10
+	beq $0, $0, MLflush
+MLsetB:
+	ori $1, $0, 0x20
+	beq $0, $0, MLflush
+MLsetAn:
+	ori $1, $0, 0x40
+	beq $0, $0, MLflush
+MLsetBn:
+	ori $1, $0, 0x80
+	beq $0, $0, MLflush
+
+MLflush:
+	;; Update $7 with the new left motor value
+	andi $7, $7, 0xFF0F
+	or $7, $7, $1
+
+	;; Now reset the counter according to the input sensors
+	;;          sensors
+	;; Left 0 1 2 3 4 5 6 Right
+
+	;; Test sensor 6
+	andi $2, $4, 0x40
+	beq $2, $0, MLspeedPMP
+
+	;; Test sensor 5
+	andi $2, $4, 0x20
+	beq $2, $0, MLspeedFast
+
+	;; Test sensor 4
+	andi $2, $4, 0x10
+	beq $2, $0, MLspeedMiddle
+
+	;; No left sensors on so default speed on right motor : Slow one
+MLspeedSlow:
+	ori $5, $0, 50
+	;; Go back in the loop
+	beq $0, $0, updateM
+
+MLspeedPMP:
+	ori $5, $0, 20
+	;; Go back in the loop
+	beq $0, $0, updateM
+
+MLspeedFast:
+	ori $5, $0, 25
+	;; Go back in the loop
+	beq $0, $0, updateM
+
+MLspeedMiddle:
+	ori $5, $0, 33
+	;; Go back in the loop
+	beq $0, $0, updateM
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
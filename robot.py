@@ -1,18 +1,33 @@
 #! /usr/bin/env python
 
-from math import cos, sin, atan, pi, copysign
-from PyQt4 import QtCore, QtGui
+from math import cos, sin, atan, pi, copysign, floor
+import struct
 import emulator
 
 DEGTORAD = pi /180
 RADTODEG = 1.0 / DEGTORAD
 
+SPRITE = "ressources/car.png"
+
+def image_size(path):
+    """Return the (width, height) of a PNG image, read from its header
+       so that the robot doesn't need Qt
+    """
+    with open(path, "rb") as fd:
+        header = fd.read(24)
+    if header[:8] != "\x89PNG\r\n\x1a\n" or header[12:16] != "IHDR":
+        raise ValueError('"{}" is not a PNG image'.format(path))
+    return struct.unpack(">II", header[16:24])
+
 class LineSensor():
     """This module detect the black line draw on the ground
        The IO (only used as a output) from io_callback is
        composed of 7 bits representing the presence of light
        (i.e. texture's pixel is not black under the sensor)
     """
+    # Error tolerated on the sensors' position when reusing the last output
+    EPSILON = 1e-6
+
     def __init__(self, io_callback, world_map, robot):
         """io_callback : callback to get/set the IO
            world_map : image were to look for sensor input
@@ -24,8 +39,8 @@ class LineSensor():
         # Compute the position (relative to the robot) of the sensors
         self.sensors = []
         # The sensors are at the end of the robot
-        l = robot.sprite.width() / 2
-        sensor_space = float(robot.sprite.height()) / 7
+        l = robot.width / 2
+        sensor_space = float(robot.height) / 7
         w = -3 * sensor_space
         for _ in xrange(7):
             sensor = {}
@@ -33,36 +48,93 @@ class LineSensor():
             sensor['rayon'] = l / cos(sensor['angle'])
             self.sensors.append(sensor)
             w += sensor_space
+        self.max_rayon = max(sensor['rayon'] for sensor in self.sensors)
+        # Last output and the pose it was computed for
+        self.output = None
 
     def update(self, dt):
         """Update the sensor according to the world
+           The last output is reused as long as the robot moved less than
+           the distance from any sensor to the border of its pixel, this
+           gives the same output as computing it again
         """
+        x = self.robot.pos_x
+        y = self.robot.pos_y
+        rotation = self.robot.rotation
+        if self.output is not None:
+            # Bound of the distance the sensors moved since the last computation
+            moved = (abs(x - self.x) + abs(y - self.y) +
+                     self.max_rayon * abs(rotation - self.rotation) * DEGTORAD)
+            if moved <= self.margin:
+                self.io_callback(self.output)
+                return
+        self.compute(x, y, rotation)
+        self.io_callback(self.output)
+
+    def compute(self, x, y, rotation):
+        """Compute the output for the given robot pose"""
         output = 0x00
+        # Distance from the sensors to the border of their pixel
+        margin = 1.0
+        # Pixels under the sensors
+        xs = []
+        ys = []
         # To get back the value of the pixel under each sensor
         # we have to project the local coordinates of the sensors
         # in the coordinates the robot is
-        x = self.robot.pos_x
-        y = self.robot.pos_y
-        a = self.robot.rotation * DEGTORAD
+        a = rotation * DEGTORAD
+        # Pixels array of the world map if it has one, read without any call
+        # to the map for each sensor
+        pixels = getattr(self.world_map, 'pixels', None)
+        width = self.world_map.width()
+        height = self.world_map.height()
         for i in xrange(7):
             sensor = self.sensors[i]
             b = sensor['angle'] + a
             sensor_x = x + cos(b) * sensor['rayon']
             sensor_y = y - sin(b) * sensor['rayon']
+            fx = sensor_x - floor(sensor_x)
+            fy = sensor_y - floor(sensor_y)
+            margin = min(margin, fx, 1 - fx, fy, 1 - fy)
+            xs.append(sensor_x)
+            ys.append(sensor_y)
             # If the sensor is out of the image, consider it sees white
-            if not ((0 <= sensor_x < self.world_map.width()) and
-                    (0 <= sensor_y < self.world_map.height())):
+            if not ((0 <= sensor_x < width) and (0 <= sensor_y < height)):
                 output |= (1 << i)
+            elif pixels is not None:
+                if pixels.item(int(sensor_y), int(sensor_x)) == 0xFFFFFFFF:
+                    output |= (1 << i)
             elif self.world_map.pixel(sensor_x, sensor_y) == 0xFFFFFFFF:
                 output |= (1 << i)
-        self.io_callback(output)
+        if getattr(self.world_map, 'continuous', False):
+            # Not a grid of pixels, only the very same pose gives the same output
+            margin = 0.0
+        self.output = output
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        # Keep some room for the rounding errors of the projections
+        self.margin = max(margin - self.EPSILON, 0.0)
+        self.footprint = (floor(min(xs)), floor(min(ys)), floor(max(xs)) + 1, floor(max(ys)) + 1)
+
+    def map_changed(self, rect):
+        """Invalidate the cached output if the world map changed under the
+           sensors, rect is (left, top, right, bottom) or None for everywhere
+        """
+        if self.output is None:
+            return
+        if rect is not None:
+            left, top, right, bottom = self.footprint
+            if rect[0] >= right or rect[2] <= left or rect[1] >= bottom or rect[3] <= top:
+                return
+        self.output = None
 
 
 class Motor():
     """Represents a simple stepper electric motor
     """
-    if emulator.IMPLEMENTATION == "python":
-        # Python version is really too slow, "cheat" a bit...
+    if emulator.IMPLEMENTATION != "cpp":
+        # Python versions are really too slow, "cheat" a bit...
         SPEED_COEF=3
     else: # CPP version, faster, really faster !
         SPEED_COEF=0.5
@@ -89,7 +161,11 @@ class Motor():
         """Update the physical state of the motor
         """
         # First we have to get back the current state from the IO
-        io_byte = self.io_callback()
+        self.update_io(dt, self.io_callback())
+
+    def update_io(self, dt, io_byte):
+        """Update the physical state of the motor from the given IO value
+        """
         magnets = [ (io_byte >> i) & 0x1 for i in xrange(4)]
 
         self.lastchange += dt
@@ -133,13 +209,15 @@ class Robot():
     ROTATION_COEF = 2
 
     def __init__(self, memory, world_map, x=50, y=50):
-        self.sprite = QtGui.QPixmap("ressources/car.png")
+        # Sprite drawn by the GUI, its size is the robot's one
+        self.sprite = SPRITE
+        self.width, self.height = image_size(SPRITE)
         self.memory = memory
         self.world_map = world_map
         self.pos_x = x
         self.pos_y = y
-        self.half_width = self.sprite.width() / 2
-        self.half_height = self.sprite.height() / 2
+        self.half_width = self.width / 2
+        self.half_height = self.height / 2
         self.rotation = 90
         # Motors are special builtin modules
         self.motorR = Motor(lambda : (self.memory[0x10]) & 0x0F)
@@ -166,12 +244,28 @@ class Robot():
     def update(self, dt):
         """Update the robot physical state
         """
-        # Update the modules
+        self.update_motors(dt)
+        self.update_modules(dt)
+        self.move(dt)
+
+    def update_motors(self, dt):
+        """Update the motors from the IO"""
         self.motorR.update(dt)
         self.motorL.update(dt)
+
+    def update_motors_io(self, dt, io_byte):
+        """Update the motors from a value of the motors IO byte"""
+        self.motorR.update_io(dt, io_byte & 0x0F)
+        self.motorL.update_io(dt, (io_byte >> 4) & 0x0F)
+
+    def update_modules(self, dt):
+        """Update the modules plugged on the robot"""
         for m in self.modules:
             m.update(dt)
 
+    def move(self, dt):
+        """Move the robot according to the motors' speed
+        """
         # Right motor is mounted backward, we have to invert it speed
         inv_R_linear_speed = -self.motorR.linear_speed
         # Get the total speed from motors' one
@@ -193,7 +287,7 @@ class Robot():
         # Update the robot position
         self.pos_x += straight * cos(self.rotation * DEGTORAD) * dt
         self.pos_y += -straight * sin(self.rotation * DEGTORAD) * dt
-        self.rotation -= copysign(atan(turn/self.sprite.height()), turn) * RADTODEG * dt * self.ROTATION_COEF
+        self.rotation -= copysign(atan(turn/self.height), turn) * RADTODEG * dt * self.ROTATION_COEF
 
         # Check collisions to be sure we're not out of the window
         self.pos_x = min(self.pos_x, self.world_map.width())
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+from timeit import default_timer as clock
+import json
+
+class Telemetry():
+    """Timing counters of the simulation loop
+       Each stage of Program.update (and the GUI painting) reports
+       its wall time here, the cumulated and last tick values are kept.
+       Collection is enabled by attaching the object to a Program
+       (see Program.set_telemetry), without it nothing is measured.
+       The wall time only runs between resume() and pause(), so the
+       real-time factor ignores the time the simulation is stopped.
+    """
+    STAGES = ("cpu", "motors", "modules", "robot", "paint")
+
+    def __init__(self, dump_path=None, dump_period=1.0):
+        """dump_path : file where counters are periodically appended
+                       (one JSON object per line), None to disable it
+           dump_period : wall time (in seconds) between two dumps
+        """
+        self.dump_path = dump_path
+        self.dump_period = dump_period
+        self.running_since = clock()
+        self.reset()
+
+    def reset(self):
+        """Set all the counters back to zero"""
+        self.ticks = 0
+        self.frames = 0
+        self.instructions = 0
+        self.io_changes = 0
+        self.simulated_time = 0.0
+        self.total = dict((stage, 0.0) for stage in self.STAGES)
+        self.last = dict((stage, 0.0) for stage in self.STAGES)
+        # Wall time run before the last resume()
+        self.elapsed = 0.0
+        now = clock()
+        if self.running_since is not None:
+            self.running_since = now
+        self.last_dump = now
+
+    def pause(self):
+        """Stop the wall time, to call when the simulation is stopped"""
+        if self.running_since is not None:
+            self.elapsed += clock() - self.running_since
+            self.running_since = None
+
+    def resume(self):
+        """Restart the wall time, to call when the simulation is (re)started"""
+        if self.running_since is None:
+            self.running_since = clock()
+
+    def record(self, stage, duration):
+        """Account duration (in seconds) to the given stage"""
+        self.total[stage] += duration
+        self.last[stage] = duration
+
+    def tick(self, dt, instructions, io_changes):
+        """Close a simulation tick
+           dt : simulated time elapsed during the tick
+           instructions : number of instructions executed by the CPU
+           io_changes : number of I/O bytes whose value changed during the
+                        tick (several stores to a byte count at most once)
+        """
+        self.ticks += 1
+        self.simulated_time += dt
+        self.instructions += instructions
+        self.io_changes += io_changes
+        if self.dump_path is not None:
+            now = clock()
+            if now - self.last_dump >= self.dump_period:
+                self.last_dump = now
+                self.dump()
+
+    def wall_time(self):
+        """Wall time run since the last reset, paused time excluded"""
+        if self.running_since is None:
+            return self.elapsed
+        return self.elapsed + clock() - self.running_since
+
+    def realtime_factor(self):
+        """Simulated time divided by wall time, 1.0 means real time"""
+        elapsed = self.wall_time()
+        if elapsed <= 0:
+            return 0.0
+        return self.simulated_time / elapsed
+
+    def counters(self):
+        """Return a snapshot of the counters as a dict"""
+        return {
+            'ticks': self.ticks,
+            'frames': self.frames,
+            'instructions': self.instructions,
+            'io_changes': self.io_changes,
+            'simulated_time': self.simulated_time,
+            'wall_time': self.wall_time(),
+            'realtime_factor': self.realtime_factor(),
+            'total': dict(self.total),
+            'last': dict(self.last)
+        }
+
+    def dump(self):
+        """Append the current counters to dump_path"""
+        with open(self.dump_path, "a") as fd:
+            fd.write(json.dumps(self.counters(), sort_keys=True) + "\n")
+
+    def summary(self):
+        """Return the counters as short lines of text (used by the GUI overlay)"""
+        lines = ['x{:.2f} real time'.format(self.realtime_factor()),
+                 '{} ticks, {} instr, {} io changes'.format(self.ticks, self.instructions, self.io_changes)]
+        for stage in self.STAGES:
+            lines.append('{:<8}{:8.3f}ms {:10.3f}s'.format(stage,
+                self.last[stage] * 1000, self.total[stage]))
+        return lines
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+"""Tiled, bit-packed world maps memory-mapped from disk
+
+Usage : tilemap.py <image> <output.ttm> [tile_size]
+
+The image is converted once into a file of square tiles, one bit per pixel
+(1 for white). Each tile is zlib compressed, uniform tiles are not stored at
+all. TileMap memory-maps the file and keeps the decoded tiles in a bounded
+LRU cache, it can replace the QImage given to Program as world map.
+
+File layout : header, then a (offset, size) entry per tile in row-major
+order, then the compressed tiles. An entry of size 0 is a uniform tile
+whose color is given by offset (0 black, 1 white).
+"""
+
+import sys
+import mmap
+import zlib
+import struct
+from collections import OrderedDict
+
+from vectorworld import WHITE, BLACK
+
+MAGIC = "TTM1"
+# magic, width, height, tile size
+HEADER = struct.Struct("<4sIII")
+# offset, size
+ENTRY = struct.Struct("<QI")
+TILE_SIZE = 256
+# Default number of decoded tiles kept in memory (8KB each for 256 pixels tiles)
+CACHE_TILES = 256
+
+
+class TileMapError(Exception):
+    pass
+
+
+def _write(path, width, height, tile_size, read_band):
+    """Write a tile map, read_band(y, rows) returns the rows y to y+rows
+       of the image, each one as a string of packed bits (LSB first)
+    """
+    if tile_size % 8 != 0:
+        raise TileMapError("tile size must be a multiple of 8")
+    tiles_x = (width + tile_size - 1) // tile_size
+    tiles_y = (height + tile_size - 1) // tile_size
+    row_bytes = tiles_x * tile_size // 8
+    tile_bytes = tile_size // 8
+    black = "\x00" * (tile_bytes * tile_size)
+    white = "\xff" * (tile_bytes * tile_size)
+    entries = []
+    with open(path, "wb") as fd:
+        fd.write(HEADER.pack(MAGIC, width, height, tile_size))
+        # Entries are written once all the tiles are known
+        fd.write("\x00" * ENTRY.size * tiles_x * tiles_y)
+        offset = fd.tell()
+        for ty in xrange(tiles_y):
+            y = ty * tile_size
+            rows = read_band(y, min(tile_size, height - y))
+            # Pad the band to full tiles
+            rows = [row[:row_bytes].ljust(row_bytes, "\x00") for row in rows]
+            rows += ["\x00" * row_bytes] * (tile_size - len(rows))
+            for tx in xrange(tiles_x):
+                start = tx * tile_bytes
+                data = "".join(row[start:start + tile_bytes] for row in rows)
+                if data == black:
+                    entries.append((0, 0))
+                elif data == white:
+                    entries.append((1, 0))
+                else:
+                    data = zlib.compress(data)
+                    fd.write(data)
+                    entries.append((offset, len(data)))
+                    offset += len(data)
+        fd.seek(HEADER.size)
+        fd.write("".join(ENTRY.pack(*entry) for entry in entries))
+
+
+def convert(source, path, tile_size=TILE_SIZE):
+    """Convert any world map (width()/height()/pixel()) into a tile map"""
+    width = int(source.width())
+    height = int(source.height())
+
+    def read_band(y0, rows):
+        band = []
+        for y in xrange(y0, y0 + rows):
+            row = bytearray((width + 7) // 8)
+            for x in xrange(width):
+                if source.pixel(x, y) == WHITE:
+                    row[x >> 3] |= 1 << (x & 7)
+            band.append(str(row))
+        return band
+
+    _write(path, width, height, tile_size, read_band)
+
+
+def convert_image(image_path, path, tile_size=TILE_SIZE):
+    """Convert an image file into a tile map
+       The image is read by bands of tile_size rows, so it does not
+       have to fit in memory when its format supports clipped reads.
+       Pixels are thresholded to black and white.
+    """
+    from PyQt4 import QtCore, QtGui
+    reader = QtGui.QImageReader(image_path)
+    size = reader.size()
+    if not size.isValid():
+        raise TileMapError('cannot read "{}"'.format(image_path))
+    width = size.width()
+    height = size.height()
+
+    def read_band(y, rows):
+        band_reader = QtGui.QImageReader(image_path)
+        band_reader.setClipRect(QtCore.QRect(0, y, width, rows))
+        image = band_reader.read()
+        if image.isNull():
+            raise TileMapError('cannot read "{}" : {}'.format(image_path, band_reader.errorString()))
+        image = image.convertToFormat(QtGui.QImage.Format_MonoLSB,
+            QtCore.Qt.MonoOnly | QtCore.Qt.ThresholdDither)
+        # Mono images use a color table, bits must be 1 for white
+        invert = QtGui.QColor(image.color(1)) != QtGui.QColor(QtCore.Qt.white)
+        data = image.constBits().asstring(image.byteCount())
+        line = image.bytesPerLine()
+        band = []
+        for i in xrange(rows):
+            row = data[i * line:i * line + (width + 7) // 8]
+            if invert:
+                row = "".join(chr(~ord(c) & 0xFF) for c in row)
+            band.append(row)
+        return band
+
+    _write(path, width, height, tile_size, read_band)
+
+
+class TileMap():
+    """World map read from a tile map file
+       Provides the width()/height()/pixel() interface of QImage
+    """
+    def __init__(self, path, cache_tiles=CACHE_TILES):
+        self.cache_tiles = cache_tiles
+        self.fd = open(path, "rb")
+        self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < HEADER.size or self.data[:len(MAGIC)] != MAGIC:
+            self.data.close()
+            self.fd.close()
+            raise TileMapError('"{}" is not a tile map'.format(path))
+        magic, self._width, self._height, self.tile_size = HEADER.unpack_from(self.data, 0)
+        self.tiles_x = (self._width + self.tile_size - 1) // self.tile_size
+        size = self.tile_size * self.tile_size // 8
+        self.uniform = ("\x00" * size, "\xff" * size)
+        # Tile index -> decoded tile, least recently used first
+        self.tiles = OrderedDict()
+        # Sensors read the same tile most of the time, keep it at hand
+        self.last_index = None
+        self.last_tile = None
+
+    def close(self):
+        self.tiles.clear()
+        self.last_index = self.last_tile = None
+        self.data.close()
+        self.fd.close()
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def tile(self, index):
+        """Return the decoded tile (packed bits) at the given index"""
+        tile = self.tiles.pop(index, None)
+        if tile is None:
+            offset, size = ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)
+            if size == 0:
+                tile = self.uniform[offset]
+            else:
+                tile = zlib.decompress(self.data[offset:offset + size])
+            if len(self.tiles) >= self.cache_tiles:
+                self.tiles.popitem(last=False)
+        self.tiles[index] = tile
+        return tile
+
+    def pixel(self, x, y):
+        """Return the color at (x, y), 0 when outside like QImage"""
+        x = int(x)
+        y = int(y)
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return 0
+        size = self.tile_size
+        index = (y // size) * self.tiles_x + x // size
+        if index != self.last_index:
+            self.last_tile = self.tile(index)
+            self.last_index = index
+        i = (y % size) * size + x % size
+        if (ord(self.last_tile[i >> 3]) >> (i & 7)) & 1:
+            return WHITE
+        return BLACK
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        tile_size = int(sys.argv[3])
+    else:
+        tile_size = TILE_SIZE
+    convert_image(sys.argv[1], sys.argv[2], tile_size)
@@ -1,12 +1,43 @@
 #! /usr/bin/env python
 
 import sys, os
-from PyQt4 import QtCore, QtGui, uic
-from program import Program
+
+# "--emulator <cpp|python|flat>" selects the emulator implementation, it
+# must be known before the emulator package is imported
+if "--emulator" in sys.argv[:-1]:
+    os.environ["TRIMPS_EMULATOR"] = sys.argv[sys.argv.index("--emulator") + 1]
+
+from PyQt4 import QtCore, QtGui
+from program import Program, MOTOR_IO, SENSOR_IO
+from telemetry import Telemetry
+from pacing import Pacer, FACTORS
+from iocapture import IoCapture
+from uitimeline import UiTimeline
+from hotswap import hot_swap, HotSwapError
+from emulator import ProgramCache
 import tempfile
 
 DEFAULT_SRC="ressources/linetracer.asm"
 COMPILER="ressources/gopiler"
+# Simulation ticks at the GUI refresh rate, the pacer batches the steps
+TICK_PERIOD=1000/60
+UI_FILE="mainwindow.ui"
+# Python module compiled from UI_FILE, regenerated when UI_FILE changes
+UI_MODULE="ui_mainwindow.py"
+
+def load_form():
+    """Return the form class generated from UI_FILE
+       uic is only imported when the cached module is out of date
+    """
+    if (not os.path.exists(UI_MODULE) or
+            os.path.getmtime(UI_MODULE) < os.path.getmtime(UI_FILE)):
+        from PyQt4 import uic
+        tmp_file = UI_MODULE + ".tmp"
+        with open(tmp_file, "w") as fd:
+            uic.compileUi(UI_FILE, fd)
+        os.rename(tmp_file, UI_MODULE)
+    from ui_mainwindow import Ui_MainWindow
+    return Ui_MainWindow
 
 class CompilationError(Exception):
     def __init__(self, msg):
@@ -43,23 +74,114 @@ class Ui(QtGui.QMainWindow):
     """
     def __init__(self):
         super(Ui, self).__init__()
-        self.ui = uic.loadUi('mainwindow.ui', self)
+        self.ui = load_form()()
+        self.ui.setupUi(self)
         self.ui.button_run.clicked.connect(self.run)
         self.ui.button_clear.clicked.connect(self.ui.widget_world.clear)
-        self.ui.show()
+        self.show()
         with open(DEFAULT_SRC) as fd:
             self.ui.textEdit_source.setPlainText(fd.read())
         # Compilation stuff
         self.compile_out_bin = None
         self.compile_out_vhdl = ""
+        # Source of the program running, to hot swap it
+        self.loaded_source = None
         self.ui.button_compile.clicked.connect(self.update_compile)
         # Robot simulator program
-        self.program = Program(self.ui.widget_world.image)
+        try:
+            cache = ProgramCache()
+        except (OSError, IOError):
+            # Cache directory can't be created (read-only home...), run without it
+            cache = None
+        self.program = Program(self.ui.widget_world.world_map, cache=cache)
         self.program_timer = QtCore.QTimer(self)
-        self.program_timer.timeout.connect(self.program.update)
+        self.program_timer.timeout.connect(self.tick)
         self.program_running = False
+        self.pacer = Pacer(self.program)
+        for factor in FACTORS:
+            self.ui.comboBox_speed.addItem("max" if factor is None else "x{:g}".format(factor))
+        self.ui.comboBox_speed.currentIndexChanged.connect(
+            lambda index: self.pacer.set_factor(FACTORS[index]))
         # Don't forget to connect the robot to the Qt world
         self.ui.widget_world.robot = self.program.robot
+        self.ui.widget_world.listeners.append(self.program.line_sensor.map_changed)
+        # Telemetry, TRIMPS_TELEMETRY env variable is the file to dump it to
+        self.telemetry = Telemetry(dump_path=os.environ.get("TRIMPS_TELEMETRY"))
+        self.telemetry.pause()
+        self.ui.checkBox_telemetry.toggled.connect(self.toggle_telemetry)
+        self.ui.checkBox_telemetry.setChecked(self.telemetry.dump_path is not None)
+        # Logic analyzer of the I/O bytes, only captured while it is shown
+        # Samples are finer than the synchronisations to show the writes in between
+        self.capture = IoCapture(self.program.memory, (MOTOR_IO, SENSOR_IO),
+                                 self.program.synchronise_step / 10)
+        self.timeline = UiTimeline()
+        self.dock_timeline = QtGui.QDockWidget("I/O timeline", self)
+        self.dock_timeline.setWidget(self.timeline)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.dock_timeline)
+        self.dock_timeline.hide()
+        self.dock_timeline.visibilityChanged.connect(self.toggle_capture)
+        self.ui.menubar.addAction(self.dock_timeline.toggleViewAction())
+        # Timer peripheral, needed by programs sleeping on it
+        self.ui.checkBox_timer.toggled.connect(self.toggle_timer)
+        # Line following score, the distance field is built when first enabled
+        self.distance_field = None
+        self.ui.checkBox_score.toggled.connect(self.toggle_score)
+
+    def tick(self):
+        """Run the simulation steps due since the last tick"""
+        self.pacer.tick()
+        message = "Real-time factor : x{:.2f}".format(self.pacer.achieved)
+        score = self.program.score
+        if score is not None:
+            message += " | deviation {:.1f}px (max {:.1f}px), off line {:.1f}s, {:.2f} laps".format(
+                score.mean_deviation(), score.max_deviation, score.time_off_line, score.laps())
+        self.ui.statusbar.showMessage(message)
+
+    def toggle_telemetry(self, enabled):
+        """Enable/disable the telemetry collection and its overlay
+        """
+        if enabled:
+            self.telemetry.reset()
+            self.program.set_telemetry(self.telemetry)
+            self.ui.widget_world.telemetry = self.telemetry
+        else:
+            self.program.set_telemetry(None)
+            self.ui.widget_world.telemetry = None
+
+    def toggle_timer(self, enabled):
+        """Enable/disable the timer peripheral, untick it if the
+           simulation can't use it
+        """
+        try:
+            self.program.set_timer(enabled)
+        except (TypeError, ValueError) as e:
+            self.ui.checkBox_timer.setChecked(False)
+            self.ui.statusbar.showMessage(str(e))
+
+    def toggle_score(self, enabled):
+        """Score the line following from now on, the distance field is
+           then kept up to date with the strokes drawn
+        """
+        if enabled and self.distance_field is None:
+            try:
+                from distancefield import DistanceField
+            except ImportError:
+                self.ui.checkBox_score.setChecked(False)
+                self.ui.statusbar.showMessage("The score needs numpy")
+                return
+            world = self.ui.widget_world
+            self.distance_field = DistanceField(world.world_map)
+            world.listeners.append(self.distance_field.update)
+        self.program.set_scoring(self.distance_field if enabled else None)
+
+    def toggle_capture(self, visible):
+        """Capture the I/O bytes only while the timeline is visible"""
+        if visible and self.program.capture is None:
+            self.capture.reset()
+            self.program.set_capture(self.capture)
+            self.timeline.capture = self.capture
+        elif not visible:
+            self.program.set_capture(None)
 
     def update_compile(self):
         """Compile the source buffer
@@ -69,14 +191,24 @@ class Ui(QtGui.QMainWindow):
             # Reset the console's background
             palette.setColor(QtGui.QPalette.Base, QtCore.Qt.white)
             self.ui.textEdit_console.setPalette(palette)
-            bin_file = compile_buffer(self.ui.textEdit_source.toPlainText(), mode='binary')
-            vhdl_file = compile_buffer(self.ui.textEdit_source.toPlainText(), mode='vhdl')
+            source = unicode(self.ui.textEdit_source.toPlainText()).encode("utf-8")
+            bin_file = compile_buffer(source, mode='binary')
+            vhdl_file = compile_buffer(source, mode='vhdl')
             self.ui.textEdit_console.setPlainText("Compilation done !")
             # Update the vhdl output window
             with open(vhdl_file, "rb") as ofd:
                 self.ui.textEdit_vhdl.setPlainText(ofd.read())
             # Load the binary in the robot
-            self.program.cpu.load(bin_file)
+            if self.ui.checkBox_hotswap.isChecked() and self.loaded_source is not None:
+                try:
+                    pc = hot_swap(self.program, bin_file, self.loaded_source, source)
+                    self.ui.textEdit_console.appendPlainText("Program swapped, pc : {:#x}".format(pc))
+                except HotSwapError as e:
+                    self.ui.textEdit_console.appendPlainText("{}, program reloaded".format(e))
+                    self.program.load(bin_file)
+            else:
+                self.program.load(bin_file)
+            self.loaded_source = source
         except CompilationError as e:
             # Turn the console red and display the error
             palette.setColor(QtGui.QPalette.Base, QtCore.Qt.red)
@@ -107,7 +239,7 @@ class Ui(QtGui.QMainWindow):
                     self.ui.textEdit_vhdl.setPlainText(ofd.read())
             else:
                 # Load the binary in the robot
-                self.program.cpu.load(output_file)
+                self.program.load(output_file)
         else:
             with open(err_file, "r") as efd:
                 self.ui.textEdit_console.appendPlainText(efd.read())
@@ -117,9 +249,12 @@ class Ui(QtGui.QMainWindow):
            If the program is already started, stop it
         """
         if not self.program_running:
-            self.program_timer.start(self.program.synchronise_step * 1000)
+            self.pacer.reset()
+            self.telemetry.resume()
+            self.program_timer.start(TICK_PERIOD)
         else:
             self.program_timer.stop()
+            self.telemetry.pause()
         self.program_running = not self.program_running
 
 
@@ -127,4 +262,7 @@ if __name__ == '__main__':
     # Create the Ui
     app = QtGui.QApplication(sys.argv)
     w = Ui()
+    if "--startup" in sys.argv:
+        # Startup benchmark : quit as soon as the window is ready
+        QtCore.QTimer.singleShot(0, app.quit)
     sys.exit(app.exec_())
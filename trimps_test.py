@@ -0,0 +1,835 @@
+#! /usr/bin/env python
+
+"""Tests of the simulation modules, to run from the repository root
+(the robot reads its sprite size from ressources/)
+"""
+
+import os
+import json
+import struct
+import random
+import tempfile
+import threading
+import unittest
+
+from emulator import Cpu, Memory
+from arena import Arena
+from pacing import Pacer
+from robot import Robot, Motor, LineSensor
+import tilemap
+from program import Program, Timer, load_world, TIMER_COUNT, MOTOR_IO, SENSOR_IO
+from iocapture import IoCapture
+from vectorworld import VectorWorld, WHITE, BLACK
+import hotswap
+import render
+import replay
+import control
+import telemetry
+
+try:
+    from PyQt4 import QtGui
+except ImportError:
+    QtGui = None
+try:
+    import numpy
+    import distancefield
+except ImportError:
+    distancefield = None
+
+LINETRACER = "tests/linetracer.mips"
+
+
+class Test_arena(unittest.TestCase):
+
+    def testSeparation(self):
+        arena = Arena(VectorWorld(400, 400))
+        a = arena.add_robot(LINETRACER, 200, 200).robot
+        b = arena.add_robot(LINETRACER, 205, 203).robot
+        c = arena.add_robot(LINETRACER, 100, 100).robot
+        d = arena.add_robot(LINETRACER, 100, 100).robot
+        arena.collide()
+        self.assertEqual(len(arena.contacts), 2)
+        distance_min = 2 * arena.radius
+        for p, q in ((a, b), (c, d)):
+            distance = ((p.pos_x - q.pos_x) ** 2 + (p.pos_y - q.pos_y) ** 2) ** 0.5
+            self.assertAlmostEqual(distance, distance_min)
+        # Robots at the same position are pushed apart around it
+        self.assertAlmostEqual(c.pos_x + d.pos_x, 200)
+        self.assertEqual((c.pos_y, d.pos_y), (100, 100))
+
+    def testUpdate(self):
+        # A line per robot, far enough not to collide
+        world = VectorWorld(400, 600)
+        for y in (100, 300, 500):
+            world.add_segment(0, y, 400, y, 10)
+        arena = Arena(world, stuck_detection=True)
+        starts = ((100, 100, 0), (300, 300, 180), (100, 500, 0))
+        robots = [arena.add_robot(LINETRACER, *start) for start in starts]
+        # j 0 : stuck, it is not run anymore once detected
+        path = write_program([0x08000000])
+        try:
+            spinning = arena.add_robot(path, 350, 200)
+        finally:
+            os.remove(path)
+        for _ in xrange(100):
+            arena.update()
+        self.assertAlmostEqual(arena.time, 0.1)
+        self.assertEqual(spinning.stuck, spinning.synchronise_step)
+        self.assertTrue(spinning.time < 0.05)
+        self.assertFalse(arena.is_idle())
+        self.assertEqual(arena.contacts, [])
+        # Interleaved, with a smaller memory, the robots run as they do alone
+        for program, (x, y, rotation) in zip(robots, starts):
+            alone = Program(world, stuck_detection=True)
+            alone.load(LINETRACER)
+            alone.robot.pos_x, alone.robot.pos_y, alone.robot.rotation = x, y, rotation
+            for _ in xrange(100):
+                alone.update()
+            self.assertAlmostEqual(program.time, 0.1)
+            self.assertEqual(program.stuck, None)
+            self.assertNotEqual((program.robot.pos_x, program.robot.pos_y), (x, y))
+            self.assertEqual((program.robot.pos_x, program.robot.pos_y, program.robot.rotation),
+                             (alone.robot.pos_x, alone.robot.pos_y, alone.robot.rotation))
+            self.assertEqual(list(program.cpu.r), list(alone.cpu.r))
+
+
+def random_world(rng, width=160, height=120, segments=12):
+    world = VectorWorld(width, height, cell_size=16)
+    for _ in xrange(segments):
+        world.add_segment(rng.uniform(-10, width + 10), rng.uniform(-10, height + 10),
+                          rng.uniform(-10, width + 10), rng.uniform(-10, height + 10),
+                          rng.choice((1, 4, 10, 40)))
+    return world
+
+
+class Test_vectorworld(unittest.TestCase):
+
+    def raster(self, world, x, y):
+        """Color at (x, y) checked against all the segments"""
+        for x0, y0, x1, y1, half in world.segments:
+            dx = x1 - x0
+            dy = y1 - y0
+            t = max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / float(dx * dx + dy * dy)))
+            if (x0 + t * dx - x) ** 2 + (y0 + t * dy - y) ** 2 <= half * half:
+                return BLACK
+        return WHITE
+
+    def testSampling(self):
+        # The grid index finds the segments of every point, even between cells
+        world = random_world(random.Random(3))
+        for y in xrange(0, 120):
+            for x in xrange(0, 160):
+                for px, py in ((x, y), (x + 0.5, y + 0.5)):
+                    self.assertEqual(world.pixel(px, py), self.raster(world, px, py))
+
+    def testSaveLoad(self):
+        world = random_world(random.Random(4))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            world.save(path)
+            loaded = VectorWorld.load(path, cell_size=16)
+        finally:
+            os.remove(path)
+        self.assertEqual(loaded.segments, world.segments)
+        self.assertEqual(loaded.cells, world.cells)
+
+
+class Test_tilemap(unittest.TestCase):
+
+    def setUp(self):
+        # Sparse enough to have uniform tiles, stored without data
+        self.world = random_world(random.Random(5), segments=4)
+        fd, self.path = tempfile.mkstemp(suffix=".ttm")
+        os.close(fd)
+        tilemap.convert(self.world, self.path, 32)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testRoundTrip(self):
+        tiles = tilemap.TileMap(self.path)
+        try:
+            self.assertEqual((tiles.width(), tiles.height()), (160, 120))
+            for y in xrange(120):
+                for x in xrange(160):
+                    self.assertEqual(tiles.pixel(x, y), self.world.pixel(x, y))
+            # Outside like QImage
+            self.assertEqual(tiles.pixel(160, 0), 0)
+            self.assertEqual(tiles.pixel(-1, 0), 0)
+        finally:
+            tiles.close()
+
+    def testCacheBound(self):
+        tiles = tilemap.TileMap(self.path, cache_tiles=3)
+        try:
+            for y in xrange(0, 120, 7):
+                for x in xrange(0, 160, 7):
+                    tiles.pixel(x, y)
+                    self.assertTrue(len(tiles.tiles) <= 3)
+            # The least recently used tile is dropped
+            tiles.tiles.clear()
+            for index in (0, 1, 2, 0, 3):
+                tiles.tile(index)
+            self.assertEqual(list(tiles.tiles), [2, 0, 3])
+        finally:
+            tiles.close()
+
+    def testBadFile(self):
+        self.assertRaises(tilemap.TileMapError, tilemap.TileMap, "trimps_test.py")
+
+
+class Test_linesensor(unittest.TestCase):
+
+    def testCache(self):
+        # Pixel grid : the output is reused while the sensors stay in their pixels
+        fd, path = tempfile.mkstemp(suffix=".ttm")
+        os.close(fd)
+        try:
+            tilemap.convert(random_world(random.Random(6), segments=30), path, 32)
+            tiles = tilemap.TileMap(path)
+            outputs = []
+            robot = Robot(Memory(), tiles, 50, 60)
+            cached = LineSensor(outputs.append, tiles, robot)
+            computed = []
+            compute = cached.compute
+            cached.compute = lambda *pose: computed.append(pose) or compute(*pose)
+            reference = LineSensor(None, tiles, robot)
+            rng = random.Random(7)
+            # Steps of a robot moving at a few pixels per second, drifting right
+            for _ in xrange(5000):
+                robot.pos_x += rng.uniform(-0.005, 0.015)
+                robot.pos_y += rng.uniform(-0.01, 0.01)
+                robot.rotation += rng.uniform(-0.01, 0.01)
+                cached.update(0.001)
+                reference.compute(robot.pos_x, robot.pos_y, robot.rotation)
+                self.assertEqual(outputs[-1], reference.output)
+            tiles.close()
+        finally:
+            os.remove(path)
+        self.assertTrue(len(set(outputs)) > 1)
+        # The cache was used
+        self.assertTrue(len(computed) < len(outputs) / 2)
+
+
+class Test_pacing(unittest.TestCase):
+
+    def testIdle(self):
+        program = Program(VectorWorld(100, 100))
+        pacer = Pacer(program, None)
+        # No program loaded
+        self.assertEqual(pacer.tick(), 0)
+        program.load(LINETRACER)
+        self.assertTrue(pacer.tick() > 0)
+        # Stuck simulation
+        program.stuck = program.synchronise_step
+        self.assertEqual(pacer.tick(), 0)
+        self.assertEqual(pacer.debt, 0.0)
+
+
+def write_program(words):
+    """Write a MIPS binary in a temporary file, return its path"""
+    fd, path = tempfile.mkstemp(suffix=".mips")
+    os.write(fd, struct.pack("<{}I".format(len(words)), *words))
+    os.close(fd)
+    return path
+
+
+class Test_stuck(unittest.TestCase):
+
+    def run_program(self, words, updates=200):
+        path = write_program(words)
+        try:
+            program = Program(VectorWorld(100, 100), stuck_detection=True)
+            program.load(path)
+        finally:
+            os.remove(path)
+        for _ in xrange(updates):
+            program.update()
+        return program
+
+    def testConverged(self):
+        # j 0
+        program = self.run_program([0x08000000])
+        self.assertEqual(program.stuck, program.synchronise_step)
+        self.assertTrue(program.time < 0.1)
+        self.assertTrue(program.is_idle())
+        # Nothing runs once stuck, until the state is changed
+        time = program.time
+        program.update()
+        self.assertEqual(program.time, time)
+        program.state_changed()
+        program.update()
+        self.assertTrue(program.time > time)
+
+    def testCycle(self):
+        """Program used :
+               addi $1, $1, 1
+               andi $1, $1, 1
+               sw $1, 0x100($0)
+               nop
+               nop
+               j 0
+           12500 instructions per synchronisation : the PC at the
+           synchronisations repeats every 3 of them
+        """
+        program = self.run_program([0x20210001, 0x30210001, 0xAC010100, 0, 0, 0x08000000])
+        self.assertAlmostEqual(program.stuck, 3 * program.synchronise_step)
+        # With the sensor byte, written by the robot
+        self.assertEqual(list(program.memory.dirty_pages()), [0, 1])
+
+    def testCounter(self):
+        """Program used :
+               addi $1, $1, 1
+               sw $1, 0x100($0)
+               j 0
+        """
+        program = self.run_program([0x20210001, 0xAC010100, 0x08000000], 50)
+        self.assertEqual(program.stuck, None)
+        program.set_stuck_detection(False)
+        self.assertEqual(list(program.memory.dirty_pages()), [])
+
+
+class Test_telemetry(unittest.TestCase):
+
+    def setUp(self):
+        # Wall time driven by the test
+        self.now = 100.0
+        self.clock = telemetry.clock
+        telemetry.clock = lambda: self.now
+
+    def tearDown(self):
+        telemetry.clock = self.clock
+
+    def testTick(self):
+        counters = telemetry.Telemetry()
+        counters.record("cpu", 0.002)
+        counters.tick(0.001, 12500, 1)
+        counters.record("cpu", 0.003)
+        counters.tick(0.001, 12500, 2)
+        self.now += 0.004
+        values = counters.counters()
+        self.assertEqual((values['ticks'], values['instructions'], values['io_changes']),
+                         (2, 25000, 3))
+        self.assertAlmostEqual(values['simulated_time'], 0.002)
+        self.assertAlmostEqual(values['wall_time'], 0.004)
+        self.assertAlmostEqual(values['realtime_factor'], 0.5)
+        self.assertAlmostEqual(values['total']['cpu'], 0.005)
+        self.assertAlmostEqual(values['last']['cpu'], 0.003)
+        self.assertEqual(counters.summary()[1], '2 ticks, 25000 instr, 3 io changes')
+        counters.reset()
+        self.assertEqual(counters.counters()['ticks'], 0)
+        self.assertEqual(counters.wall_time(), 0.0)
+
+    def testPause(self):
+        counters = telemetry.Telemetry()
+        counters.tick(1.0, 0, 0)
+        self.now += 2.0
+        counters.pause()
+        # Time stopped is not accounted
+        self.now += 10.0
+        self.assertAlmostEqual(counters.wall_time(), 2.0)
+        counters.resume()
+        self.now += 2.0
+        self.assertAlmostEqual(counters.realtime_factor(), 0.25)
+        # Still paused after a reset
+        counters.pause()
+        counters.reset()
+        self.now += 1.0
+        self.assertEqual(counters.wall_time(), 0.0)
+
+    def testDump(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            counters = telemetry.Telemetry(path, dump_period=1.0)
+            counters.tick(0.001, 10, 0)
+            self.now += 1.0
+            counters.tick(0.001, 10, 1)
+            counters.tick(0.001, 10, 0)
+            with open(path) as dump:
+                lines = dump.read().splitlines()
+        finally:
+            os.remove(path)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['io_changes'], 1)
+
+    def testProgram(self):
+        """Program used :
+               addi $1, $1, 1
+               sw $1, 0x10($0)      ; MOTOR_IO
+               j 0
+           The motor byte ends each synchronisation on another value
+        """
+        telemetry.clock = self.clock
+        path = write_program([0x20210001, 0xAC010010, 0x08000000])
+        try:
+            program = Program(VectorWorld(100, 100))
+            program.load(path)
+        finally:
+            os.remove(path)
+        counters = telemetry.Telemetry()
+        program.set_telemetry(counters)
+        memory = program.memory
+        changes = [0, 0]
+        for _ in xrange(10):
+            before = (memory[MOTOR_IO], memory[SENSOR_IO])
+            program.update()
+            for i, address in enumerate((MOTOR_IO, SENSOR_IO)):
+                changes[i] += memory[address] != before[i]
+        self.assertEqual(counters.ticks, 10)
+        self.assertEqual(counters.instructions, 10 * program.cpu_sample)
+        self.assertEqual(changes[0], 10)
+        self.assertEqual(counters.io_changes, sum(changes))
+        self.assertAlmostEqual(counters.simulated_time, 10 * program.synchronise_step)
+        self.assertTrue(counters.total["cpu"] > 0)
+        program.set_telemetry(None)
+        program.update()
+        self.assertEqual(counters.ticks, 10)
+
+
+class Test_control(unittest.TestCase):
+    """Program used :
+           addi $1, $1, 1
+           sw $1, 0x100($0)
+           j 0
+    """
+    WORDS = [0x20210001, 0xAC010100, 0x08000000]
+
+    def setUp(self):
+        self.path = write_program(self.WORDS)
+        self.program = Program(VectorWorld(100, 100))
+        self.server = control.ControlServer(self.program, ("127.0.0.1", 0))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = control.ControlClient(self.server.socket.getsockname())
+
+    def tearDown(self):
+        # The loop ends once the server and the connection are closed, the
+        # client is closed last to wake up the loop
+        self.server.close()
+        self.client.close()
+        self.thread.join(5)
+        os.remove(self.path)
+        self.assertFalse(self.thread.is_alive())
+
+    def testSession(self):
+        # Nothing to run before the load
+        self.assertRaises(control.ControlError, self.client.step, 1)
+        self.client.load(self.path)
+        self.assertEqual(self.program.cpu.program_size, 3)
+        state = self.client.step(4)
+        self.assertEqual((state['pc'], state['r'][1]), (4, 2))
+        self.assertEqual(state['time'], 0.0)
+        self.assertEqual(self.client.peek(0x100, 4), "\x01\x00\x00\x00")
+        self.client.poke(0x100, "\x10\x20")
+        self.assertEqual(self.program.memory[0x101], 0x20)
+        self.assertEqual(self.client.peek(0xFF, 4), "\x00\x10\x20\x00")
+        # Unknown command, the session goes on
+        with self.assertRaises(control.ControlError) as context:
+            self.client.request(control.frame(99))
+        self.assertEqual(str(context.exception), "unknown command 99")
+        # Several requests in a single round trip
+        regs, pose = self.client.request(control.frame(control.REGS), control.frame(control.POSE))
+        self.assertEqual(control.REGISTERS.unpack(regs)[:3], (4, 0, 2))
+        robot = self.program.robot
+        self.assertEqual(control.POSE_BLOCK.unpack(pose), (robot.pos_x, robot.pos_y, robot.rotation))
+        state = self.client.run_until(0.005)
+        self.assertAlmostEqual(state['time'], 0.005)
+
+    def testLoadWorld(self):
+        world = VectorWorld(120, 80)
+        world.add_segment(10, 10, 100, 70, 5)
+        fd, path = tempfile.mkstemp(suffix=".vw")
+        os.close(fd)
+        try:
+            world.save(path)
+            loaded = load_world(path)
+        finally:
+            os.remove(path)
+        self.assertEqual((loaded.width(), loaded.height()), (120, 80))
+        self.assertEqual(loaded.segments, world.segments)
+
+
+class Test_timer(unittest.TestCase):
+    """Program used :
+       loop:
+           lw $1, 0x30($0)      ; TIMER_COUNT
+           addi $1, $1, 500
+           sw $1, 0x34($0)      ; TIMER_COMPARE
+           sw $0, 0x38($0)      ; TIMER_SLEEP
+           addi $2, $2, 1
+           j loop
+    """
+    WORDS = [0x8C010030, 0x202101F4, 0xAC010034, 0xAC000038, 0x20420001, 0x08000000]
+
+    def setUp(self):
+        self.path = write_program(self.WORDS)
+        self.memory = Memory()
+        self.cpu = Cpu(self.memory)
+        self.cpu.load(self.path)
+        # A microsecond is 10 cycles
+        self.timer = Timer(self.memory, 10000000)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testSleep(self):
+        # Wakes up every 500us, it runs 6 instructions each time
+        executed = 0
+        for _ in xrange(10):
+            executed += self.timer.run(self.cpu, 10000)
+        self.assertEqual(self.cpu.r[2], 19)
+        self.assertEqual(executed, 4 + 19 * 6)
+        self.assertTrue(self.timer.sleeping)
+
+    def testCount(self):
+        # Refreshed at each synchronisation, even while sleeping
+        for i in xrange(1, 6):
+            self.timer.run(self.cpu, 3000)
+            self.assertEqual(self.memory.get_uword(TIMER_COUNT), i * 300)
+
+
+class SmallCapture(IoCapture):
+    BLOCK = 4
+    LEVELS = 2
+
+
+class Test_exactio(unittest.TestCase):
+    """Program used, the right motor phases written every 42 instructions :
+           addi $1, $0, phase
+           sw $1, 0x10($0)      ; MOTOR_IO
+           nop (x 40)
+       for the phases 1, 2, 4, 8 and 1, then j to itself
+       At 10kHz an instruction is 0.1ms, a synchronisation 100 instructions
+    """
+    PHASES = (1, 2, 4, 8, 1)
+    BLOCK = 42
+
+    def engines(self):
+        import emulator.cpu
+        import emulator.flatcpu
+        engines = [emulator.cpu.Cpu, emulator.flatcpu.Cpu]
+        if hasattr(Cpu, 'step_until_io') and Cpu not in engines:
+            engines.append(Cpu)
+        return engines
+
+    def run_engine(self, cpu_class, words):
+        path = write_program(words)
+        try:
+            program = Program(VectorWorld(100, 100), cpu_freq=10000, synchronise_freq=100,
+                              cpu_class=cpu_class, exact_io=True)
+            program.load(path)
+        finally:
+            os.remove(path)
+        # Motor state seen after each update from the I/O byte
+        robot = program.robot
+        motor = robot.motorR
+        calls = []
+        update_motors_io = robot.update_motors_io
+        def record(dt, io_byte):
+            update_motors_io(dt, io_byte)
+            calls.append((int(round(dt * program.cpu_freq)), io_byte,
+                          list(motor.magnets), motor.lastchange, motor.linear_speed))
+        robot.update_motors_io = record
+        program.update()
+        program.update()
+        return program, calls
+
+    def testEvents(self):
+        words = []
+        for phase in self.PHASES:
+            words += [0x20010000 | phase, 0xAC010010] + [0] * (self.BLOCK - 2)
+        words.append(0x08000000 | len(words))
+        speed = -Motor.SPEED_COEF * 10000.0 / self.BLOCK
+        for engine in self.engines():
+            program, calls = self.run_engine(engine, words)
+            # (instructions since the previous update, I/O byte, magnets)
+            self.assertEqual([call[:3] for call in calls],
+                             [(2, 1, [1, 0, 0, 0]), (42, 2, [0, 1, 0, 0]),
+                              (42, 4, [0, 0, 1, 0]), (14, 4, [0, 0, 1, 0]),
+                              (28, 8, [0, 0, 0, 1]), (42, 1, [1, 0, 0, 0]),
+                              (30, 1, [1, 0, 0, 0])])
+            # Each write resets the time since the last change, the speed is
+            # the one of a phase every 4.2ms, kept up to the synchronisations
+            for _, _, _, lastchange, linear_speed in calls[1:3] + calls[4:6]:
+                self.assertEqual(lastchange, 0)
+                self.assertAlmostEqual(linear_speed, speed)
+            self.assertAlmostEqual(calls[3][3], 0.0014)
+            self.assertAlmostEqual(calls[6][3], 0.003)
+            self.assertAlmostEqual(calls[6][4], speed)
+            self.assertAlmostEqual(program.time, 0.02)
+
+
+class Test_iocapture(unittest.TestCase):
+
+    def brute_force(self, samples, start, end):
+        window = samples[start:end]
+        if not window:
+            return None
+        return (reduce(lambda a, b: a & b, [a for a, _ in window]),
+                reduce(lambda a, b: a | b, [o for _, o in window]))
+
+    def testAppend(self):
+        rng = random.Random(8)
+        capture = SmallCapture(Memory(), (0x10, 0x21), 0.001, capacity=32)
+        samples = [[], []]
+        for i in xrange(100):
+            pairs = []
+            for channel in xrange(2):
+                value_and = rng.getrandbits(8)
+                pairs.append((value_and, value_and | rng.getrandbits(8)))
+                samples[channel].append(pairs[-1])
+            capture.append([a for a, _ in pairs], [o for _, o in pairs])
+            for channel in xrange(2):
+                # Block being filled at each level, from the blocks of the previous one
+                end = capture.count
+                for level, size in enumerate(capture.sizes):
+                    start = capture.count - capture.count % size
+                    acc = self.brute_force(samples[channel], start, end) or (0xFF, 0x00)
+                    end = start
+                    self.assertEqual((capture.acc_and[channel][level], capture.acc_or[channel][level]), acc)
+        # Only the last capacity samples are kept
+        self.assertEqual(capture.first(), 68)
+        self.assertEqual(capture.sample(1, 99), samples[1][99])
+        for _ in xrange(200):
+            start = rng.randrange(-5, 105)
+            end = rng.randrange(start, 106)
+            self.assertEqual(capture.summary(0, start, end),
+                             self.brute_force(samples[0], max(start, 68), min(end, 100)))
+        # Constant values
+        capture.append([1, 2])
+        self.assertEqual(capture.sample(1, 100), (2, 2))
+
+    def testColumns(self):
+        capture = SmallCapture(Memory(), (0x10,), 0.001, capacity=64)
+        for i in xrange(64):
+            capture.append([1 << (i % 8)])
+        columns = capture.columns(0, 0, 64, 4)
+        self.assertEqual(columns, [(0, 0xFF)] * 4)
+        self.assertEqual(capture.columns(0, 0, 2, 2), [(1, 1), (2, 2)])
+
+    def testWrites(self):
+        memory = Memory()
+        capture = IoCapture(memory, (MOTOR_IO, SENSOR_IO), 0.0001)
+        self.assertEqual(capture.io_range, (MOTOR_IO, SENSOR_IO + 1))
+        # A pulse in the third sample, the other byte of the word ignored
+        capture.write(0.00025, MOTOR_IO - 1, 0x0500)
+        capture.write(0.00028, MOTOR_IO, 0)
+        memory.set_byte(SENSOR_IO, 0x7F)
+        capture.update(0.001)
+        self.assertEqual(capture.count, 10)
+        self.assertEqual([capture.sample(0, i) for i in xrange(4)], [(0, 0), (0, 0), (0, 5), (0, 0)])
+        # Written by the robot modules at the synchronisation, the next sample
+        self.assertEqual(capture.sample(1, 9), (0, 0))
+        capture.update(0.001)
+        self.assertEqual(capture.sample(1, 10), (0x7F, 0x7F))
+
+    def testProgram(self):
+        """Program used :
+               addi $1, $0, 0xFF
+           loop:
+               sw $1, 0x10($0)   ; pulse between two synchronisations
+               sw $0, 0x10($0)
+               j loop
+        """
+        path = write_program([0x200100FF, 0xAC010010, 0xAC000010, 0x08000001])
+        try:
+            program = Program(VectorWorld(100, 100))
+            program.load(path)
+        finally:
+            os.remove(path)
+        capture = IoCapture(program.memory, (MOTOR_IO, SENSOR_IO), program.synchronise_step / 10)
+        program.set_capture(capture)
+        for _ in xrange(3):
+            program.update()
+        self.assertEqual(program.memory[MOTOR_IO], 0)
+        self.assertEqual(capture.count, 30)
+        self.assertEqual(capture.summary(0, 0, 30), (0, 0xFF))
+        program.set_capture(None)
+        self.assertEqual(program.robot.modules, [program.line_sensor])
+
+
+class Test_hotswap(unittest.TestCase):
+    # Source of tests/store.mips
+    SOURCE = """    ori $1, $0, 0x42
+loop:
+    sw $1, 0x10($0)   ; comment: not a label
+    lw $2, 0x10($0)
+    addi $1, $1, 1
+    j loop
+"""
+
+    def testLabels(self):
+        source = "start: ori $1, $0, 1\n\n; only a comment\nloop:\n  j loop\na: b: j a\n"
+        self.assertEqual(hotswap.labels(source), ({"start": 0, "loop": 1, "a": 2, "b": 2}, 3))
+        self.assertEqual(hotswap.labels(self.SOURCE), ({"loop": 1}, 5))
+
+    def testRemap(self):
+        old = {"start": 0, "loop": 2, "end": 6}
+        # Same program
+        self.assertEqual(hotswap.remap(4, old, old, 8), 4)
+        # Instruction inserted before the block of the pc
+        self.assertEqual(hotswap.remap(4, old, {"start": 0, "loop": 3, "end": 7}, 9), 5)
+        # Instructions removed before the block of the pc
+        self.assertEqual(hotswap.remap(4, old, {"start": 0, "loop": 1, "end": 5}, 7), 3)
+        # Block of the pc shortened to two instructions, the pc stays in it
+        self.assertEqual(hotswap.remap(5, old, {"start": 0, "loop": 2, "end": 4}, 6), 3)
+        # Label of the block removed, the previous one is used
+        self.assertEqual(hotswap.remap(4, old, {"start": 0, "end": 6}, 8), 4)
+        # No label before the pc
+        self.assertEqual(hotswap.remap(1, old, {"end": 1}, 3), 1)
+
+    def testHotSwap(self):
+        program = Program(VectorWorld(100, 100))
+        program.load("emulator/tests/store.mips")
+        program.cpu.step(3)
+        self.assertEqual(program.cpu.get_pc(), 0xc)
+        # Instruction inserted before loop, j loop moved with it
+        with open("emulator/tests/store.mips", "rb") as fd:
+            words = list(struct.unpack("<5I", fd.read()))
+        words = words[:1] + [0] + words[1:4] + [(0x02 << 26) | 2]
+        source = self.SOURCE.replace("loop:", "    nop\nloop:")
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, struct.pack("<6I", *words))
+            os.close(fd)
+            self.assertRaises(hotswap.HotSwapError, hotswap.hot_swap, program, path,
+                              self.SOURCE.replace("    j loop\n", ""), source)
+            self.assertRaises(hotswap.HotSwapError, hotswap.hot_swap, program, path,
+                              self.SOURCE, self.SOURCE)
+            self.assertEqual(hotswap.hot_swap(program, path, self.SOURCE, source), 0x10)
+        finally:
+            os.remove(path)
+        program.cpu.step(4)
+        self.assertEqual(program.cpu.r[1], 0x43)
+        self.assertEqual(program.memory[0x10], 0x43)
+
+
+class Test_render(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.poses = tempfile.mkstemp(suffix=".poses")
+        os.close(fd)
+        world = VectorWorld(200, 150)
+        world.add_segment(50, 0, 50, 150, 10)
+        program = Program(world)
+        program.load(LINETRACER)
+        recorder = render.PoseRecorder(program.robot, self.poses, fps=50)
+        program.robot.modules.append(recorder)
+        robot = program.robot
+        # Pose seen by the modules at each update, before the robot moves
+        self.history = []
+        try:
+            while program.time < 0.2:
+                self.history.append((robot.pos_x, robot.pos_y, robot.rotation))
+                program.update()
+        finally:
+            recorder.close()
+
+    def tearDown(self):
+        os.remove(self.poses)
+
+    def testPoses(self):
+        fps, poses = render.read_poses(self.poses)
+        self.assertEqual(fps, 50)
+        # A frame at 0, then one every 20ms
+        self.assertEqual(len(poses), 11)
+        self.assertEqual(poses[0], self.history[0])
+        for pose in poses:
+            self.assertTrue(pose in self.history)
+        self.assertRaises(ValueError, render.read_poses, LINETRACER)
+
+    @unittest.skipIf(QtGui is None, "PyQt4 is not available")
+    def testRaw(self):
+        fd, output = tempfile.mkstemp(suffix=".raw")
+        os.close(fd)
+        try:
+            self.assertEqual(render.render("ressources/car.png", self.poses, output, -1, 2), 11)
+            size = QtGui.QImage("ressources/car.png").size()
+            self.assertEqual(os.path.getsize(output), 11 * size.width() * size.height() * 3)
+        finally:
+            os.remove(output)
+
+
+class Test_replay(unittest.TestCase):
+
+    def testReplay(self):
+        world = VectorWorld(200, 150)
+        world.add_segment(50, 0, 50, 150, 10)
+        fd, path = tempfile.mkstemp(suffix=".io")
+        os.close(fd)
+        try:
+            replay.record(LINETRACER, world, path, 0.1)
+            recording = replay.Recording(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(recording), 100)
+        # The motors change during the run
+        self.assertTrue(len(set(recording.motors)) > 1)
+        memory = Memory()
+        cpu = Cpu(memory)
+        cpu.load(LINETRACER)
+        motors = replay.replay(cpu, recording)
+        self.assertEqual(recording.compare(motors), (0, None))
+        motors[50] ^= 0xFF
+        self.assertEqual(recording.compare(motors), (1, 50))
+
+    def testTimer(self):
+        program = Program(VectorWorld(100, 100), timer=True)
+        self.assertRaises(ValueError, replay.IoRecorder, program, os.devnull)
+
+
+@unittest.skipIf(distancefield is None, "numpy is not available")
+class Test_distancefield(unittest.TestCase):
+
+    def testTransform(self):
+        rng = random.Random(0)
+        mask = numpy.zeros((30, 40), dtype=bool)
+        for _ in xrange(6):
+            mask[rng.randrange(30), rng.randrange(40)] = True
+        field = distancefield.distance_transform(mask, 10)
+        points = zip(*numpy.nonzero(mask))
+        for y in xrange(30):
+            for x in xrange(40):
+                distance = min(((x - px) ** 2 + (y - py) ** 2) ** 0.5 for py, px in points)
+                self.assertAlmostEqual(field[y, x], min(distance, 10), places=4)
+
+    def testUpdate(self):
+        world = VectorWorld(200, 150)
+        world.add_segment(20, 20, 180, 30, 6)
+        field = distancefield.DistanceField(world, 16)
+        # Strokes drawn afterward, as the GUI reports them
+        for x0, y0, x1, y1, thickness in ((50, 140, 60, 60, 4), (190, 5, 195, 140, 8)):
+            world.add_segment(x0, y0, x1, y1, thickness)
+            field.update((min(x0, x1) - thickness, min(y0, y1) - thickness,
+                          max(x0, x1) + thickness + 1, max(y0, y1) + thickness + 1))
+            rebuilt = distancefield.DistanceField(world, 16)
+            self.assertTrue(numpy.array_equal(field.mask, rebuilt.mask))
+            self.assertTrue(numpy.array_equal(field.field, rebuilt.field))
+            self.assertEqual(field.line_count, rebuilt.line_count)
+            self.assertAlmostEqual(field.centroid[0], rebuilt.centroid[0])
+            self.assertAlmostEqual(field.centroid[1], rebuilt.centroid[1])
+
+    def testControlScore(self):
+        world = VectorWorld(200, 150)
+        world.add_segment(50, 0, 50, 150, 10)
+        program = Program(world)
+        program.load(LINETRACER)
+        controller = control.Controller(program)
+        status, _ = control.HEADER.unpack_from(controller.execute(control.SCORE, ""))
+        self.assertEqual(status, control.ERROR)
+        program.set_scoring(distancefield.DistanceField(world))
+        for _ in xrange(100):
+            program.update()
+        reply = controller.execute(control.SCORE, "")
+        status, size = control.HEADER.unpack_from(reply)
+        self.assertEqual(status, control.OK)
+        score = dict(zip(control.SCORE_KEYS, control.SCORE_BLOCK.unpack(reply[control.HEADER.size:])))
+        self.assertAlmostEqual(score["time"], 0.1)
+        self.assertEqual(score, program.score.results())
+
+
+if __name__ == '__main__':
+    unittest.main()
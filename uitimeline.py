@@ -0,0 +1,120 @@
+from PyQt4 import QtCore, QtGui
+
+# (label, channel, bit) of the plotted signals, channel 0 being the motors
+# byte and channel 1 the sensors one
+SIGNALS = ([("MR " + name, 0, bit) for bit, name in enumerate(("A", "B", "An", "Bn"))] +
+           [("ML " + name, 0, bit + 4) for bit, name in enumerate(("A", "B", "An", "Bn"))] +
+           [("S{}".format(bit), 1, bit) for bit in xrange(7)])
+
+class UiTimeline(QtGui.QWidget):
+    """Logic analyzer view of an IoCapture
+       Wheel zooms around the cursor, dragging pans, double click goes back
+       to following the last samples
+    """
+    ROW_HEIGHT = 14
+    LABEL_WIDTH = 50
+    # Number of samples displayed at start
+    DEFAULT_LENGTH = 2000
+
+    def __init__(self, parent=None):
+        super(UiTimeline, self).__init__(parent)
+        self.capture = None
+        self.view_end = 0
+        self.view_length = self.DEFAULT_LENGTH
+        # Keep the last samples in view
+        self.follow = True
+        self.drag_x = None
+        self.setMinimumHeight(self.ROW_HEIGHT * (len(SIGNALS) + 1))
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000/30)
+
+    def refresh(self):
+        if self.isVisible() and self.follow and self.capture is not None:
+            self.update()
+
+    def plot_width(self):
+        return max(self.width() - self.LABEL_WIDTH, 1)
+
+    def view(self):
+        """Return the (start, end) samples displayed"""
+        if self.follow and self.capture is not None:
+            self.view_end = self.capture.count
+        return self.view_end - self.view_length, self.view_end
+
+    def paintEvent(self, e):
+        qp = QtGui.QPainter()
+        qp.begin(self)
+        qp.fillRect(self.rect(), QtCore.Qt.black)
+        if self.capture is not None:
+            self.paint_signals(qp)
+        qp.end()
+
+    def paint_signals(self, qp):
+        capture = self.capture
+        start, end = self.view()
+        width = self.plot_width()
+        columns = [capture.columns(channel, start, end, width)
+                   for channel in xrange(len(capture.addresses))]
+        left = self.LABEL_WIDTH
+        h = self.ROW_HEIGHT
+        for row, (label, channel, bit) in enumerate(SIGNALS):
+            top = row * h + 2
+            bottom = (row + 1) * h - 2
+            qp.setPen(QtCore.Qt.white)
+            qp.drawText(2, bottom, label)
+            lines = []
+            for x, column in enumerate(columns[channel]):
+                if column is None:
+                    continue
+                high = (column[0] >> bit) & 1
+                low = not ((column[1] >> bit) & 1)
+                x += left
+                if high:
+                    lines.append(QtCore.QLineF(x, top, x + 1, top))
+                elif low:
+                    lines.append(QtCore.QLineF(x, bottom, x + 1, bottom))
+                else:
+                    # Both levels in the column
+                    lines.append(QtCore.QLineF(x, top, x, bottom))
+            qp.setPen(QtCore.Qt.green)
+            qp.drawLines(lines)
+        # Time axis
+        y = len(SIGNALS) * h + h - 2
+        qp.setPen(QtCore.Qt.white)
+        qp.drawText(left, y, "{:.3f}s".format(max(start, 0) * capture.period))
+        qp.drawText(self.width() - 80, y, "{:.3f}s".format(end * capture.period))
+
+    def wheelEvent(self, e):
+        start, end = self.view()
+        # Zoom around the cursor
+        x = min(max(e.x() - self.LABEL_WIDTH, 0), self.plot_width())
+        anchor = start + self.view_length * x / self.plot_width()
+        if e.delta() > 0:
+            length = max(self.view_length // 2, self.plot_width() // 4)
+        else:
+            length = min(self.view_length * 2, self.capture.capacity if self.capture else self.view_length)
+        self.view_end = anchor + (end - anchor) * length // self.view_length
+        self.view_length = length
+        if self.capture is not None and self.view_end < self.capture.count:
+            self.follow = False
+        self.update()
+
+    def mousePressEvent(self, e):
+        self.drag_x = e.x()
+
+    def mouseMoveEvent(self, e):
+        if self.drag_x is None:
+            return
+        self.view()
+        self.view_end -= (e.x() - self.drag_x) * self.view_length // self.plot_width()
+        self.drag_x = e.x()
+        self.follow = False
+        self.update()
+
+    def mouseReleaseEvent(self, e):
+        self.drag_x = None
+
+    def mouseDoubleClickEvent(self, e):
+        self.follow = True
+        self.update()
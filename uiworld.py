@@ -1,5 +1,41 @@
+from timeit import default_timer as clock
 from PyQt4 import QtCore, QtGui
 
+class ImageView():
+    """World map reading an ARGB32 QImage through a numpy array sharing
+       its pixels : no copy and no Qt call per pixel
+       refresh() must be called after the image is modified, the array is
+       rebuilt if Qt reallocated the pixels (detach of a shared image)
+    """
+    def __init__(self, image):
+        self.image = image
+        self.address = None
+        self.refresh()
+
+    def refresh(self):
+        image = self.image
+        if int(image.constBits()) == self.address:
+            return
+        import numpy
+        # bits() detaches a shared image, the address is read afterward
+        bits = image.bits()
+        bits.setsize(image.byteCount())
+        rows = numpy.frombuffer(bits, dtype=numpy.uint32).reshape(
+            image.height(), image.bytesPerLine() // 4)
+        # (height, width) array of the ARGB pixels
+        self.pixels = rows[:, :image.width()]
+        self.address = int(image.constBits())
+
+    def width(self):
+        return self.image.width()
+
+    def height(self):
+        return self.image.height()
+
+    def pixel(self, x, y):
+        return self.pixels.item(int(y), int(x))
+
+
 class UiWorld(QtGui.QWidget):
     """Qt widget representing the world
     """
@@ -9,35 +45,81 @@ class UiWorld(QtGui.QWidget):
         self.image = QtGui.QImage(800, 600, QtGui.QImage.Format_ARGB32)
         self.image.fill(QtCore.Qt.white)
         self.pen = QtGui.QPen(QtCore.Qt.black, 10, QtCore.Qt.SolidLine)
+        # World map given to the simulation : the image, read through a
+        # numpy view when numpy is available
+        try:
+            self.world_map = ImageView(self.image)
+        except ImportError:
+            self.world_map = self.image
+        # Callbacks called with the (left, top, right, bottom) area of the
+        # image which changed, or None when it is fully redrawn
+        self.listeners = []
         # Create a timer to refresh the image
         self.timer = QtCore.QTimer(self)
         self.timer.timeout.connect(self.update)
         self.timer.start(1000/60)
         self.robot = None
+        # Sprite path -> QPixmap
+        self.sprites = {}
+        # Telemetry displayed as an overlay (None to hide it)
+        self.telemetry = None
 
     def clear(self):
         self.image.fill(QtCore.Qt.white)
+        self.changed(None)
+
+    def changed(self, rect):
+        if self.world_map is not self.image:
+            self.world_map.refresh()
+        for listener in self.listeners:
+            listener(rect)
 
     def paintEvent(self, e):
+        if self.telemetry is None:
+            self.paint(e)
+        else:
+            start = clock()
+            self.paint(e)
+            self.telemetry.record("paint", clock() - start)
+            self.telemetry.frames += 1
+
+    def paint(self, e):
         qp = QtGui.QPainter()
         qp.begin(self)
         qp.drawImage(e.rect(), self.image, e.rect())
         if self.robot is not None:
             # Rotate the robot sprite before drawing it
-            rot_sprite = QtGui.QPixmap(self.robot.sprite.size())
+            sprite = self.sprites.get(self.robot.sprite)
+            if sprite is None:
+                sprite = self.sprites[self.robot.sprite] = QtGui.QPixmap(self.robot.sprite)
+            rot_sprite = QtGui.QPixmap(sprite.size())
             rot_sprite.fill(QtCore.Qt.transparent)
             rp = QtGui.QPainter()
             rp.begin(rot_sprite)
             rp.translate(self.robot.half_width, self.robot.half_height)
             rp.rotate(-self.robot.rotation)
             rp.translate(-self.robot.half_width, -self.robot.half_height)
-            rp.drawPixmap(0, 0, self.robot.sprite)
+            rp.drawPixmap(0, 0, sprite)
             rp.end()
             qp.drawPixmap(self.robot.img_x(),
                 self.robot.img_y(),
                 rot_sprite)
+        if self.telemetry is not None:
+            self.paint_telemetry(qp)
         qp.end()
 
+    def paint_telemetry(self, qp):
+        """Draw the telemetry counters on top left corner"""
+        lines = self.telemetry.summary()
+        metrics = qp.fontMetrics()
+        height = metrics.height()
+        qp.fillRect(0, 0, 260, height * len(lines) + 4, QtGui.QColor(0, 0, 0, 160))
+        qp.setPen(QtCore.Qt.green)
+        y = height
+        for line in lines:
+            qp.drawText(4, y, line)
+            y += height
+
     def mousePressEvent(self, e):
         # Draw line on left click
         if e.button() == QtCore.Qt.LeftButton:
@@ -61,5 +143,11 @@ class UiWorld(QtGui.QWidget):
         painter = QtGui.QPainter(self.image)
         painter.setPen(self.pen)
         painter.drawLine(self.__last_point, pos)
+        painter.end()
+        margin = self.pen.width()
+        self.changed((min(self.__last_point.x(), pos.x()) - margin,
+                      min(self.__last_point.y(), pos.y()) - margin,
+                      max(self.__last_point.x(), pos.x()) + margin + 1,
+                      max(self.__last_point.y(), pos.y()) + margin + 1))
         self.__last_point = pos
         self.update()
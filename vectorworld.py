@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+from math import sqrt, ceil
+
+# Colors returned by pixel(), same values as the ARGB QImage world
+WHITE = 0xFFFFFFFF
+BLACK = 0xFF000000
+
+class VectorWorld():
+    """World map made of thick line segments
+       Segments are indexed in a sparse uniform grid : each cell lists the
+       segments passing near it, so a pixel() query only checks the segments
+       of a single cell and memory grows with the lines' length, not with
+       the world area. It provides the width()/height()/pixel() interface of
+       the QImage used by LineSensor and Robot.
+    """
+    CELL_SIZE = 32
+    # pixel() is exact at any coordinate, not constant over integer pixels
+    continuous = True
+
+    def __init__(self, width, height, cell_size=CELL_SIZE):
+        self._width = width
+        self._height = height
+        self.cell_size = float(cell_size)
+        self.clear()
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def clear(self):
+        # List of (x0, y0, x1, y1, half thickness)
+        self.segments = []
+        # (cell x, cell y) -> list of segment indexes
+        self.cells = {}
+
+    def add_segment(self, x0, y0, x1, y1, thickness):
+        """Add a line of the given thickness (with round ends)"""
+        index = len(self.segments)
+        half = thickness / 2.0
+        self.segments.append((x0, y0, x1, y1, half))
+        # Cut the segment in pieces no longer than a cell, each piece
+        # registers in the cells its bounding box (plus thickness) covers
+        cs = self.cell_size
+        length = sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+        pieces = max(1, int(ceil(length / cs)))
+        keys = set()
+        for i in xrange(pieces):
+            ax = x0 + (x1 - x0) * i / pieces
+            ay = y0 + (y1 - y0) * i / pieces
+            bx = x0 + (x1 - x0) * (i + 1) / pieces
+            by = y0 + (y1 - y0) * (i + 1) / pieces
+            for cx in xrange(int((min(ax, bx) - half) // cs), int((max(ax, bx) + half) // cs) + 1):
+                for cy in xrange(int((min(ay, by) - half) // cs), int((max(ay, by) + half) // cs) + 1):
+                    keys.add((cx, cy))
+        for key in keys:
+            self.cells.setdefault(key, []).append(index)
+
+    def is_on_line(self, x, y):
+        """Check if the point (x, y) is covered by a segment"""
+        cell = self.cells.get((int(x // self.cell_size), int(y // self.cell_size)))
+        if cell is None:
+            return False
+        for index in cell:
+            x0, y0, x1, y1, half = self.segments[index]
+            dx = x1 - x0
+            dy = y1 - y0
+            length2 = dx * dx + dy * dy
+            # Projection of the point on the segment, clamped to its ends
+            if length2 == 0:
+                t = 0
+            else:
+                t = max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / float(length2)))
+            px = x0 + t * dx - x
+            py = y0 + t * dy - y
+            if px * px + py * py <= half * half:
+                return True
+        return False
+
+    def pixel(self, x, y):
+        if self.is_on_line(x, y):
+            return BLACK
+        return WHITE
+
+    def paint(self, painter):
+        """Draw the segments with a QPainter (display only)"""
+        from PyQt4 import QtCore, QtGui
+        for x0, y0, x1, y1, half in self.segments:
+            painter.setPen(QtGui.QPen(QtCore.Qt.black, 2 * half, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap))
+            painter.drawLine(QtCore.QPointF(x0, y0), QtCore.QPointF(x1, y1))
+
+    def rasterize(self, image):
+        """Draw the world on a QImage (display only)"""
+        from PyQt4 import QtCore, QtGui
+        image.fill(QtCore.Qt.white)
+        painter = QtGui.QPainter(image)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+        self.paint(painter)
+        painter.end()
+
+    def save(self, path):
+        """Save the world as text : size then a segment per line"""
+        with open(path, "w") as fd:
+            fd.write("{} {}\n".format(self._width, self._height))
+            for x0, y0, x1, y1, half in self.segments:
+                fd.write("{!r} {!r} {!r} {!r} {!r}\n".format(x0, y0, x1, y1, 2 * half))
+
+    @classmethod
+    def load(cls, path, cell_size=CELL_SIZE):
+        """Create a world from a file written by save()"""
+        with open(path) as fd:
+            # Sizes are pixel counts, like the ones of a QImage
+            width, height = [int(float(v)) for v in fd.readline().split()]
+            world = cls(width, height, cell_size)
+            for line in fd:
+                if line.strip():
+                    world.add_segment(*[float(v) for v in line.split()])
+        return world